@@ -0,0 +1,235 @@
+import argparse
+import copy
+import socket
+import statistics
+import time
+from multiprocessing import Pipe, Process
+from threading import Lock, Thread
+import AR_OS_pb2 as pb
+from registry import load_registry, build_system
+from sharedmem import link_path, shmClient
+
+# Added to the registry ports so the benchmark can run alongside a simulator
+BENCH_PORT_OFFSET = 1000
+BENCH_COUNT = 20000
+# Round trips made before timing starts, so connection setup and first allocations are not measured
+BENCH_WARMUP = 1000
+BENCH_SYSTEM = 'EPS'
+BENCH_LINKS = ('lan', 'unix', 'shm')
+
+
+class benchSimulator:
+    """
+    Stand in for the simulator, the interfaces only need its time and step lock
+    """
+
+    def __init__(self):
+        self.time = 0
+        self.lock = Lock()
+
+
+class benchController:
+    """
+    Headless controller holding only what the benchmarked interfaces use, no display or simulation thread
+    """
+
+    def __init__(self):
+        self.systems = []
+        self.simulator = benchSimulator()
+
+
+class streamClient:
+    """
+    TCP or Unix domain socket client sending length prefixed messages, as AR-OS does
+    """
+
+    def __init__(self, family, address):
+        self.socket = socket.socket(family, socket.SOCK_STREAM)
+        if family == socket.AF_INET:
+            self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.socket.connect(address)
+        self.header = bytearray(4)
+
+    def recvInto(self, view):
+        received = 0
+        while received < len(view):
+            count = self.socket.recv_into(view[received:])
+            if count == 0:
+                raise ConnectionResetError("Simulator closed connection")
+            received += count
+
+    def request(self, msg: bytes):
+        self.socket.sendall(len(msg).to_bytes(4, 'little') + msg)
+        self.recvInto(memoryview(self.header))
+        response = bytearray(int.from_bytes(self.header, 'little'))
+        self.recvInto(memoryview(response))
+        return bytes(response)
+
+    def close(self):
+        self.socket.close()
+
+
+def connect_client(link, address):
+    """
+    Connects a client to the system at address over the given link, retrying until the simulator side is listening
+    """
+    for _ in range(100):
+        try:
+            if link == 'lan':
+                return streamClient(socket.AF_INET, ("127.0.0.1", address))
+            if link == 'unix':
+                return streamClient(socket.AF_UNIX, link_path(address, 'sock'))
+            return shmClient(address)
+        except (OSError, ValueError):
+            time.sleep(0.05)
+    raise ConnectionError(f"Could not connect to {address} over {link}")
+
+
+def run_client(link, address, messages, count, warmup, results):
+    """
+    Client side of a benchmark, run in its own process like AR-OS would be. Sends the round trip times back through
+    the results pipe.
+    """
+    client = connect_client(link, address)
+    for i in range(warmup):
+        client.request(messages[i % len(messages)])
+
+    times = []
+    for i in range(count):
+        msg = messages[i % len(messages)]
+        start = time.perf_counter()
+        client.request(msg)
+        times.append(time.perf_counter() - start)
+    client.close()
+    results.send(times)
+    results.close()
+
+
+def bench_link(link, messages, count=BENCH_COUNT, warmup=BENCH_WARMUP, system_key=BENCH_SYSTEM):
+    """
+    Serves one system over the given link and times count round trips of the messages (cycled through in order) from a
+    client in another process. Returns the round trip times in seconds.
+    """
+    controller = benchController()
+    entry = copy.deepcopy(next(entry for entry in load_registry()['systems'] if entry['key'] == system_key))
+    entry['link'] = link
+    system = build_system(controller, entry, BENCH_PORT_OFFSET)
+    controller.systems.append(system)
+
+    thread = Thread(target=system.run, args=(1,))
+    thread.start()
+
+    receiver, sender = Pipe(duplex=False)
+    client = Process(target=run_client, args=(link, system.port, messages, count, warmup, sender))
+    client.start()
+    try:
+        times = receiver.recv()
+    finally:
+        client.join()
+        system.interface.stop()
+        thread.join()
+    return times
+
+
+def bench_protocol(commands, count=BENCH_COUNT, system_key=BENCH_SYSTEM):
+    """
+    Times the CPU cost of answering each command in process, with no socket involved. Each command is handled count
+    times through handle_message (building and serializing a response, as every reply used to be) and through
+    handle_frame (the path the links use). Returns [(command, message path seconds, frame path seconds)] per request.
+    """
+    controller = benchController()
+    entry = next(entry for entry in load_registry()['systems'] if entry['key'] == system_key)
+    system = build_system(controller, entry, BENCH_PORT_OFFSET)
+    controller.systems.append(system)
+    interface = system.interface
+
+    results = []
+    for command in commands:
+        msg = pb.AROS_Command()
+        msg.command = command
+        msg = msg.SerializeToString()
+
+        start = time.perf_counter()
+        for _ in range(count):
+            response = interface.handle_message(msg)
+            len(response).to_bytes(4, 'little')
+        message_time = (time.perf_counter() - start) / count
+
+        start = time.perf_counter()
+        for _ in range(count):
+            interface.handle_frame(msg)
+        frame_time = (time.perf_counter() - start) / count
+        results.append((command, message_time, frame_time))
+    return results
+
+
+def report_protocol(results):
+    print(f"{'command':<24}{'message':>10}{'frame':>10}{'saving':>10}")
+    for command, message_time, frame_time in results:
+        saving = (1 - frame_time / message_time) * 100
+        print(f"{pb.COMMAND.Name(command):<24}{message_time * 1e6:>10.2f}{frame_time * 1e6:>10.2f}{saving:>9.0f}%")
+
+
+def summarize(times):
+    """
+    Returns (mean, p50, p99, max) of a list of times, in microseconds
+    """
+    ordered = sorted(times)
+    return (statistics.fmean(ordered) * 1e6, ordered[len(ordered) // 2] * 1e6,
+            ordered[int(len(ordered) * 0.99)] * 1e6, ordered[-1] * 1e6)
+
+
+def report(name, times, baseline=None):
+    """
+    Prints one line of results, with the speed up over the baseline's mean if given
+    """
+    mean, p50, p99, longest = summarize(times)
+    line = f"{name:<24}{mean:>10.1f}{p50:>10.1f}{p99:>10.1f}{longest:>10.1f}"
+    if baseline is not None:
+        line += f"{summarize(baseline)[0] / mean:>10.2f}x"
+    print(line)
+
+
+# Command mix sent in each benchmark, a ping and the EPS single value, mode and setter requests
+BENCH_COMMANDS = (pb.COMMAND.GEN_PING, pb.COMMAND.EPS_GET_CHARGE, pb.COMMAND.GEN_GET_VOLTAGE, pb.COMMAND.EPS_GET_PS,
+                  pb.COMMAND.EPS_SET_PS_ON)
+
+
+def bench_messages():
+    """
+    Serialized AROS_Command for each command in the benchmark mix
+    """
+    messages = []
+    for command in BENCH_COMMANDS:
+        msg = pb.AROS_Command()
+        msg.command = command
+        messages.append(msg.SerializeToString())
+    return messages
+
+
+if __name__ == "__main__":
+    """
+    Measures round trip latency to a system over each link, e.g. python benchmark.py --count 50000 --links lan shm,
+    or with --protocol the CPU time spent answering each command
+    """
+    parser = argparse.ArgumentParser(description="AR-OS Simulator interface latency benchmark")
+    parser.add_argument('--count', type=int, default=BENCH_COUNT, help="timed round trips per link")
+    parser.add_argument('--links', nargs='+', default=list(BENCH_LINKS), choices=BENCH_LINKS,
+                        help="links to compare, the first is the baseline")
+    parser.add_argument('--protocol', action='store_true',
+                        help="time handling each command in process instead, microseconds of CPU per request")
+    args = parser.parse_args()
+
+    if args.protocol:
+        print(f"CPU time per request to {BENCH_SYSTEM}, {args.count} requests per command, microseconds")
+        report_protocol(bench_protocol(BENCH_COMMANDS, args.count))
+    else:
+        messages = bench_messages()
+        print(f"Round trip latency to {BENCH_SYSTEM}, {args.count} requests per link, microseconds")
+        print(f"{'link':<24}{'mean':>10}{'p50':>10}{'p99':>10}{'max':>10}{'speed up':>11}")
+        baseline = None
+        for link in args.links:
+            times = bench_link(link, messages, args.count)
+            report(link, times, baseline)
+            if baseline is None:
+                baseline = times
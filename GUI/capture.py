@@ -0,0 +1,117 @@
+import os
+import struct
+import time
+from threading import Lock
+
+# Capture file settings
+CAPTURE_DIR = "TTC_output"
+CAPTURE_MAGIC = b'AROSCAP1'
+CAPTURE_RECORD = struct.Struct('<BHIddI')  # kind, port, connection, monotonic time, sim time, payload length
+CAPTURE_BUFFER = 1 << 16  # Bytes gathered before each write to disk, so capturing costs few system calls
+
+# Kinds of record, a request holds the serialized AROS_Command, a response every frame sent back for it (length
+# prefixes included, some commands reply with several frames) and a close marks a client disconnecting
+CAPTURE_REQUEST = 0
+CAPTURE_RESPONSE = 1
+CAPTURE_CLOSE = 2
+
+
+def capture_path(directory=CAPTURE_DIR):
+    return os.path.join(directory, f'capture_{time.strftime("%d-%m-%y_%H-%M-%S")}.cap')
+
+
+class captureWriter:
+    """
+    Records every command AR-OS sends the simulator's ports and every response sent back, so a real AR-OS session can
+    be replayed later without AR-OS (see replay.py). Each record is a fixed header followed by the raw bytes, timed by
+    the monotonic clock along with the sim time it was handled at.
+
+    Shared by every interface, each client connection is numbered the first time it is seen so the replay can give each
+    its own connection again. Subscription and bulk transfer pushes are not responses to a request and are left out.
+    """
+
+    def __init__(self, path=None):
+        self.path = path if path is not None else capture_path()
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self.file = open(self.path, 'wb', buffering=CAPTURE_BUFFER)
+        self.file.write(CAPTURE_MAGIC)
+        # Held while writing, interfaces handle requests on several threads
+        self.lock = Lock()
+        # connection: number it is recorded under
+        self.connections = {}
+        self.next_connection = 1
+        self.records = 0
+
+    def connection_id(self, connection):
+        """
+        Number of a connection, 0 for requests handled without one. Called with the lock held.
+        """
+        if connection is None:
+            return 0
+        number = self.connections.get(connection)
+        if number is None:
+            number = self.connections[connection] = self.next_connection
+            self.next_connection += 1
+        return number
+
+    def record(self, interface, connection, received, request, buffers):
+        """
+        Writes one request, received at perf_counter time received, and the buffers of its response
+        """
+        sim_time = interface.controller.simulator.time
+        sent = time.perf_counter()
+        self.lock.acquire()
+        if self.file is not None:
+            number = self.connection_id(connection)
+            self.file.write(CAPTURE_RECORD.pack(CAPTURE_REQUEST, interface.address, number, received, sim_time,
+                                                len(request)))
+            self.file.write(request)
+            self.file.write(CAPTURE_RECORD.pack(CAPTURE_RESPONSE, interface.address, number, sent, sim_time,
+                                                sum(len(buffer) for buffer in buffers)))
+            for buffer in buffers:
+                self.file.write(buffer)
+            self.records += 1
+        self.lock.release()
+
+    def forget(self, interface, connection):
+        """
+        Marks a connection as closed, a later connection gets a number of its own
+        """
+        self.lock.acquire()
+        number = self.connections.pop(connection, None)
+        if self.file is not None and number is not None:
+            self.file.write(CAPTURE_RECORD.pack(CAPTURE_CLOSE, interface.address, number, time.perf_counter(),
+                                                interface.controller.simulator.time, 0))
+        self.lock.release()
+
+    def close(self):
+        """
+        Flush on shutdown hook, writes what is buffered and closes the file. Safe to call more than once.
+        """
+        self.lock.acquire()
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        self.lock.release()
+
+
+def read_capture(path):
+    """
+    Yields every record of a capture file as (kind, port, connection, time, sim time, payload). A record cut short,
+    e.g. by the simulator being killed while capturing, ends the file.
+    """
+    f = open(path, 'rb')
+    try:
+        if f.read(len(CAPTURE_MAGIC)) != CAPTURE_MAGIC:
+            raise ValueError(f"{path} is not a simulator capture file")
+        while True:
+            header = f.read(CAPTURE_RECORD.size)
+            if len(header) < CAPTURE_RECORD.size:
+                return
+            kind, port, connection, moment, sim_time, length = CAPTURE_RECORD.unpack(header)
+            payload = f.read(length)
+            if len(payload) < length:
+                return
+            yield kind, port, connection, moment, sim_time, payload
+    finally:
+        f.close()
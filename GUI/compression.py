@@ -0,0 +1,115 @@
+import lzma
+import zlib
+import AR_OS_pb2 as pb
+
+# Level used for each method when a client does not ask for one, and the levels each accepts
+COMPRESSION_LEVELS = {
+    pb.COMPRESSION.ZLIB: (6, range(0, 10)),
+    pb.COMPRESSION.LZMA: (3, range(0, 10)),
+}
+# Largest payload a compressed byte_string may expand to, so a bad or hostile message cannot exhaust memory
+MAX_PAYLOAD = 16 << 20
+# Every zlib sync flush ends with these bytes, they are left off the wire and put back before decompressing
+SYNC_MARKER = b'\x00\x00\xff\xff'
+
+
+def negotiate(compression, level=None):
+    """
+    Returns the (compression, level) the simulator agrees to for what a client asked for, no compression for a method
+    it does not support and the nearest supported level for one out of range
+    """
+    if compression not in COMPRESSION_LEVELS:
+        return pb.COMPRESSION.NONE, 0
+    default, levels = COMPRESSION_LEVELS[compression]
+    if level is None:
+        return compression, default
+    return compression, min(max(level, levels[0]), levels[-1])
+
+
+class zlibStream:
+    """
+    One direction of one stream compressed with raw deflate. Each message is sync flushed so it can be decompressed on
+    its own as soon as it arrives, while the window carries over from the messages before it, so small repeated
+    messages shrink to a few bytes once the stream has seen them.
+    """
+    __slots__ = ('compressor', 'decompressor')
+
+    def __init__(self, level):
+        self.compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+        self.decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+
+    def compress(self, data):
+        compressed = self.compressor.compress(data) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+        return compressed[:-len(SYNC_MARKER)]
+
+    def decompress(self, data):
+        try:
+            data = self.decompressor.decompress(data + SYNC_MARKER, MAX_PAYLOAD)
+        except zlib.error as e:
+            raise ValueError(f"Bad zlib payload: {e}")
+        if self.decompressor.unconsumed_tail:
+            raise ValueError(f"Payload expands past {MAX_PAYLOAD} bytes")
+        return data
+
+
+class lzmaStream:
+    """
+    One direction of one stream compressed with LZMA. LZMA cannot flush part way through a stream, so each message is
+    compressed on its own as a raw LZMA2 block with no container, both ends knowing the settings from the negotiation.
+    Slower than zlib but smaller for larger messages.
+    """
+    __slots__ = ('filters',)
+
+    def __init__(self, level):
+        self.filters = [{'id': lzma.FILTER_LZMA2, 'preset': level}]
+
+    def compress(self, data):
+        return lzma.compress(data, format=lzma.FORMAT_RAW, filters=self.filters)
+
+    def decompress(self, data):
+        decompressor = lzma.LZMADecompressor(format=lzma.FORMAT_RAW, filters=self.filters)
+        try:
+            data = decompressor.decompress(data, MAX_PAYLOAD)
+        except lzma.LZMAError as e:
+            raise ValueError(f"Bad lzma payload: {e}")
+        if not decompressor.eof:
+            raise ValueError(f"Payload truncated or expands past {MAX_PAYLOAD} bytes")
+        return data
+
+
+STREAMS = {pb.COMPRESSION.ZLIB: zlibStream, pb.COMPRESSION.LZMA: lzmaStream}
+
+
+class payloadCodec:
+    """
+    Compression negotiated on one connection, used the same way by the simulator and by a client. Every stream (e.g.
+    the health data, or the replies to TTC_GET_COMMAND) gets its own context the first time it is used, so history from
+    one kind of message does not dilute another's.
+
+    zlib streams carry state from message to message, both ends must see every message of a stream in order. The
+    simulator's connections always do, since they run over TCP, a Unix socket or shared memory.
+    """
+    __slots__ = ('compression', 'level', 'name', 'compressors', 'decompressors')
+
+    def __init__(self, compression, level):
+        self.compression = compression
+        self.level = level
+        self.name = f'{pb.COMPRESSION.Name(compression).lower()}-{level}'
+        # stream: context, one set for what this end sends and one for what it receives
+        self.compressors = {}
+        self.decompressors = {}
+
+    def compress(self, stream, data):
+        context = self.compressors.get(stream)
+        if context is None:
+            context = self.compressors[stream] = STREAMS[self.compression](self.level)
+        return context.compress(data)
+
+    def decompress(self, stream, data):
+        """
+        Raises ValueError if data is not a valid payload for the stream
+        """
+        context = self.decompressors.get(stream)
+        if context is None:
+            context = self.decompressors[stream] = STREAMS[self.compression](self.level)
+        return context.decompress(data)
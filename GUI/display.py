@@ -2,10 +2,15 @@ from abc import ABC, abstractmethod
 import PySimpleGUI as sg
 import numpy as np
 import time
-from systems import EPSState, ESPState, GNSS_ADCSState, GNSS_TRAIL_SIZE, ADCS_mode, TTC_mode, TTC_GS_status
+from threading import Thread
+from systems import EPSState, ESPState, GNSS_ADCSState, GNSS_TRAIL_SIZE, ADCS_mode, TTC_mode, TTC_GS_status, KINGSTON
 from globe import GLOBE
 
-KINGSTON = (-76.4930, 44.2334)
+# TTC console limits, lines printed per refresh and lines of history kept in the output box
+CONSOLE_LINES_PER_REFRESH = 200
+CONSOLE_HISTORY = 2000
+# Milliseconds the event loop waits for GUI events before checking if the simulator has been closed elsewhere
+DISPLAY_POLL = 50
 
 class displayController:
     """
@@ -23,6 +28,7 @@ class displayController:
         self.systemDisplays = []
         self.layoutControl = [[sg.Text('Systems')],
                               [sg.Button('Exit', key='-CLOSE-', size=(10, 1)), sg.Button('Simulator', key='-SIM-', size=(10, 1))],
+                              [sg.Button('Restart Ports', key='-RESTART-', size=(22, 1))],
                               [sg.Radio('Static Refresh', group_id=1, default=True, enable_events=True, key='-STATIC-'), sg.Radio('Auto Refresh', group_id=1, enable_events=True, key='-AUTO-')],
                               [sg.HorizontalSeparator()]
                               ]
@@ -37,14 +43,17 @@ class displayController:
         self.windowControl = sg.Window('Control', self.layoutControl, finalize=True)
 
         while True:  # The Event Loop
-            window, event, values = sg.read_all_windows()
+            window, event, values = sg.read_all_windows(timeout=DISPLAY_POLL)
 
+            if event == sg.TIMEOUT_EVENT:
+                # No GUI events, close the windows if the simulator was closed from outside the GUI (e.g. Ctrl+C)
+                if self.controller.close:
+                    self.closeWindows()
+                    return
             # Main check for if the primary window has been closed
-            if window == self.windowControl and (event == sg.WIN_CLOSED or event == '-CLOSE-'):
-                for display in self.systemDisplays:
-                    display.close()
-                self.windowControl.close()
-                self.controller.close = True
+            elif window == self.windowControl and (event == sg.WIN_CLOSED or event == '-CLOSE-'):
+                self.closeWindows()
+                self.controller.stop()
                 return
             # Check if main window clicked, if yes check for Radio button or generate appropriate sub window
             elif window == self.windowControl:
@@ -52,6 +61,9 @@ class displayController:
                     self.autoRefresh = True
                 elif event == '-STATIC-':
                     self.autoRefresh = False
+                elif event == '-RESTART-':
+                    # Restarted on its own thread so the GUI keeps responding while the ports come back up
+                    Thread(target=self.controller.restartInterfaces).start()
                 else:
                     for display in self.systemDisplays:
                         if event == f'-{display.name}-':
@@ -70,6 +82,11 @@ class displayController:
                         display.handleEvent(event, values)
                         break
 
+    def closeWindows(self):
+        for display in self.systemDisplays:
+            display.close()
+        self.windowControl.close()
+
     def addSystem(self, system, sysDisplay):
         # print(f"{system.name} added to Display")
         tempDisplay = sysDisplay(system)
@@ -87,7 +104,7 @@ class displayController:
             if self.windowControl is not None and self.autoRefresh:
                 for display in self.systemDisplays:
                     display.refresh()
-            time.sleep(1)
+            self.controller.shutdown.wait(1)
         print("Thread Refresher Closed")
 
 
@@ -140,6 +157,8 @@ class simulatorDisplay:
                         sg.Input(size=(16, 1), key='-INPUT_FOR-')],
                        [sg.Radio('Enable Real Time', group_id=1, enable_events=True, key='-RT_ON-'),
                         sg.Radio('Disable Real Time', group_id=1, default=True, enable_events=True, key='-RT_OFF-')],
+                       [sg.Checkbox('Lockstep (AR-OS steps time)', default=self.simulator.lockstep, enable_events=True,
+                                    key='-LOCKSTEP-')],
                        [sg.HorizontalSeparator()],
                        [sg.Text('Simulation Debugger:\t'), sg.Button('Show Debug', key='-DEBUG-', size=(16, 1))],
                        [sg.Text('Position:', key='-P-', visible=False),
@@ -260,6 +279,8 @@ class simulatorDisplay:
             self.simulator.realTime = True
         elif event == '-RT_OFF-':
             self.simulator.realTime = False
+        elif event == '-LOCKSTEP-':
+            self.simulator.lockstep = values['-LOCKSTEP-']
         self.refresh()
 
 
@@ -762,6 +783,8 @@ class ttcDisplay(subDisplay):
     Link for determing when to connect or not https://www.askpython.com/python/examples/find-distance-between-two-geo-locations
     """
     def generateLayoutBody(self):
+        # Number of lines currently held by the output box, reset since a new layout has an empty box
+        self.console_lines = 0
         options_mode = ('Off', 'Beaconing', 'Connecting', 'Established Data', 'Established Control', 'Broadcast No Connection', 'Disconnected')
 
         self.layout.append([[sg.Text('TTC:')],
@@ -785,9 +808,29 @@ class ttcDisplay(subDisplay):
             self.window['-HEALTH-'].update(f'{self.system.voltage} V\t{self.system.temp}°C\t Port Status: {"CONNECTED" if self.system.interface.connected else "NOT CONNECTED"}')
             self.window['-MODE-'].update(f'{self.system.mode.name}\t')
             self.window['-RANGE-'].update(f'{self.system.connection_radius} km\t')
-            if self.system.console_output != "":
-                self.window['-OUTPUT-'].print(self.system.console_output)
-                self.system.console_output = ""
+            self.updateConsole()
+
+    def updateConsole(self):
+        """
+        Prints the next lines waiting in the TTC console buffer, then trims the oldest lines from the output box so its
+        history, and the cost of redrawing it, stays constant over long sessions
+        """
+        lines, dropped = self.system.console.drain(CONSOLE_LINES_PER_REFRESH)
+        if not lines and not dropped:
+            return
+
+        text = [f'[{stamp}] {line}' for stamp, line in lines]
+        if dropped:
+            text.insert(0, f'[{dropped} console lines dropped]')
+        text = '\n'.join(text)
+        self.print_to_console(text)
+        self.console_lines += text.count('\n') + 1
+
+        if self.console_lines > CONSOLE_HISTORY:
+            # Delete the oldest lines straight from the Tk text widget, avoids rewriting the whole output box
+            excess = self.console_lines - CONSOLE_HISTORY
+            self.window['-OUTPUT-'].Widget.delete('1.0', f'{excess + 1}.0')
+            self.console_lines = CONSOLE_HISTORY
 
     def handleEvent(self, event, values):
         if event == sg.WIN_CLOSED or event == '-CLOSE-':
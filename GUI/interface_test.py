@@ -1,6 +1,16 @@
+import math
 import socket
+import sys
+import time
 import AR_OS_pb2 as pb
 import random
+import tempfile
+from threading import Lock
+from compression import payloadCodec
+from interfaces import SUCCESS_FRAME, encode_frame, interfaceLAN_Pi_VHF, singleEncoder, vectorEncoder
+from soak import SOAK_BOUNDS, SOAK_WARMUP_SAMPLES, analyse
+from systems import Pi_VHF
+from telemetry import healthStore
 
 HOST = "127.0.0.1"
 
@@ -302,6 +312,11 @@ class interface_testerLAN:
             rspString = self.recv()
             rsp.ParseFromString(rspString)
 
+            if rsp.response == pb.RESPONSE.PI_AUDIO_PENDING:
+                # Nothing new over VHF yet, the file is not finished until an empty PI_RETURN_AUDIO
+                time.sleep(0.01)
+                continue
+
             if rsp.HasField('byte_string'):
                 test_file += rsp.byte_string
 
@@ -317,6 +332,74 @@ class interface_testerLAN:
         f.close()
         print(f"{self.port}: Successfully saved file from Pi, finished testing download ")
 
+    def test_pi_VHF_bulk(self):
+        """
+        Test downloading the file from the Pi/VHF as one bulk transfer, with the Pi streaming chunks as they come in over
+        VHF and acknowledging them as they arrive rather than requesting each one
+
+        Set up in GUI the same as test_pi_VHF_file
+        """
+        print(f"{self.port}: Testing bulk download of file from Pi")
+        if not self.connected:
+            # Return if connection not established first
+            print(f"{self.port}: Could not test bulk download from Pi, not connected to in first place")
+            return
+
+        # Creates both protobuf objects
+        msg = pb.AROS_Command()
+        rsp = pb.Simulator_Response()
+
+        try:
+            msg.command = pb.COMMAND.PI_SET_ON
+            self.send(msg.SerializeToString())
+            rsp.ParseFromString(self.recv())
+            assert rsp.response == pb.RESPONSE.GEN_SUCCESS or rsp.response == pb.RESPONSE.GEN_ERROR
+        except:
+            print(f"{self.port}: Failed to set Pi to enabled for receiving, aborting")
+            return
+
+        try:
+            # Whole file, in chunks of up to 4 KB with 8 of them allowed ahead of the last ack
+            msg = pb.AROS_Command()
+            msg.command = pb.COMMAND.PI_GET_AUDIO_RANGE
+            msg.chunk_size = 4096
+            msg.window = 8
+            self.send(msg.SerializeToString())
+
+            test_file = bytearray()
+            # Chunks that arrived ahead of a missing one, offset: bytes
+            waiting = {}
+            length = None
+            while length is None or len(test_file) < length:
+                rsp.ParseFromString(self.recv())
+                if rsp.response == pb.RESPONSE.PI_AUDIO_RANGE:
+                    length = rsp.length
+                    print(f"{self.port}: Receiving {length} bytes in chunks of {rsp.chunk_size}, window {rsp.window}")
+                    continue
+                assert rsp.response == pb.RESPONSE.PI_RETURN_AUDIO_CHUNK
+                waiting[rsp.offset] = rsp.byte_string
+                while len(test_file) in waiting:
+                    test_file += waiting.pop(len(test_file))
+
+                # Cumulative ack of everything received in order
+                msg = pb.AROS_Command()
+                msg.command = pb.COMMAND.PI_ACK_AUDIO
+                msg.offset = len(test_file)
+                self.send(msg.SerializeToString())
+
+            # Chunks resent before the last ack arrived may still come in ahead of the final reply
+            rsp.ParseFromString(self.recv())
+            while rsp.response == pb.RESPONSE.PI_RETURN_AUDIO_CHUNK:
+                rsp.ParseFromString(self.recv())
+            assert rsp.response == pb.RESPONSE.GEN_SUCCESS
+
+            f = open('test_output/test_bulk.wav', 'wb')
+            f.write(test_file)
+            f.close()
+            print(f"{self.port}: Successfully saved file from Pi in one bulk transfer")
+        except Exception as e:
+            print(f"{self.port}: Failed bulk download from Pi: {e}")
+
     def test_adcs_vectors(self):
         """
         Test retriving vectors of data using the ADCS' PRY and AV commands
@@ -366,6 +449,179 @@ class interface_testerLAN:
             print(f"{self.port}: Failed to get angular velocities from ADCS: {e}")
 
 
+
+    def test_batch(self):
+        """
+        Test sending several commands to different systems in one batch and receiving all their responses in one frame
+        """
+        print(f"{self.port}: Testing batched commands")
+        if not self.connected:
+            # Return if connection not established first
+            print(f"{self.port}: Could not test batched commands, not connected to in first place")
+            return
+
+        # Creates both protobuf objects
+        msg = pb.AROS_Command()
+        rsp = pb.Simulator_Response()
+
+        try:
+            msg.command = pb.COMMAND.GEN_BATCH
+            # System specific commands are routed to the system that owns them
+            msg.batch.add().command = pb.COMMAND.GNSS_GET_POSI
+            msg.batch.add().command = pb.COMMAND.ADCS_GET_PRY
+            msg.batch.add().command = pb.COMMAND.EPS_GET_CHARGE
+            # Generic commands are routed by address, EPS is on port 8001
+            voltage = msg.batch.add()
+            voltage.command = pb.COMMAND.GEN_GET_VOLTAGE
+            voltage.address = 8001
+            msgString = msg.SerializeToString()
+            self.send(msgString)
+            rspString = self.recv()
+
+            rsp.ParseFromString(rspString)
+
+            assert rsp.response == pb.RESPONSE.GEN_RETURN_BATCH and len(rsp.batch) == 4
+            assert rsp.batch[0].response == pb.RESPONSE.GNSS_RETURN_POSI and rsp.batch[0].HasField('vector')
+            assert rsp.batch[1].response == pb.RESPONSE.ADCS_RETURN_PRY and rsp.batch[1].HasField('vector')
+            assert rsp.batch[2].response == pb.RESPONSE.EPS_RETURN_CHARGE and rsp.batch[2].HasField('single')
+            assert rsp.batch[3].response == pb.RESPONSE.GEN_RETURN_VOLTAGE and rsp.batch[3].HasField('single')
+            print(f"{self.port}: Successfully got position, PRY, charge {rsp.batch[2].single}% and voltage "
+                  f"{rsp.batch[3].single}V in one batch")
+        except Exception as e:
+            print(f"{self.port}: Failed to get batched responses: {e}")
+
+    def test_subscribe(self):
+        """
+        Test subscribing to the GNSS position and receiving it pushed as the simulation runs, without polling
+        """
+        print(f"{self.port}: Testing telemetry subscription")
+        if not self.connected:
+            # Return if connection not established first
+            print(f"{self.port}: Could not test subscription, not connected to in first place")
+            return
+
+        # Creates both protobuf objects
+        msg = pb.AROS_Command()
+        rsp = pb.Simulator_Response()
+
+        try:
+            msg.command = pb.COMMAND.GEN_SUBSCRIBE
+            msg.fields.append(pb.COMMAND.GNSS_GET_POSI)
+            # At most one push per 10 seconds of sim time
+            msg.interval = 10
+            self.send(msg.SerializeToString())
+            rsp.ParseFromString(self.recv())
+            assert rsp.response == pb.RESPONSE.GEN_SUBSCRIBED
+            subscription = rsp.subscription
+
+            # First push is sent straight away, the next once the satellite has moved
+            for i in range(2):
+                rsp.ParseFromString(self.recv())
+                assert rsp.response == pb.RESPONSE.GNSS_RETURN_POSI and rsp.subscription == subscription
+                print(f"{self.port}: Pushed position {rsp.vector.x}, {rsp.vector.y}, {rsp.vector.z}")
+
+            msg = pb.AROS_Command()
+            msg.command = pb.COMMAND.GEN_UNSUBSCRIBE
+            msg.subscription = subscription
+            self.send(msg.SerializeToString())
+            # Pushes already sent may arrive before the reply
+            rsp.ParseFromString(self.recv())
+            while rsp.HasField('subscription'):
+                rsp.ParseFromString(self.recv())
+            assert rsp.response == pb.RESPONSE.GEN_SUCCESS
+            print(f"{self.port}: Successfully subscribed to and unsubscribed from position")
+        except Exception as e:
+            print(f"{self.port}: Failed to subscribe to position: {e}")
+
+    def test_lockstep(self):
+        """
+        Test driving the simulation clock, needs the simulator started with --lockstep
+        """
+        print(f"{self.port}: Testing lockstep time steps")
+        if not self.connected:
+            # Return if connection not established first
+            print(f"{self.port}: Could not test lockstep, not connected to in first place")
+            return
+
+        # Creates both protobuf objects
+        msg = pb.AROS_Command()
+        rsp = pb.Simulator_Response()
+
+        try:
+            msg.command = pb.COMMAND.SIM_GET_TIME
+            self.send(msg.SerializeToString())
+            rsp.ParseFromString(self.recv())
+            assert rsp.response == pb.RESPONSE.SIM_TIME
+            start = rsp.time
+
+            # Time must not move on its own between requests
+            time.sleep(2)
+            self.send(msg.SerializeToString())
+            rsp.ParseFromString(self.recv())
+            assert rsp.time == start
+
+            msg = pb.AROS_Command()
+            msg.command = pb.COMMAND.SIM_STEP
+            msg.steps = 5
+            self.send(msg.SerializeToString())
+            rsp.ParseFromString(self.recv())
+            assert rsp.response == pb.RESPONSE.SIM_TIME and rsp.time > start
+            step = (rsp.time - start) / 5
+
+            msg = pb.AROS_Command()
+            msg.command = pb.COMMAND.SIM_ADVANCE_TO
+            msg.time = start + 100 * step
+            self.send(msg.SerializeToString())
+            rsp.ParseFromString(self.recv())
+            assert rsp.response == pb.RESPONSE.SIM_TIME and rsp.time == start + 100 * step
+            print(f"{self.port}: Successfully stepped simulation from {start}s to {rsp.time}s")
+        except Exception as e:
+            print(f"{self.port}: Failed to step simulation: {e}")
+
+    def test_compression(self):
+        """
+        Test negotiating zlib compression with the TTC and sending it compressed text, which needs TTC to be in
+        established mode to be accepted
+        """
+        print(f"{self.port}: Testing compressed byte strings")
+        if not self.connected:
+            # Return if connection not established first
+            print(f"{self.port}: Could not test compression, not connected to in first place")
+            return
+
+        # Creates both protobuf objects
+        msg = pb.AROS_Command()
+        rsp = pb.Simulator_Response()
+
+        try:
+            msg.command = pb.COMMAND.GEN_SET_COMPRESSION
+            msg.compression = pb.COMPRESSION.ZLIB
+            self.send(msg.SerializeToString())
+            rsp.ParseFromString(self.recv())
+            assert rsp.response == pb.RESPONSE.GEN_COMPRESSION and rsp.compression == pb.COMPRESSION.ZLIB
+            codec = payloadCodec(rsp.compression, rsp.level)
+            print(f"{self.port}: Negotiated {codec.name}")
+
+            # Repeated messages compress against the ones before them in the same stream
+            for i in range(3):
+                msg = pb.AROS_Command()
+                msg.command = pb.COMMAND.TTC_SEND_BYTE_STRING
+                msg.byte_string = codec.compress(msg.command, f"Compressed test message {i}".encode('utf-8'))
+                self.send(msg.SerializeToString())
+                rsp.ParseFromString(self.recv())
+                print(f"{self.port}: Sent message {i} in {len(msg.byte_string)} bytes, "
+                      f"{pb.RESPONSE.Name(rsp.response)}")
+
+            msg = pb.AROS_Command()
+            msg.command = pb.COMMAND.GEN_SET_COMPRESSION
+            msg.compression = pb.COMPRESSION.NONE
+            self.send(msg.SerializeToString())
+            rsp.ParseFromString(self.recv())
+            assert rsp.compression == pb.COMPRESSION.NONE
+            print(f"{self.port}: Successfully sent compressed messages and turned compression off")
+        except Exception as e:
+            print(f"{self.port}: Failed to test compression: {e}")
+
     def test_ttc_gc_comms(self):
         """
         Test the different comms method of TTC and GS
@@ -549,11 +805,174 @@ class interface_testerLAN:
 
 
 
+def test_encoders():
+    """
+    Checks the struct based encoders in interfaces.py give exactly the bytes AR_OS_pb2 does for single and vector
+    responses, and that their frames parse back to the same values. Needs no simulator running.
+    """
+    print("Testing single and vector encoders against protobuf")
+    values = (0, 1, -1, 0.1, 50, 12.0, -96.0, 73.25, 2000, 1e-45, 3.4e38, -3.4e38,
+              float('inf'), float('-inf'), float('nan'))
+    failures = 0
+
+    for response in pb.RESPONSE.values():
+        single = singleEncoder(response)
+        vector = vectorEncoder(response)
+        for i, value in enumerate(values):
+            xyz = (value, values[(i + 1) % len(values)], values[(i + 2) % len(values)])
+
+            # Single value, compare with protobuf's frame and parse back
+            rsp = pb.Simulator_Response()
+            rsp.response = response
+            rsp.single = value
+            frame = single.pack(value)
+            parsed = pb.Simulator_Response()
+            parsed.ParseFromString(frame[4:])
+            if frame != encode_frame(rsp) or parsed.response != response or \
+                    not (parsed.single == rsp.single or math.isnan(parsed.single) and math.isnan(rsp.single)):
+                failures += 1
+                print(f"Single encoder mismatch for {pb.RESPONSE.Name(response)} {value}")
+
+            # Vector, compare with protobuf's frame and parse back
+            rsp = pb.Simulator_Response()
+            rsp.response = response
+            rsp.vector.x, rsp.vector.y, rsp.vector.z = xyz
+            frame = vector.pack(*xyz)
+            parsed = pb.Simulator_Response()
+            parsed.ParseFromString(frame[4:])
+            if frame != encode_frame(rsp) or parsed.response != response or parsed.vector != rsp.vector and \
+                    not any(math.isnan(v) for v in xyz):
+                failures += 1
+                print(f"Vector encoder mismatch for {pb.RESPONSE.Name(response)} {xyz}")
+
+        try:
+            # Too big for a float, interfaces fall back to protobuf when the encoder refuses it
+            single.pack(1e39)
+            failures += 1
+            print(f"Single encoder accepted out of range value for {pb.RESPONSE.Name(response)}")
+        except OverflowError:
+            pass
+
+    if failures:
+        print(f"Encoders failed {failures} checks")
+    else:
+        print("Successfully checked encoders match protobuf")
+    assert failures == 0, f"Encoders failed {failures} checks"
+
+
+def test_health_store_runs():
+    """
+    Checks a health store queries both runs when sim time restarts at a time still above the last index entry of the
+    run before. Needs no simulator running.
+    """
+    print("Testing health store runs")
+    directory = tempfile.TemporaryDirectory()
+    store = healthStore(directory.name, index_interval=64)
+    for sim_time in range(100, 151):
+        store.append(sim_time, 0.0, b'first')
+    # Restarted, but still above the first run's only index entry at 100
+    for sim_time in range(120, 131):
+        store.append(sim_time, 0.0, b'second')
+    store.flush()
+
+    records = store.query(135, 140)
+    assert [(r[0], bytes(r[2])) for r in records] == [(t, b'first') for t in range(135, 141)], records
+    records = sorted((r[0], bytes(r[2])) for r in store.query(125, 128))
+    assert records == sorted([(t, b'first') for t in range(125, 129)] + [(t, b'second') for t in range(125, 129)]), \
+        records
+
+    # Reopened store carries on the second run
+    store.close()
+    store = healthStore(directory.name, index_interval=64)
+    store.append(131, 0.0, b'second')
+    store.flush()
+    assert [r[0] for r in store.query(129, 200) if bytes(r[2]) == b'second'] == [129, 130, 131]
+    store.close()
+    directory.cleanup()
+    print("Successfully checked health store runs")
+
+
+def test_soak_bounds():
+    """
+    Checks the soak report leaves a bounded series alone while it fills up to its bound and flags it once it holds more,
+    while an unbounded series growing the same way is flagged. Needs no simulator running.
+    """
+    print("Testing soak growth flags")
+    bound = SOAK_BOUNDS['gnss_trail']
+    samples = 10 + SOAK_WARMUP_SAMPLES
+    filling = [{'elapsed_s': i * 60.0, 'gnss_trail': i * bound // samples, 'threads': i} for i in range(samples)]
+    flags = {series: flagged for series, _, _, _, _, flagged in analyse(filling)}
+    assert flags == {'gnss_trail': False, 'threads': True}, flags
+
+    overrun = [dict(sample, gnss_trail=bound + i) for i, sample in enumerate(filling)]
+    flags = {series: flagged for series, _, _, _, _, flagged in analyse(overrun)}
+    assert flags['gnss_trail'], flags
+    print("Successfully checked soak growth flags")
+
+
+def test_audio_range_loss():
+    """
+    Checks a bulk audio transfer finishes with every chunk at its offset in the file when the VHF link loses packets
+    and goes down between passes. Needs no simulator running.
+    """
+    print("Testing audio range over a lossy link")
+    random.seed(1)
+
+    class stubSimulator:
+        lock = Lock()
+
+    class stubController:
+        simulator = stubSimulator()
+
+    pi = Pi_VHF('Pi_VHF', stubController())
+    pi.enabled = True
+    pi.vhf_link.loss = 0.2
+    pi.audio_data = bytes(random.getrandbits(8) for _ in range(20000))
+    interface = interfaceLAN_Pi_VHF(0, stubController(), pi)
+    connection = object()
+
+    aros_com = pb.AROS_Command()
+    aros_com.command = pb.COMMAND.PI_GET_AUDIO_RANGE
+    frames = interface.get_audio_range(aros_com, connection)[1:]
+    aros_com = pb.AROS_Command()
+    aros_com.command = pb.COMMAND.PI_ACK_AUDIO
+    received = bytearray()
+    now = 0.0
+    # 30 s passes with 20 s out of range between them
+    for step in range(200):
+        for frame in frames:
+            assert frame != SUCCESS_FRAME
+            sim_resp = pb.Simulator_Response()
+            sim_resp.ParseFromString(frame[4:])
+            assert sim_resp.response == pb.RESPONSE.PI_RETURN_AUDIO_CHUNK, sim_resp
+            assert sim_resp.offset == len(received), (sim_resp.offset, len(received))
+            received += sim_resp.byte_string
+        now += 10
+        pi.connected = step % 5 < 3
+        pi.step_link(now, 10)
+        aros_com.offset = len(received)
+        frames = interface.ack_audio(aros_com, connection)
+        if frames == [SUCCESS_FRAME]:
+            break
+    assert frames == [SUCCESS_FRAME], len(received)
+    assert bytes(received) == pi.audio_data
+    assert sum(p.lost for p in pi.vhf_link.passes) > 0
+    print("Successfully checked audio range over a lossy link")
+
+
 if __name__ == "__main__":
     """
     Tests the generic functionality of the interfaceLAN objects from interfaces.py.
-    Run this test code when simulation is already running.
+    Run this test code when simulation is already running, or as "python interface_test.py encoders" to only check
+    the response encoders, health store, soak report and audio transfer without a simulator.
     """
+    if sys.argv[1:] == ['encoders']:
+        test_encoders()
+        test_health_store_runs()
+        test_soak_bounds()
+        test_audio_range_loss()
+        sys.exit()
+
     test_systems = []
     # list of ports used by systems
     ports = (8001, 8002, 8003, 8004, 8005, 8006, 8007, 8008)
@@ -578,10 +997,21 @@ if __name__ == "__main__":
 
     #test_systems[4].test_pi_VHF_file()
 
+    #test_systems[4].test_pi_VHF_bulk()
+
     #test_systems[7].test_ttc_gc_comms()
 
+    #test_systems[7].test_compression()
+
+    # Needs the simulator started with --lockstep
+    #test_systems[0].test_lockstep()
+
     test_systems[6].test_adcs_vectors()
 
+    test_systems[7].test_batch()
+    # Needs the simulation running to push a second position
+    test_systems[3].test_subscribe()
+
     print("Finished Regular testing, Beginning sporadic Pinging")
 
     cnt = 0
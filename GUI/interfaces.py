@@ -1,10 +1,256 @@
 from abc import ABC, abstractmethod
+from functools import partial
+import os
+import select
 import socket
+import struct
+import time
+from threading import Event, Lock, Thread
 import AR_OS_pb2 as pb
+from google.protobuf.message import DecodeError
+from compression import negotiate, payloadCodec
+from metrics import portMetrics
+from sharedmem import link_path, shmChannel, shmSocket
 from systems import ESPState, ADCS_mode, TTC_mode
 
 HOST = "127.0.0.1"
 
+# Starting size of each LAN connection's receive buffer, grows to fit the largest message seen
+RECV_BUFFER_SIZE = 4096
+# sendmsg lets the length prefix and message be sent in one call without joining them, not available on Windows
+HAS_SENDMSG = hasattr(socket.socket, 'sendmsg')
+# Clients each LAN port serves at once unless the registry gives the system its own limit
+LAN_MAX_CLIENTS = 1
+# Longest a LAN port waits on a socket before checking whether it has been stopped, stop wakes it straight away so this
+# is only a fallback
+LAN_POLL = 1
+# Bulk audio transfers, chunk size in bytes and window in chunks given to a client that does not ask for its own, and
+# the most it can ask for
+AUDIO_CHUNK_SIZE = 1024
+AUDIO_CHUNK_MAX = 65536
+AUDIO_WINDOW = 16
+AUDIO_WINDOW_MAX = 256
+
+# Responses for each system mode, precomputed so mode requests are a single lookup
+ESP_MODE_RESPONSES = {
+    ESPState.OFF: pb.RESPONSE.ESP_OFF,
+    ESPState.WARMING: pb.RESPONSE.ESP_WARMING,
+    ESPState.READY: pb.RESPONSE.ESP_READY,
+    ESPState.BURNING: pb.RESPONSE.ESP_BURNING,
+    ESPState.COOLDOWN: pb.RESPONSE.ESP_COOL_DOWN,
+}
+ADCS_MODE_RESPONSES = {
+    ADCS_mode.OFF: pb.RESPONSE.ADCS_OFF,
+    ADCS_mode.DETUMBLING: pb.RESPONSE.ADCS_DE_TUMBLE,
+    ADCS_mode.SUN_POINTING: pb.RESPONSE.ADCS_SUN_POINT,
+}
+TTC_MODE_RESPONSES = {
+    TTC_mode.OFF: pb.RESPONSE.TTC_OFF,
+    TTC_mode.BEACONING: pb.RESPONSE.TTC_BEACONING,
+    TTC_mode.CONNECTING: pb.RESPONSE.TTC_CONNECTING,
+    TTC_mode.ESTABLISHED_DATA: pb.RESPONSE.TTC_ESTABLISHED_DATA,
+    TTC_mode.ESTABLISHED_CONT: pb.RESPONSE.TTC_ESTABLISHED_CONT,
+    TTC_mode.BROADCAST_NO_CON: pb.RESPONSE.TTC_BROADCAST_NO_CON,
+    TTC_mode.DISCONNECTED: pb.RESPONSE.TTC_DISCONNECTED,
+}
+EPS_PS_RESPONSES = {True: pb.RESPONSE.EPS_PS_ON, False: pb.RESPONSE.EPS_PS_OFF}
+DRAG_RESPONSES = {True: pb.RESPONSE.DRAG_DEPLOYED, False: pb.RESPONSE.DRAG_RETRACTED}
+PI_RESPONSES = {True: pb.RESPONSE.PI_ON, False: pb.RESPONSE.PI_OFF}
+
+# Single value requests every system answers, command: (response, system attribute)
+GENERIC_SINGLES = {
+    pb.COMMAND.GEN_GET_VOLTAGE: (pb.RESPONSE.GEN_RETURN_VOLTAGE, 'voltage'),
+    pb.COMMAND.GEN_GET_TEMP: (pb.RESPONSE.GEN_RETURN_TEMP, 'temp'),
+}
+
+
+# Lockstep commands that do time steps, these take the simulator lock themselves so can not run inside a batch
+STEP_COMMANDS = {pb.COMMAND.SIM_STEP, pb.COMMAND.SIM_ADVANCE_TO}
+
+
+def encode_frame(sim_resp):
+    """
+    Serializes a response into a frame ready to send, length of message in 4 bytes + message
+    """
+    body = sim_resp.SerializeToString()
+    return len(body).to_bytes(4, 'little') + body
+
+
+def constant_frame(response):
+    sim_resp = pb.Simulator_Response()
+    sim_resp.response = response
+    return encode_frame(sim_resp)
+
+
+# Pre-encoded frames, length prefix included, for every response that carries nothing but its enum (GEN_PONG,
+# GEN_SUCCESS, GEN_ERROR, the mode responses), so these replies are sent without building or serializing a message
+RESPONSE_FRAMES = {response: constant_frame(response) for response in pb.RESPONSE.values()}
+SUCCESS_FRAME = RESPONSE_FRAMES[pb.RESPONSE.GEN_SUCCESS]
+ERROR_FRAME = RESPONSE_FRAMES[pb.RESPONSE.GEN_ERROR]
+
+
+def encode_varint(value):
+    """
+    Protobuf base 128 varint encoding of a non-negative integer
+    """
+    encoded = bytearray()
+    while value > 0x7f:
+        encoded.append((value & 0x7f) | 0x80)
+        value >>= 7
+    encoded.append(value)
+    return bytes(encoded)
+
+
+class singleEncoder:
+    """
+    Encodes a Simulator_Response frame holding a response enum and a float 'single' with one precompiled struct.pack,
+    wire compatible with AR_OS_pb2 but without building a message object. The length prefix, the response field and
+    the single field's tag are constant and packed as one header.
+    """
+    __slots__ = ('header', 'struct')
+
+    def __init__(self, response):
+        # response = 1 (varint), single = 2 (32 bit)
+        body = b'\x08' + encode_varint(response) + b'\x15'
+        self.header = (len(body) + 4).to_bytes(4, 'little') + body
+        self.struct = struct.Struct(f'<{len(self.header)}sf')
+
+    def pack(self, value):
+        """
+        Raises OverflowError if value does not fit a float
+        """
+        return self.struct.pack(self.header, value)
+
+
+class vectorEncoder:
+    """
+    Encodes a Simulator_Response frame holding a response enum and a VECTOR with one precompiled struct.pack, the same
+    way as singleEncoder
+    """
+    __slots__ = ('header', 'struct')
+
+    def __init__(self, response):
+        # response = 1 (varint), vector = 3 (15 byte message), x = 1 (32 bit), y and z tags are packed between values
+        body = b'\x08' + encode_varint(response) + b'\x1a\x0f\x0d'
+        self.header = (len(body) + 14).to_bytes(4, 'little') + body
+        self.struct = struct.Struct(f'<{len(self.header)}sfBfBf')
+
+    def pack(self, x, y, z):
+        """
+        Raises OverflowError if a value does not fit a float
+        """
+        return self.struct.pack(self.header, x, 0x15, y, 0x1d, z)
+
+
+# Subscription tag appended to a pushed response, field 7 (varint) of Simulator_Response
+SUBSCRIPTION_TAG = b'\x38'
+
+
+class telemetrySubscription:
+    """
+    One client's subscription to a set of a system's get commands. After each time step the response to each command
+    is encoded and pushed to the client if it differs from the last one pushed, at most once every interval sim
+    seconds (every step if interval is 0). Pushed responses carry the subscription id so the client can tell them from
+    replies to its own requests.
+    """
+    __slots__ = ('id', 'connection', 'commands', 'interval', 'tag', 'last_push', 'last_frames')
+
+    def __init__(self, subscription_id, connection, commands, interval):
+        self.id = subscription_id
+        self.connection = connection
+        self.commands = commands
+        self.interval = interval
+        self.tag = SUBSCRIPTION_TAG + encode_varint(subscription_id)
+        self.last_push = None
+        # command: frame last pushed for it
+        self.last_frames = {}
+
+    def collect(self, handlers, now):
+        """
+        Returns the frames to push at sim time now, one per command whose response has changed, using the interface's
+        frame handlers to encode them
+        """
+        if self.last_push is not None and now - self.last_push < self.interval:
+            return []
+
+        frames = []
+        for command in self.commands:
+            frame = handlers[command](None)
+            if self.last_frames.get(command) != frame:
+                self.last_frames[command] = frame
+                body = frame[4:] + self.tag
+                frames.append(len(body).to_bytes(4, 'little') + body)
+        if frames:
+            self.last_push = now
+        return frames
+
+    def resync(self):
+        """
+        Forgets what was last pushed, so every response is pushed again next time (e.g. after a push was dropped)
+        """
+        self.last_frames = {}
+
+
+class audioTransfer:
+    """
+    One client's bulk transfer of a range of the Pi's received audio. Chunks are sent as soon as their audio has come in
+    over VHF, up to window chunks past the last byte the client has acknowledged, so a transfer moves at the radio's
+    rate instead of one round trip per chunk. Acks are cumulative, the client acknowledges every byte it has received
+    in order. Each chunk carries its offset in the file, the buoy sends again whatever the VHF link loses so the Pi's
+    audio is always the start of the file and every byte of the range comes in eventually.
+
+    Pushed the same way as a telemetrySubscription, if a push is dropped the transfer goes back to the last ack and
+    sends everything after it again.
+    """
+    __slots__ = ('connection', 'start', 'end', 'chunk_size', 'window', 'acked', 'sent')
+
+    def __init__(self, connection, start, end, chunk_size, window):
+        self.connection = connection
+        self.start = start
+        self.end = end
+        self.chunk_size = chunk_size
+        self.window = window
+        # Bytes acknowledged by the client and bytes sent, both as offsets in the file
+        self.acked = start
+        self.sent = start
+
+    def collect(self, system):
+        """
+        Returns the frames of every chunk that has arrived at the Pi and fits in the window, called with the simulator
+        lock held
+        """
+        position = max(self.sent, self.acked)
+        limit = min(self.end, self.acked + self.window * self.chunk_size)
+        frames = []
+        while position < limit:
+            data = system.read_audio(position, min(position + self.chunk_size, limit))
+            if not data:
+                # Rest has not come in over VHF yet
+                break
+            sim_resp = pb.Simulator_Response()
+            sim_resp.response = pb.RESPONSE.PI_RETURN_AUDIO_CHUNK
+            sim_resp.offset = position
+            sim_resp.byte_string = data
+            frames.append(encode_frame(sim_resp))
+            position += len(data)
+        self.sent = position
+        return frames
+
+    def ack(self, offset):
+        """
+        Moves the window up to offset, returns True once the whole range has been acknowledged
+        """
+        if self.acked < offset <= self.sent:
+            self.acked = offset
+        return self.acked == self.end
+
+    def resync(self):
+        """
+        Goes back to the last ack, so everything after it is sent again (e.g. after a push was dropped)
+        """
+        self.sent = self.acked
+
+
 class interface(ABC):
     """
     Generic interface code for connecting the simulator to AR-OS.
@@ -21,26 +267,483 @@ class interface(ABC):
         self.controller = controller
         self.address = address
         self.connected = False
+        # Set by stop to end the interface's threads, cleared again when the interface layer is restarted
+        self.stopping = Event()
+
+        # Dispatch table from command to handler, built once for this system
+        self.handlers = self.build_handlers()
+        # Fast path for commands whose reply is always a constant response, handler returns the pre-encoded frame
+        self.frame_handlers = self.build_frame_handlers()
+        # Commands that need the client's connection, handler takes (aros_com, connection) and returns the buffers
+        self.stream_handlers = self.build_stream_handlers()
+        # System methods taking the bytes of each receiver command, and the commands that carry a byte_string either
+        # way, which go through handle_compressed on connections that negotiated compression
+        self.receivers = {command: getattr(self.system, method) for command, method in self.RECEIVERS.items()}
+        self.compressible = set(self.RECEIVERS) | set(self.COMMANDS)
+        # Requests, latency, bytes and connection events of this system's port
+        self.stats = portMetrics()
+        # Which interface answers each command in a batch, built on first batch once every system exists
+        self.routes = None
+        # captureWriter recording every request and response, when the simulator is capturing traffic
+        self.capture = None
+
+        # Get commands a client can subscribe to, their responses are pushed after each time step when they change
+        self.subscribable = {command: self.frame_handlers[command]
+                             for command in {**GENERIC_SINGLES, **self.SINGLES, **self.VECTORS, **self.STATES}}
+        # Subscriptions of this system's clients, id: telemetrySubscription
+        self.subscriptions = {}
+        self.subscriptionsLock = Lock()
+        self.next_subscription = 1
+        # Compression negotiated by each client, connection: payloadCodec, guarded by subscriptionsLock
+        self.codecs = {}
 
     @abstractmethod
     def connect(self):
         """
         Either connects to the desired system or opens a local interface for system to connect to it.
-        returns when connection has been established or controller.close = True
+        returns when connection has been established or the interface is stopped
         """
         pass
 
-    @abstractmethod
+    def stop(self):
+        """
+        Tells the interface's threads to finish, from any thread. Interfaces with sockets of their own also wake them so
+        the threads finish straight away.
+        """
+        self.stopping.set()
+
+    # Dispatch tables, each system's interface fills in the commands it answers on top of the generic ones
+    # Single value requests, command: (response, system attribute)
+    SINGLES = {}
+    # Vector requests, command: (response, (x attribute, y attribute, z attribute))
+    VECTORS = {}
+    # Mode requests, command: (system attribute, {attribute value: response})
+    STATES = {}
+    # Requests that change the system state, command: system method returning True if the change was made
+    SETTERS = {}
+    # Requests carrying bytes for the system, command: system method taking the bytes, returning True on success
+    RECEIVERS = {}
+    # Requests with their own handler, command: name of interface method taking (aros_com, sim_resp)
+    COMMANDS = {}
+    # Requests whose responses keep being pushed to the client's connection, command: name of interface method taking
+    # (aros_com, connection) and returning the buffers to reply with
+    STREAMS = {}
+
+    def build_handlers(self):
+        """
+        Builds the dispatch table for this system from the class tables, every handler takes (aros_com, sim_resp) and
+        fills in the response
+        """
+        handlers = {pb.COMMAND.GEN_PING: self.ping, pb.COMMAND.GEN_BATCH: self.batch,
+                    pb.COMMAND.SIM_GET_TIME: self.get_time, pb.COMMAND.SIM_STEP: self.step,
+                    pb.COMMAND.SIM_ADVANCE_TO: self.advance_to}
+        for command, (response, attribute) in {**GENERIC_SINGLES, **self.SINGLES}.items():
+            handlers[command] = partial(self.get_single, response, attribute)
+        for command, (response, attributes) in self.VECTORS.items():
+            handlers[command] = partial(self.get_vector, response, attributes)
+        for command, (attribute, responses) in self.STATES.items():
+            handlers[command] = partial(self.get_state, attribute, responses)
+        for command, method in self.SETTERS.items():
+            handlers[command] = partial(self.set_state, getattr(self.system, method))
+        for command, method in self.RECEIVERS.items():
+            handlers[command] = partial(self.receive_bytes, getattr(self.system, method))
+        for command, method in self.COMMANDS.items():
+            handlers[command] = getattr(self, method)
+        return handlers
+
+    def build_frame_handlers(self):
+        """
+        Builds the fast path table for commands answered with a constant response or a single/vector value, every
+        handler takes aros_com and returns the encoded frame
+        """
+        handlers = {pb.COMMAND.GEN_PING: partial(self.frame_constant, RESPONSE_FRAMES[pb.RESPONSE.GEN_PONG])}
+        for command, (response, attribute) in {**GENERIC_SINGLES, **self.SINGLES}.items():
+            handlers[command] = partial(self.frame_single, response, attribute, singleEncoder(response))
+        for command, (response, attributes) in self.VECTORS.items():
+            handlers[command] = partial(self.frame_vector, response, attributes, vectorEncoder(response))
+        for command, (attribute, responses) in self.STATES.items():
+            frames = {value: RESPONSE_FRAMES[response] for value, response in responses.items()}
+            handlers[command] = partial(self.frame_state, attribute, frames)
+        for command, method in self.SETTERS.items():
+            handlers[command] = partial(self.frame_set_state, getattr(self.system, method))
+        for command, method in self.RECEIVERS.items():
+            handlers[command] = partial(self.frame_receive_bytes, getattr(self.system, method))
+        return handlers
+
+    def build_stream_handlers(self):
+        handlers = {pb.COMMAND.GEN_SUBSCRIBE: self.subscribe, pb.COMMAND.GEN_UNSUBSCRIBE: self.unsubscribe,
+                    pb.COMMAND.GEN_SET_COMPRESSION: self.set_compression}
+        for command, method in self.STREAMS.items():
+            handlers[command] = getattr(self, method)
+        return handlers
+
+    def handle_frame(self, msg: bytes, connection=None):
+        """
+        Handles one command from AR-OS, takes the serialized AROS_Command and returns the buffers making up the response
+        frame, length prefix included. Constant replies come straight from RESPONSE_FRAMES, single and vector values are
+        packed by their precompiled encoder, anything else is built and serialized by handle_message's dispatch.
+
+        connection is the client's connection, needed for subscriptions and bulk transfers since their responses are
+        pushed to it later.
+        """
+        start = time.perf_counter()
+        aros_com = self.parse(msg)
+        if aros_com is None:
+            self.stats.parse_error(len(msg) + 4, len(ERROR_FRAME))
+            if self.capture is not None:
+                self.capture.record(self, connection, start, msg, [ERROR_FRAME])
+            return [ERROR_FRAME]
+
+        handler = self.frame_handlers.get(aros_com.command)
+        codec = self.codecs.get(connection) if self.codecs else None
+        if codec is not None and aros_com.command in self.compressible:
+            buffers = self.handle_compressed(aros_com, codec)
+        elif handler is not None:
+            buffers = [handler(aros_com)]
+        elif aros_com.command in self.stream_handlers:
+            buffers = self.stream_handlers[aros_com.command](aros_com, connection)
+        elif aros_com.command not in self.handlers:
+            # Command not meant for this system
+            buffers = [ERROR_FRAME]
+        else:
+            sim_resp = pb.Simulator_Response()
+            self.dispatch(aros_com, sim_resp)
+            body = sim_resp.SerializeToString()
+            buffers = [len(body).to_bytes(4, 'little'), body]
+
+        self.stats.record(aros_com.command, time.perf_counter() - start, len(msg) + 4,
+                          sum(len(buffer) for buffer in buffers))
+        if self.capture is not None:
+            self.capture.record(self, connection, start, msg, buffers)
+        return buffers
+
+    def handle_compressed(self, aros_com, codec):
+        """
+        Handles a command carrying a byte_string on a connection that negotiated compression. The request's byte_string
+        is decompressed before the system sees it and the response's compressed, with each command its own stream in
+        each direction. Receivers are also given the compressed size, the bytes that would cross a radio link. A payload
+        that does not decompress is answered GEN_ERROR, its stream is then broken until the client negotiates again.
+        """
+        command = aros_com.command
+        size = None
+        if aros_com.HasField('byte_string'):
+            compressed = aros_com.byte_string
+            start = time.perf_counter()
+            try:
+                aros_com.byte_string = codec.decompress(command, compressed)
+            except ValueError:
+                return [ERROR_FRAME]
+            self.stats.record_compression(codec.name, 'in', len(aros_com.byte_string), len(compressed),
+                                          time.perf_counter() - start)
+            size = len(compressed)
+
+        receiver = self.receivers.get(command)
+        if receiver is not None:
+            return [SUCCESS_FRAME if receiver(msg=aros_com.byte_string, size=size) else ERROR_FRAME]
+
+        sim_resp = pb.Simulator_Response()
+        self.dispatch(aros_com, sim_resp)
+        if sim_resp.HasField('byte_string'):
+            raw = sim_resp.byte_string
+            start = time.perf_counter()
+            sim_resp.byte_string = codec.compress(command, raw)
+            self.stats.record_compression(codec.name, 'out', len(raw), len(sim_resp.byte_string),
+                                          time.perf_counter() - start)
+        return [encode_frame(sim_resp)]
+
+    def handle_message(self, msg: bytes):
+        """
+        Handles one command from AR-OS, takes the serialized AROS_Command and returns the serialized
+        Simulator_Response. Kept apart from any socket code so every transport can share it.
+        """
+        start = time.perf_counter()
+        aros_com = self.parse(msg)
+        sim_resp = pb.Simulator_Response()
+        if aros_com is None:
+            sim_resp.response = pb.RESPONSE.GEN_ERROR
+            response = sim_resp.SerializeToString()
+            self.stats.parse_error(len(msg) + 4, len(response) + 4)
+            return response
+
+        self.dispatch(aros_com, sim_resp)
+        response = sim_resp.SerializeToString()
+        self.stats.record(aros_com.command, time.perf_counter() - start, len(msg) + 4, len(response) + 4)
+        return response
+
+    def parse(self, msg: bytes):
+        """
+        Parses an AROS_Command, returns None if the message is not a valid one
+        """
+        aros_com = pb.AROS_Command()
+        try:
+            aros_com.ParseFromString(msg)
+        except DecodeError:
+            return None
+        if not aros_com.IsInitialized():
+            # Missing the required command field
+            return None
+        return aros_com
+
+    def dispatch(self, aros_com, sim_resp):
+        """
+        Runs the handler for one parsed command, filling in sim_resp
+        """
+        handler = self.handlers.get(aros_com.command)
+        if handler is None:
+            # Command not meant for this system
+            sim_resp.response = pb.RESPONSE.GEN_ERROR
+        else:
+            handler(aros_com, sim_resp)
+
+    # Shared handlers
+    def ping(self, aros_com, sim_resp):
+        sim_resp.response = pb.RESPONSE.GEN_PONG
+
+    def batch(self, aros_com, sim_resp):
+        """
+        Runs every command in the batch and returns their responses in order, in one frame. The simulator lock is held
+        for the whole batch so no time step lands part way through. System specific commands go to the system that
+        owns them, generic commands go to the system at the command's address or to this system if none is given.
+        """
+        if self.routes is None:
+            self.routes = self.build_routes()
+        commands, addresses = self.routes
+
+        lock = self.controller.simulator.lock
+        lock.acquire()
+        try:
+            for command in aros_com.batch:
+                response = sim_resp.batch.add()
+                if command.command == pb.COMMAND.GEN_BATCH or command.command in STEP_COMMANDS:
+                    # Batches do not nest, and time can not be stepped while the batch holds the simulator lock
+                    response.response = pb.RESPONSE.GEN_ERROR
+                    continue
+                if command.HasField('address'):
+                    target = addresses.get(command.address)
+                else:
+                    target = commands.get(command.command, self)
+                if target is None:
+                    response.response = pb.RESPONSE.GEN_ERROR
+                else:
+                    target.dispatch(command, response)
+        finally:
+            lock.release()
+
+        sim_resp.response = pb.RESPONSE.GEN_RETURN_BATCH
+
+    def get_time(self, aros_com, sim_resp):
+        sim_resp.response = pb.RESPONSE.SIM_TIME
+        sim_resp.time = self.controller.simulator.time
+
+    def step(self, aros_com, sim_resp):
+        """
+        Lockstep, does the asked for number of time steps (one if not given) then replies SIM_TIME with the time
+        reached, as the ack that AR-OS can carry on. Every push the steps cause is sent ahead of the reply. Stops after
+        LOCKSTEP_MAX_STEPS, AR-OS asks again for the rest.
+        """
+        simulator = self.controller.simulator
+        if not simulator.lockstep:
+            sim_resp.response = pb.RESPONSE.GEN_ERROR
+            return
+        sim_resp.response = pb.RESPONSE.SIM_TIME
+        sim_resp.time = simulator.advance(aros_com.steps if aros_com.HasField('steps') else 1)
+
+    def advance_to(self, aros_com, sim_resp):
+        """
+        Lockstep, does time steps until the asked for time is reached then replies SIM_TIME with the time reached. Stops
+        short after LOCKSTEP_MAX_STEPS, AR-OS asks again until the time reached is the time it wants.
+        """
+        simulator = self.controller.simulator
+        if not simulator.lockstep or not aros_com.HasField('time'):
+            sim_resp.response = pb.RESPONSE.GEN_ERROR
+            return
+        sim_resp.response = pb.RESPONSE.SIM_TIME
+        sim_resp.time = simulator.advance_to(aros_com.time)
+
+    def subscribe(self, aros_com, connection):
+        """
+        Starts a subscription to the requested get commands for this connection. Replies GEN_SUBSCRIBED with the
+        subscription id, followed straight away by the current response to every command.
+        """
+        if connection is None or not aros_com.fields or \
+                any(command not in self.subscribable for command in aros_com.fields):
+            return [ERROR_FRAME]
+
+        self.subscriptionsLock.acquire()
+        subscription = telemetrySubscription(self.next_subscription, connection, list(aros_com.fields),
+                                             aros_com.interval)
+        self.subscriptions[subscription.id] = subscription
+        self.next_subscription += 1
+        self.subscriptionsLock.release()
+
+        sim_resp = pb.Simulator_Response()
+        sim_resp.response = pb.RESPONSE.GEN_SUBSCRIBED
+        sim_resp.subscription = subscription.id
+        # Held so the first values are all from one time step, and not pushed again by a step running alongside
+        lock = self.controller.simulator.lock
+        lock.acquire()
+        frames = subscription.collect(self.subscribable, self.controller.simulator.time)
+        lock.release()
+        return [encode_frame(sim_resp)] + frames
+
+    def unsubscribe(self, aros_com, connection):
+        """
+        Ends the given subscription of this connection, or all of them if none is given
+        """
+        self.subscriptionsLock.acquire()
+        if aros_com.HasField('subscription'):
+            subscription = self.subscriptions.get(aros_com.subscription)
+            ended = [subscription] if subscription is not None and subscription.connection is connection else []
+        else:
+            ended = [subscription for subscription in self.subscriptions.values()
+                     if subscription.connection is connection]
+        for subscription in ended:
+            del self.subscriptions[subscription.id]
+        self.subscriptionsLock.release()
+        return [SUCCESS_FRAME if ended else ERROR_FRAME]
+
+    def drop_subscriptions(self, connection):
+        """
+        Ends every subscription of a connection that has closed, along with its compression, and marks its end in the
+        capture
+        """
+        self.subscriptionsLock.acquire()
+        for subscription in [subscription for subscription in self.subscriptions.values()
+                             if subscription.connection is connection]:
+            del self.subscriptions[subscription.id]
+        self.codecs.pop(connection, None)
+        self.subscriptionsLock.release()
+        if self.capture is not None:
+            self.capture.forget(self, connection)
+
+    def set_compression(self, aros_com, connection):
+        """
+        Negotiates compression of byte_string payloads on this connection, from the next message on. Replies
+        GEN_COMPRESSION with the method and level agreed, NONE if the method asked for is not supported. Asking again
+        starts every stream afresh.
+        """
+        if connection is None:
+            return [ERROR_FRAME]
+        compression, level = negotiate(aros_com.compression, aros_com.level if aros_com.HasField('level') else None)
+
+        self.subscriptionsLock.acquire()
+        if compression == pb.COMPRESSION.NONE:
+            self.codecs.pop(connection, None)
+        else:
+            self.codecs[connection] = payloadCodec(compression, level)
+        self.subscriptionsLock.release()
+
+        sim_resp = pb.Simulator_Response()
+        sim_resp.response = pb.RESPONSE.GEN_COMPRESSION
+        sim_resp.compression = compression
+        sim_resp.level = level
+        return [encode_frame(sim_resp)]
+
+    def collect_pushes(self, now):
+        """
+        Called by the simulator after each time step, returns (subscription, frames) for every subscription with
+        changed responses to push
+        """
+        self.subscriptionsLock.acquire()
+        subscriptions = list(self.subscriptions.values())
+        self.subscriptionsLock.release()
+
+        pushes = []
+        for subscription in subscriptions:
+            frames = subscription.collect(self.subscribable, now)
+            if frames:
+                pushes.append((subscription, frames))
+        return pushes
+
+    def build_routes(self):
+        """
+        Returns ({command: interface} for commands only one system answers, {address: interface})
+        """
+        owners = {}
+        addresses = {}
+        for system in self.controller.systems:
+            addresses[system.interface.address] = system.interface
+            for command in system.interface.handlers:
+                owners.setdefault(command, []).append(system.interface)
+        commands = {command: interfaces[0] for command, interfaces in owners.items() if len(interfaces) == 1}
+        return commands, addresses
+
+    def get_single(self, response, attribute, aros_com, sim_resp):
+        sim_resp.response = response
+        sim_resp.single = getattr(self.system, attribute)
+
+    def get_vector(self, response, attributes, aros_com, sim_resp):
+        sim_resp.response = response
+        sim_resp.vector.x = getattr(self.system, attributes[0])
+        sim_resp.vector.y = getattr(self.system, attributes[1])
+        sim_resp.vector.z = getattr(self.system, attributes[2])
+
+    def get_state(self, attribute, responses, aros_com, sim_resp):
+        sim_resp.response = responses[getattr(self.system, attribute)]
+
+    def set_state(self, setter, aros_com, sim_resp):
+        if setter():
+            sim_resp.response = pb.RESPONSE.GEN_SUCCESS
+        else:
+            sim_resp.response = pb.RESPONSE.GEN_ERROR
+
+    def receive_bytes(self, receiver, aros_com, sim_resp):
+        if aros_com.HasField('byte_string'):
+            msg = aros_com.byte_string
+        else:
+            msg = b''
+        if receiver(msg=msg):
+            sim_resp.response = pb.RESPONSE.GEN_SUCCESS
+        else:
+            sim_resp.response = pb.RESPONSE.GEN_ERROR
+
+    # Fast path handlers, each returns a pre-encoded frame
+    def frame_constant(self, frame, aros_com):
+        return frame
+
+    def frame_state(self, attribute, frames, aros_com):
+        return frames[getattr(self.system, attribute)]
+
+    def frame_single(self, response, attribute, encoder, aros_com):
+        try:
+            return encoder.pack(getattr(self.system, attribute))
+        except OverflowError:
+            # Out of float range, leave the conversion to protobuf
+            sim_resp = pb.Simulator_Response()
+            self.get_single(response, attribute, aros_com, sim_resp)
+            return encode_frame(sim_resp)
+
+    def frame_vector(self, response, attributes, encoder, aros_com):
+        try:
+            return encoder.pack(getattr(self.system, attributes[0]), getattr(self.system, attributes[1]),
+                                getattr(self.system, attributes[2]))
+        except OverflowError:
+            # Out of float range, leave the conversion to protobuf
+            sim_resp = pb.Simulator_Response()
+            self.get_vector(response, attributes, aros_com, sim_resp)
+            return encode_frame(sim_resp)
+
+    def frame_set_state(self, setter, aros_com):
+        return SUCCESS_FRAME if setter() else ERROR_FRAME
+
+    def frame_receive_bytes(self, receiver, aros_com):
+        if aros_com.HasField('byte_string'):
+            msg = aros_com.byte_string
+        else:
+            msg = b''
+        return SUCCESS_FRAME if receiver(msg=msg) else ERROR_FRAME
+
     def handle_communication(self):
         """
-        Handles one interaction (receive and send) between system and AR-OS, is system specific
+        Handles one interaction (receive and send) between system and AR-OS
         """
-        pass
+        msg = self.recvFrom()
+        self.sendTo(self.handle_message(msg))
 
     def runInterface(self, _):
         """
         Loop for the interface thread, connects to a system then continuously handles communication
-        until controller.close = True.
+        until the interface is stopped.
         """
         print(f"Thread for {self.system.name} running")
 
@@ -49,7 +752,7 @@ class interface(ABC):
         if not self.connected:
             return
 
-        while not self.controller.close:
+        while not self.stopping.is_set():
             self.handle_communication()
 
         return
@@ -70,522 +773,672 @@ class interface(ABC):
         return msg
 
 
+class lanConnection:
+    """
+    One client connected to a LAN interface. Each connection has its own preallocated buffers that its messages are
+    received into, so several clients, or a client that reconnects, never share framing state.
+    """
+
+    def __init__(self, conn, interface):
+        self.conn = conn
+        self.interface = interface
+        # sets timeout to check if interface still running, in case a stop does not manage to wake the socket
+        self.conn.settimeout(LAN_POLL)
+
+        self.header = bytearray(4)
+        self.headerView = memoryview(self.header)
+        self.buffer = bytearray(RECV_BUFFER_SIZE)
+        self.bufferView = memoryview(self.buffer)
+        # Held while sending, responses and pushed subscription frames are sent from different threads
+        self.sendLock = Lock()
+        # Rest of a push the socket only took part of, sent before anything else so the framing stays intact
+        self.unsent = []
+
+    def close(self):
+        self.conn.close()
+
+    def shutdown(self):
+        """
+        Wakes any thread blocked receiving or sending on this connection, from any thread. The connection is left for
+        its own thread to close.
+        """
+        try:
+            self.conn.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            # Already closed by the client or its own thread
+            pass
+
+    def pushBuffers(self, buffers):
+        """
+        Sends frames pushed by a subscription without waiting on a slow client, so the simulator thread is never held
+        up. Returns False if nothing could be sent (the client is behind, a response is being sent or an earlier push
+        is still unfinished), the push is then dropped. The rest of a push the socket only partly takes is kept in
+        unsent and finished by the next push, reply or the client's own thread while it waits for a request.
+        """
+        if not HAS_SENDMSG or not self.sendLock.acquire(blocking=False):
+            return False
+        try:
+            if self.unsent:
+                self.unsent = self.sendAvailable(self.unsent)
+                if self.unsent:
+                    return False
+            remaining = self.sendAvailable(buffers)
+            if sum(map(len, remaining)) == sum(map(len, buffers)):
+                # Nothing went, the push can be dropped whole
+                return False
+            self.unsent = remaining
+            return True
+        finally:
+            self.sendLock.release()
+
+    def sendAvailable(self, buffers):
+        """
+        Sends as much of buffers as the connection takes without waiting, returns what is left. Called with sendLock
+        held.
+        """
+        buffers = [memoryview(buffer) for buffer in buffers]
+        if not self.writable():
+            return buffers
+        try:
+            sent = self.conn.sendmsg(buffers, [], socket.MSG_DONTWAIT)
+        except (BlockingIOError, TimeoutError):
+            return buffers
+        # Drop the buffers that were fully sent and trim the one that was partly sent
+        while buffers and sent >= len(buffers[0]):
+            sent -= len(buffers.pop(0))
+        if buffers:
+            buffers[0] = buffers[0][sent:]
+        return buffers
+
+    def flushUnsent(self):
+        """
+        Finishes a push the socket only took part of, from the client's own thread where waiting on the client is fine
+        """
+        if self.unsent:
+            self.sendBuffers([])
+
+    def writable(self):
+        """
+        True if the connection can take more data right now. Checked before pushing since a socket with a timeout
+        waits for room before sending, even when asked not to block.
+        """
+        if isinstance(self.conn, socket.socket):
+            _, writable, _ = select.select([], [self.conn], [], 0)
+            return bool(writable)
+        return self.conn.writable()
+
+    def sendFrame(self, msg: bytes):
+        """
+        Sends one message on this connection, packet is length of message in 4 bytes + message given by system
+        """
+        self.sendBuffers([len(msg).to_bytes(4, 'little'), msg])
+
+    def sendBuffers(self, buffers):
+        """
+        Sends a frame made of several buffers (e.g. length prefix and message). The buffers are handed to the socket
+        together without being joined into a new bytes object, and partial sends are continued until all is written.
+        """
+        self.sendLock.acquire()
+        try:
+            self.sendBuffersLocked(buffers)
+        finally:
+            self.sendLock.release()
+
+    def sendBuffersLocked(self, buffers):
+        # Any unfinished push goes first so this frame does not land in the middle of it
+        if self.unsent:
+            buffers = self.unsent + list(buffers)
+            self.unsent = []
+        if not HAS_SENDMSG:
+            # Platform without sendmsg (Windows), fall back to a single sendall of the joined packet
+            self.conn.sendall(b''.join(buffers))
+            return
+
+        buffers = [memoryview(buffer) for buffer in buffers]
+        while buffers:
+            try:
+                sent = self.conn.sendmsg(buffers)
+            except TimeoutError:
+                # Socket full for the whole timeout, check if interface stopping
+                if self.interface.stopping.is_set():
+                    return
+                continue
+            # Drop the buffers that were fully sent and trim the one that was partly sent
+            while sent:
+                if sent >= len(buffers[0]):
+                    sent -= len(buffers[0])
+                    buffers.pop(0)
+                else:
+                    buffers[0] = buffers[0][sent:]
+                    sent = 0
+            if buffers and not buffers[0]:
+                buffers.pop(0)
+        return
+
+    def recvInto(self, view):
+        """
+        Fills the given memoryview from the connection, checking if the interface is stopping whenever the socket times
+        out. Raises ConnectionError if the client closes the connection or the interface stops.
+        """
+        received = 0
+        while received < len(view):
+            try:
+                count = self.conn.recv_into(view[received:])
+            except TimeoutError:
+                # If timeout then check if interface stopping
+                if self.interface.stopping.is_set():
+                    # If true end the connection, its thread frees it like any other closed connection
+                    raise ConnectionAbortedError("Interface stopping")
+                else:
+                    # Else finish any push left part sent and listen again
+                    self.flushUnsent()
+                    continue
+            if count == 0:
+                # recv of nothing means the client has closed its end of the connection
+                raise ConnectionResetError("Client closed connection")
+            received += count
+
+    def recvFrame(self):
+        """
+        Receives one packet from the client and returns the message
+
+        The message is read straight into this connection's receive buffer and returned as a memoryview of it, so it is
+        only valid until the next call to recvFrame.
+        """
+        # Recevives first 4 bytes of message, which is the length of the message to come
+        self.recvInto(self.headerView)
+        length = int.from_bytes(self.header, 'little')
+
+        if length > len(self.buffer):
+            # Message bigger than buffer, grow buffer so later messages of this size need no new allocation
+            self.buffer = bytearray(max(length, 2 * len(self.buffer)))
+            self.bufferView = memoryview(self.buffer)
+
+        msg = self.bufferView[:length]
+        self.recvInto(msg)
+        return msg
+
+
 class interfaceLAN(interface, ABC):
     """
     Generic system interface code for LAN. Listens on a TCP socket on a given port to simulate listening on a serial
     bus, each system will have it own inherited version of this to handle their specific message requirements.
+
+    The port keeps listening for the life of the simulator. Each client is served on its own thread, up to max_clients
+    at once, and when a client disconnects the port goes back to accepting, so AR-OS can restart without the simulator
+    restarting.
     """
 
     def __init__(self, address, controller, system):
         super().__init__(address, controller, system)
         """
-        Creates empty variables to store the socket and connection when generated
+        Creates empty variables to store the listening socket and client connections when generated
         """
         self.socket = None
+        # Socket pair used to wake the thread waiting for a client when stopping, made along with the listener
+        self.wakeup_recv = None
+        self.wakeup_send = None
+        # Most recently accepted connection, used by sendTo and recvFrom
         self.conn = None
+        self.connections = []
+        self.connectionsLock = Lock()
+        # Clients served at once, can be raised per system in the registry with "interface.max_clients"
+        self.max_clients = LAN_MAX_CLIENTS
 
     def __del__(self):
         """
-        Closes the socket and connection when the object is deleted, to avoid memory leak.
+        Closes the socket and connections when the object is deleted, to avoid memory leak.
         """
         if self.socket:
             self.socket.close()
-        if self.conn:
-            self.conn.close()
+        for connection in self.connections:
+            connection.close()
 
     def connect(self):
         """
-        Creates new TCP socket at port 'address' and waits for connection, will return either when successfully connected
-        or when self.controller.close = True. Will set self.connected if connection established
+        Creates new TCP socket at port 'address' and waits for a connection, will return either when successfully
+        connected or when the interface is stopped. Will set self.connected if connection established
+        """
+        self.listen()
+        self.accept()
+
+    def listen(self):
+        """
+        Creates the TCP socket at port 'address' and starts listening on it
         """
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        # Lets the port be bound again straight after a restart, while old connections are still in TIME_WAIT
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         # Address is used as port number, since it is the 'address' for the system in the simulator
         self.socket.bind((HOST, self.address))
+        self.socket.listen(self.max_clients)
+        self.socket.settimeout(LAN_POLL)
+        self.wakeup_recv, self.wakeup_send = socket.socketpair()
 
-        self.socket.settimeout(1)
-
-        while not self.conn:
-            # Well not connected, continue listening and try to connect
+    def accept(self):
+        """
+        Waits for the next client, returns its connection or None if the interface is stopped first. Clients beyond
+        max_clients are left waiting until a connection closes.
+        """
+        while not self.stopping.is_set():
+            if len(self.connections) >= self.max_clients:
+                # No free slot, wait for a client to leave
+                self.stopping.wait(0.1)
+                continue
+            connection = self.acceptClient()
+            if connection is None:
+                # Timed out or woken, check if interface stopping again
+                continue
+
+            self.connectionsLock.acquire()
+            self.connections.append(connection)
+            self.conn = connection
+            self.connected = True
+            self.connectionsLock.release()
+            self.stats.connection_opened()
+            print(f"Thread {self.system.name} connection established ({len(self.connections)} connected)")
+            return connection
+
+        print(f"Thread {self.system.name} closing before connection")
+        return None
+
+    def acceptClient(self):
+        """
+        Waits up to LAN_POLL seconds for a client to connect, returns its connection or None if none connects or the
+        wait is woken by stop
+        """
+        readable, _, _ = select.select([self.socket, self.wakeup_recv], [], [], LAN_POLL)
+        if self.wakeup_recv in readable or self.socket not in readable:
+            return None
+        try:
+            conn, _ = self.socket.accept()
+        except (BlockingIOError, TimeoutError):
+            return None
+        return lanConnection(conn, self)
+
+    def stop(self):
+        """
+        Tells the interface's threads to finish and wakes every one of them, the listener's and each client's
+        """
+        super().stop()
+        self.wakeListener()
+        self.connectionsLock.acquire()
+        for connection in self.connections:
+            connection.shutdown()
+        self.connectionsLock.release()
+
+    def wakeListener(self):
+        if self.wakeup_send is not None:
             try:
-                self.socket.listen(1)
-                # If connection is successful save connection in variable then break loop
-                self.conn, _ = self.socket.accept()
+                self.wakeup_send.send(b'\0')
+            except OSError:
+                pass
+
+    def closeListener(self):
+        self.socket.close()
+        self.socket = None
+        self.wakeup_recv.close()
+        self.wakeup_send.close()
+        self.wakeup_recv = self.wakeup_send = None
+
+    def disconnect(self, connection):
+        """
+        Closes one client's connection and frees its slot
+        """
+        self.drop_subscriptions(connection)
+        connection.close()
+        self.connectionsLock.acquire()
+        self.connections.remove(connection)
+        if self.conn is connection:
+            self.conn = self.connections[-1] if self.connections else None
+        self.connected = len(self.connections) > 0
+        self.connectionsLock.release()
+        self.stats.connection_closed()
+        print(f"Thread {self.system.name} connection closed ({len(self.connections)} connected)")
+
+    def serveConnection(self, connection):
+        """
+        Loop for one client's thread, handles its messages until it disconnects or the interface is stopped
+        """
+        try:
+            while not self.stopping.is_set():
+                connection.sendBuffers(self.handle_frame(connection.recvFrame(), connection))
+        except OSError:
+            # Connection reset or closed by the client, its slot is freed below
+            pass
+        finally:
+            self.disconnect(connection)
+
+    def runInterface(self, _):
+        """
+        Loop for the interface thread, keeps accepting clients and starts a thread to serve each one until the
+        interface is stopped, then waits for the client threads to finish
+        """
+        print(f"Thread for {self.system.name} running")
+
+        self.listen()
+
+        clientThreads = []
+        while not self.stopping.is_set():
+            connection = self.accept()
+            if connection is None:
                 break
-            except TimeoutError:
-                # If timeout then check controller.close status
-                if self.controller.close:
-                    # If true return so thread can close
-                    print(f"Thread {self.system.name} closing before connection")
-                    return
-                else:
-                    # Else do nothing and listen again
-                    pass
-        # If successful at making connection, update boolean and print message
-        self.connected = True
-        print(f"Thread {self.system.name} connection established")
+            clientThread = Thread(target=self.serveConnection, args=(connection,))
+            clientThread.start()
+            # Forget threads of clients that have already left
+            clientThreads = [thread for thread in clientThreads if thread.is_alive()]
+            clientThreads.append(clientThread)
+
+        for clientThread in clientThreads:
+            clientThread.join()
+        self.closeListener()
+        return
 
     def sendTo(self, msg: bytes):
         """
-        Sends generated message through the desired interface (LAN)
-        packet is length of message in 4 bytes + message given by system
+        Sends generated message through the desired interface (LAN), to the most recently connected client
         """
-        length = len(msg)
-        lengthBytes = length.to_bytes(4, 'little')
-        packet = lengthBytes + msg
-        self.conn.send(packet)
-        return
+        self.conn.sendFrame(msg)
 
     def recvFrom(self):
         """
-        Receives packet from AR-OS and returns the message to the simulator from desired interface (LAN)
+        Receives packet from AR-OS and returns the message to the simulator from desired interface (LAN), from the most
+        recently connected client. The message is only valid until the next receive on that connection.
         """
-        # sets timeout to check if simulation still running
-        self.conn.settimeout(1)
+        return self.conn.recvFrame()
 
-        # Recevives first 4 bytes of message, which is the length of the message to come
-        lengthBytes = b''
-        while len(lengthBytes) < 4:
-            try:
-                lengthBytes += self.conn.recv(4-len(lengthBytes))
-            except TimeoutError:
-                #print("TIMEOUT")
-                # If timeout then check controller.close status
-                if self.controller.close:
-                    # If true exit thread
-                    print(f"Thread {self.system.name} closing after connection")
-                    exit()
-                else:
-                    # Else do nothing and listen again
-                    pass
-        length = int.from_bytes(lengthBytes, 'little')
 
-        msg = b''
-        while len(msg) < length:
-            try:
-                msg += self.conn.recv(length-len(msg))
-            except TimeoutError:
-                # If timeout then check controller.close status
-                if self.controller.close:
-                    # If true exit thread
-                    print(f"Thread {self.system.name} closing after connection")
-                    exit()
-                else:
-                    # Else do nothing and listen again
-                    pass
-        return msg
+class interfaceUnix(interfaceLAN, ABC):
+    """
+    Local link for a system whose AR-OS runs on the same host. Listens on a Unix domain socket named after the
+    system's port in LOCAL_LINK_DIR rather than on TCP, skipping the loopback TCP stack. Framing, clients and
+    reconnects work exactly as for LAN.
+    """
 
-    @abstractmethod
-    def handle_communication(self):
+    def listen(self):
         """
-        Handles one interaction (receive and send) between system and AR-OS, is system specific
+        Creates the Unix domain socket for this system and starts listening on it
         """
-        pass
+        self.path = link_path(self.address, 'sock')
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        if os.path.exists(self.path):
+            # Left by a simulator that did not close cleanly
+            os.unlink(self.path)
 
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.socket.bind(self.path)
+        self.socket.listen(self.max_clients)
+        self.socket.settimeout(LAN_POLL)
+        self.wakeup_recv, self.wakeup_send = socket.socketpair()
 
-class interfaceLAN_EPS(interfaceLAN):
+    def closeListener(self):
+        super().closeListener()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+class interfaceSHM(interfaceLAN, ABC):
     """
-    interface of EPS
+    Lowest latency local link for a system whose AR-OS runs on the same host. Messages pass through a pair of shared
+    memory rings with a FIFO doorbell for each (see sharedmem.py), so a request and its response need no socket at
+    all. A shared memory link has one client at a time, which can detach and a new one attach without a restart.
     """
 
-    def handle_communication(self):
-        msg = self.recvFrom()
-        aros_com = pb.AROS_Command()
-        aros_com.ParseFromString(msg)
+    def listen(self):
+        """
+        Creates the shared memory channel for this system
+        """
+        self.max_clients = 1
+        self.channel = shmChannel(self.address, True)
 
-        sim_resp = pb.Simulator_Response()
+    def acceptClient(self):
+        """
+        Waits up to LAN_POLL seconds for a client to attach, returns its connection or None
+        """
+        if not self.channel.client():
+            # Attaching rings the request doorbell, and so does stop
+            self.channel.request.wait(LAN_POLL)
+            if not self.channel.client() or self.stopping.is_set():
+                return None
+        return lanConnection(shmSocket(self.channel, True), self)
+
+    def wakeListener(self):
+        # No channel until the interface thread has started listening
+        channel = getattr(self, 'channel', None)
+        if channel is not None:
+            try:
+                channel.request.ring()
+            except OSError:
+                # Channel closed while waking it
+                pass
 
-        if aros_com.command == pb.COMMAND.GEN_PING:
-            sim_resp.response = pb.RESPONSE.GEN_PONG
-        elif aros_com.command == pb.COMMAND.GEN_GET_VOLTAGE:
-            sim_resp.response = pb.RESPONSE.GEN_RETURN_VOLTAGE
-            sim_resp.single = self.system.voltage
-        elif aros_com.command == pb.COMMAND.GEN_GET_TEMP:
-            sim_resp.response = pb.RESPONSE.GEN_RETURN_TEMP
-            sim_resp.single = self.system.temp
-
-        elif aros_com.command == pb.COMMAND.EPS_GET_CHARGE:
-            sim_resp.response = pb.RESPONSE.EPS_RETURN_CHARGE
-            sim_resp.single = self.system.charge
-        elif aros_com.command == pb.COMMAND.EPS_GET_PS:
-            if self.system.power_saving:
-                sim_resp.response = pb.RESPONSE.EPS_PS_ON
-            else:
-                sim_resp.response = pb.RESPONSE.EPS_PS_OFF
-        elif aros_com.command == pb.COMMAND.EPS_SET_PS_ON:
-            if self.system.set_ps_on():
-                sim_resp.response = pb.RESPONSE.GEN_SUCCESS
-            else:
-                sim_resp.response = pb.RESPONSE.GEN_ERROR
-        elif aros_com.command == pb.COMMAND.EPS_SET_PS_OFF:
-            if self.system.set_ps_off():
-                sim_resp.response = pb.RESPONSE.GEN_SUCCESS
-            else:
-                sim_resp.response = pb.RESPONSE.GEN_ERROR
-        else:
-            sim_resp.response = pb.RESPONSE.GEN_ERROR
+    def closeListener(self):
+        self.channel.close()
+        self.channel = None
 
-        msg = sim_resp.SerializeToString()
-        self.sendTo(msg)
 
-class interfaceLAN_ESP(interfaceLAN):
+# Link classes a system's interface can be switched to with "link" in the registry, lan keeps the interface as it is
+LINKS = {'lan': None, 'unix': interfaceUnix, 'shm': interfaceSHM}
+
+
+def with_link(interface_class, link):
     """
-    interface of ESP
+    Returns the version of a system's interface class that talks over the given link, e.g. interfaceLAN_EPS over 'shm'
+    becomes interfaceSHM_EPS, answering the same commands through shared memory
     """
+    link_class = LINKS[link]
+    if link_class is None:
+        return interface_class
+    name = interface_class.__name__.replace('interfaceLAN', link_class.__name__)
+    return type(name, (link_class, interface_class), {})
 
-    def handle_communication(self):
-        msg = self.recvFrom()
-        aros_com = pb.AROS_Command()
-        aros_com.ParseFromString(msg)
 
-        sim_resp = pb.Simulator_Response()
+class interfaceLAN_EPS(interfaceLAN):
+    """
+    interface of EPS
+    """
+    SINGLES = {pb.COMMAND.EPS_GET_CHARGE: (pb.RESPONSE.EPS_RETURN_CHARGE, 'charge')}
+    STATES = {pb.COMMAND.EPS_GET_PS: ('power_saving', EPS_PS_RESPONSES)}
+    SETTERS = {
+        pb.COMMAND.EPS_SET_PS_ON: 'set_ps_on',
+        pb.COMMAND.EPS_SET_PS_OFF: 'set_ps_off',
+    }
 
-        if aros_com.command == pb.COMMAND.GEN_PING:
-            sim_resp.response = pb.RESPONSE.GEN_PONG
-        elif aros_com.command == pb.COMMAND.GEN_GET_VOLTAGE:
-            sim_resp.response = pb.RESPONSE.GEN_RETURN_VOLTAGE
-            sim_resp.single = self.system.voltage
-        elif aros_com.command == pb.COMMAND.GEN_GET_TEMP:
-            sim_resp.response = pb.RESPONSE.GEN_RETURN_TEMP
-            sim_resp.single = self.system.temp
-
-        elif aros_com.command == pb.COMMAND.ESP_GET_FUEL:
-            sim_resp.response = pb.RESPONSE.ESP_RETURN_FUEL
-            sim_resp.single = self.system.fuel
-        elif aros_com.command == pb.COMMAND.ESP_GET_MODE:
-            if self.system.status == ESPState.OFF:
-                sim_resp.response = pb.RESPONSE.ESP_OFF
-            elif self.system.status == ESPState.WARMING:
-                sim_resp.response = pb.RESPONSE.ESP_WARMING
-            elif self.system.status == ESPState.READY:
-                sim_resp.response = pb.RESPONSE.ESP_READY
-            elif self.system.status == ESPState.BURNING:
-                sim_resp.response = pb.RESPONSE.ESP_BURNING
-            elif self.system.status == ESPState.COOLDOWN:
-                sim_resp.response = pb.RESPONSE.ESP_COOL_DOWN
-        elif aros_com.command == pb.COMMAND.ESP_SET_WARMUP:
-            if self.system.set_warmup():
-                sim_resp.response = pb.RESPONSE.GEN_SUCCESS
-            else:
-                sim_resp.response = pb.RESPONSE.GEN_ERROR
-        elif aros_com.command == pb.COMMAND.ESP_SET_BURNING:
-            if self.system.set_burn():
-                sim_resp.response = pb.RESPONSE.GEN_SUCCESS
-            else:
-                sim_resp.response = pb.RESPONSE.GEN_ERROR
-        elif aros_com.command == pb.COMMAND.ESP_SET_OFF:
-            if self.system.set_off():
-                sim_resp.response = pb.RESPONSE.GEN_SUCCESS
-            else:
-                sim_resp.response = pb.RESPONSE.GEN_ERROR
-        else:
-            sim_resp.response = pb.RESPONSE.GEN_ERROR
 
-        msg = sim_resp.SerializeToString()
-        self.sendTo(msg)
+class interfaceLAN_ESP(interfaceLAN):
+    """
+    interface of ESP
+    """
+    SINGLES = {pb.COMMAND.ESP_GET_FUEL: (pb.RESPONSE.ESP_RETURN_FUEL, 'fuel')}
+    STATES = {pb.COMMAND.ESP_GET_MODE: ('status', ESP_MODE_RESPONSES)}
+    SETTERS = {
+        pb.COMMAND.ESP_SET_WARMUP: 'set_warmup',
+        pb.COMMAND.ESP_SET_BURNING: 'set_burn',
+        pb.COMMAND.ESP_SET_OFF: 'set_off',
+    }
 
 
 class interfaceLAN_dragSail(interfaceLAN):
     """
     interface of dragSail
     """
-
-    def handle_communication(self):
-        msg = self.recvFrom()
-        aros_com = pb.AROS_Command()
-        aros_com.ParseFromString(msg)
-
-        sim_resp = pb.Simulator_Response()
-
-        if aros_com.command == pb.COMMAND.GEN_PING:
-            sim_resp.response = pb.RESPONSE.GEN_PONG
-        elif aros_com.command == pb.COMMAND.GEN_GET_VOLTAGE:
-            sim_resp.response = pb.RESPONSE.GEN_RETURN_VOLTAGE
-            sim_resp.single = self.system.voltage
-        elif aros_com.command == pb.COMMAND.GEN_GET_TEMP:
-            sim_resp.response = pb.RESPONSE.GEN_RETURN_TEMP
-            sim_resp.single = self.system.temp
-
-        elif aros_com.command == pb.COMMAND.DRAG_GET_MODE:
-            if not self.system.deployed:
-                sim_resp.response = pb.RESPONSE.DRAG_RETRACTED
-            else:
-                sim_resp.response = pb.RESPONSE.DRAG_DEPLOYED
-        elif aros_com.command == pb.COMMAND.DRAG_SET_DEPLOY:
-            if self.system.deploy_drag():
-                sim_resp.response = pb.RESPONSE.GEN_SUCCESS
-            else:
-                sim_resp.response = pb.RESPONSE.GEN_ERROR
-        else:
-            sim_resp.response = pb.RESPONSE.GEN_ERROR
-
-        msg = sim_resp.SerializeToString()
-        self.sendTo(msg)
+    STATES = {pb.COMMAND.DRAG_GET_MODE: ('deployed', DRAG_RESPONSES)}
+    SETTERS = {pb.COMMAND.DRAG_SET_DEPLOY: 'deploy_drag'}
 
 
 class interfaceLAN_ADCS(interfaceLAN):
     """
     interface of ADCS
     """
-
-    def handle_communication(self):
-        msg = self.recvFrom()
-        aros_com = pb.AROS_Command()
-        aros_com.ParseFromString(msg)
-
-        sim_resp = pb.Simulator_Response()
-
-        if aros_com.command == pb.COMMAND.GEN_PING:
-            sim_resp.response = pb.RESPONSE.GEN_PONG
-        elif aros_com.command == pb.COMMAND.GEN_GET_VOLTAGE:
-            sim_resp.response = pb.RESPONSE.GEN_RETURN_VOLTAGE
-            sim_resp.single = self.system.voltage
-        elif aros_com.command == pb.COMMAND.GEN_GET_TEMP:
-            sim_resp.response = pb.RESPONSE.GEN_RETURN_TEMP
-            sim_resp.single = self.system.temp
-
-        elif aros_com.command == pb.COMMAND.ADCS_GET_PRY:
-            sim_resp.response = pb.RESPONSE.ADCS_RETURN_PRY
-            sim_resp.vector.x = self.system.pitch
-            sim_resp.vector.y = self.system.roll
-            sim_resp.vector.z = self.system.yaw
-        elif aros_com.command == pb.COMMAND.ADCS_GET_AV:
-            sim_resp.response = pb.RESPONSE.ADCS_RETURN_AV
-            sim_resp.vector.x = self.system.pitch_av
-            sim_resp.vector.y = self.system.roll_av
-            sim_resp.vector.z = self.system.yaw_av
-        elif aros_com.command == pb.COMMAND.ADCS_GET_MODE:
-            if self.system.mode == ADCS_mode.OFF:
-                sim_resp.response = pb.RESPONSE.ADCS_OFF
-            elif self.system.mode == ADCS_mode.DETUMBLING:
-                sim_resp.response = pb.RESPONSE.ADCS_DE_TUMBLE
-            elif self.system.mode == ADCS_mode.SUN_POINTING:
-                sim_resp.response = pb.RESPONSE.ADCS_SUN_POINT
-        elif aros_com.command == pb.COMMAND.ADCS_SET_OFF:
-            if self.system.set_off():
-                sim_resp.response = pb.RESPONSE.GEN_SUCCESS
-            else:
-                sim_resp.response = pb.RESPONSE.GEN_ERROR
-        elif aros_com.command == pb.COMMAND.ADCS_SET_DE_TUMBLE:
-            if self.system.set_de_tumbling():
-                sim_resp.response = pb.RESPONSE.GEN_SUCCESS
-            else:
-                sim_resp.response = pb.RESPONSE.GEN_ERROR
-        elif aros_com.command == pb.COMMAND.ADCS_SET_SUN_POINT:
-            if self.system.set_sun_pointing():
-                sim_resp.response = pb.RESPONSE.GEN_SUCCESS
-            else:
-                sim_resp.response = pb.RESPONSE.GEN_ERROR
-        else:
-            sim_resp.response = pb.RESPONSE.GEN_ERROR
-
-        msg = sim_resp.SerializeToString()
-        self.sendTo(msg)
+    VECTORS = {
+        pb.COMMAND.ADCS_GET_PRY: (pb.RESPONSE.ADCS_RETURN_PRY, ('pitch', 'roll', 'yaw')),
+        pb.COMMAND.ADCS_GET_AV: (pb.RESPONSE.ADCS_RETURN_AV, ('pitch_av', 'roll_av', 'yaw_av')),
+    }
+    STATES = {pb.COMMAND.ADCS_GET_MODE: ('mode', ADCS_MODE_RESPONSES)}
+    SETTERS = {
+        pb.COMMAND.ADCS_SET_OFF: 'set_off',
+        pb.COMMAND.ADCS_SET_DE_TUMBLE: 'set_de_tumbling',
+        pb.COMMAND.ADCS_SET_SUN_POINT: 'set_sun_pointing',
+    }
 
 
 class interfaceLAN_GNSS(interfaceLAN):
     """
     interface of GNSS
     """
-
-    def handle_communication(self):
-        msg = self.recvFrom()
-        aros_com = pb.AROS_Command()
-        aros_com.ParseFromString(msg)
-
-        sim_resp = pb.Simulator_Response()
-
-        if aros_com.command == pb.COMMAND.GEN_PING:
-            sim_resp.response = pb.RESPONSE.GEN_PONG
-        elif aros_com.command == pb.COMMAND.GEN_GET_VOLTAGE:
-            sim_resp.response = pb.RESPONSE.GEN_RETURN_VOLTAGE
-            sim_resp.single = self.system.voltage
-        elif aros_com.command == pb.COMMAND.GEN_GET_TEMP:
-            sim_resp.response = pb.RESPONSE.GEN_RETURN_TEMP
-            sim_resp.single = self.system.temp
-
-        elif aros_com.command == pb.COMMAND.GNSS_GET_POSI:
-            sim_resp.response = pb.RESPONSE.GNSS_RETURN_POSI
-            sim_resp.vector.x = self.system.latitude
-            sim_resp.vector.y = self.system.longitude
-            sim_resp.vector.z = self.system.elevation
-        else:
-            sim_resp.response = pb.RESPONSE.GEN_ERROR
-
-        msg = sim_resp.SerializeToString()
-        self.sendTo(msg)
+    VECTORS = {pb.COMMAND.GNSS_GET_POSI: (pb.RESPONSE.GNSS_RETURN_POSI, ('latitude', 'longitude', 'elevation'))}
 
 
 class interfaceLAN_Pi_VHF(interfaceLAN):
     """
     interface of Pi_VHF
     """
+    STATES = {pb.COMMAND.PI_GET_MODE: ('enabled', PI_RESPONSES)}
+    SETTERS = {
+        pb.COMMAND.PI_SET_ON: 'set_on',
+        pb.COMMAND.PI_SET_OFF: 'set_off',
+    }
+    COMMANDS = {pb.COMMAND.PI_GET_AUDIO: 'get_audio'}
+    STREAMS = {
+        pb.COMMAND.PI_GET_AUDIO_RANGE: 'get_audio_range',
+        pb.COMMAND.PI_ACK_AUDIO: 'ack_audio',
+    }
 
-    def handle_communication(self):
-        msg = self.recvFrom()
-        aros_com = pb.AROS_Command()
-        aros_com.ParseFromString(msg)
-
-        sim_resp = pb.Simulator_Response()
+    def __init__(self, address, controller, system):
+        interfaceLAN.__init__(self, address, controller, system)
+        # Bulk audio transfer of each client, connection: audioTransfer, guarded by subscriptionsLock
+        self.transfers = {}
 
-        if aros_com.command == pb.COMMAND.GEN_PING:
-            sim_resp.response = pb.RESPONSE.GEN_PONG
-        elif aros_com.command == pb.COMMAND.GEN_GET_VOLTAGE:
-            sim_resp.response = pb.RESPONSE.GEN_RETURN_VOLTAGE
-            sim_resp.single = self.system.voltage
-        elif aros_com.command == pb.COMMAND.GEN_GET_TEMP:
-            sim_resp.response = pb.RESPONSE.GEN_RETURN_TEMP
-            sim_resp.single = self.system.temp
-
-        elif aros_com.command == pb.COMMAND.PI_GET_MODE:
-            if self.system.enabled:
-                sim_resp.response = pb.RESPONSE.PI_ON
-            else:
-                sim_resp.response = pb.RESPONSE.PI_OFF
-        elif aros_com.command == pb.COMMAND.PI_GET_AUDIO:
-            if not self.system.enabled:
-                sim_resp.response = pb.RESPONSE.GEN_ERROR
+    def get_audio(self, aros_com, sim_resp):
+        if not self.system.enabled:
+            sim_resp.response = pb.RESPONSE.GEN_ERROR
+        else:
+            audio = self.system.get_audio()
+            if audio is None:
+                # Still coming over VHF, an empty byte string would read as the end of the file
+                sim_resp.response = pb.RESPONSE.PI_AUDIO_PENDING
             else:
                 sim_resp.response = pb.RESPONSE.PI_RETURN_AUDIO
-                sim_resp.byte_string = self.system.get_audio()
-        elif aros_com.command == pb.COMMAND.PI_SET_ON:
-            if self.system.set_on():
-                sim_resp.response = pb.RESPONSE.GEN_SUCCESS
-            else:
-                sim_resp.response = pb.RESPONSE.GEN_ERROR
-        elif aros_com.command == pb.COMMAND.PI_SET_OFF:
-            if self.system.set_off():
-                sim_resp.response = pb.RESPONSE.GEN_SUCCESS
-            else:
-                sim_resp.response = pb.RESPONSE.GEN_ERROR
-        else:
-            sim_resp.response = pb.RESPONSE.GEN_ERROR
+                sim_resp.byte_string = audio
+
+    def get_audio_range(self, aros_com, connection):
+        """
+        Starts a bulk transfer of a range of the audio file, replacing any the connection already has. Replies
+        PI_AUDIO_RANGE with the range, chunk size and window agreed, followed by the chunks already received from the
+        buoy. The rest are pushed after each time step as they come in over VHF and the client's acks open the window.
+        The range can run to the end of the buoy's file, sections lost over VHF are sent again until the Pi has them.
+        """
+        system = self.system
+        start = aros_com.offset
+        if connection is None or not system.enabled or start > len(system.audio_data):
+            return [ERROR_FRAME]
+        end = len(system.audio_data)
+        if aros_com.HasField('length'):
+            end = min(end, start + aros_com.length)
+        chunk_size = min(max(aros_com.chunk_size, 1), AUDIO_CHUNK_MAX) if aros_com.chunk_size else AUDIO_CHUNK_SIZE
+        window = min(max(aros_com.window, 1), AUDIO_WINDOW_MAX) if aros_com.window else AUDIO_WINDOW
+        transfer = audioTransfer(connection, start, end, chunk_size, window)
+
+        sim_resp = pb.Simulator_Response()
+        sim_resp.response = pb.RESPONSE.PI_AUDIO_RANGE
+        sim_resp.offset = start
+        sim_resp.length = end - start
+        sim_resp.chunk_size = chunk_size
+        sim_resp.window = window
+
+        # Held so chunks are not collected by a time step at the same time
+        lock = self.controller.simulator.lock
+        lock.acquire()
+        self.subscriptionsLock.acquire()
+        self.transfers[connection] = transfer
+        self.subscriptionsLock.release()
+        frames = transfer.collect(system)
+        lock.release()
+        return [encode_frame(sim_resp)] + frames
+
+    def ack_audio(self, aros_com, connection):
+        """
+        Acknowledges every byte of the connection's transfer before offset, and replies with the chunks this lets it
+        send. Nothing is sent back if no new chunks are ready yet, once the whole range is acknowledged the transfer
+        ends with GEN_SUCCESS.
+        """
+        lock = self.controller.simulator.lock
+        lock.acquire()
+        transfer = self.transfers.get(connection)
+        if transfer is None:
+            lock.release()
+            return [ERROR_FRAME]
+        if transfer.ack(aros_com.offset):
+            self.subscriptionsLock.acquire()
+            del self.transfers[connection]
+            self.subscriptionsLock.release()
+            lock.release()
+            return [SUCCESS_FRAME]
+        frames = transfer.collect(self.system) if self.system.enabled else []
+        lock.release()
+        return frames
+
+    def drop_subscriptions(self, connection):
+        interfaceLAN.drop_subscriptions(self, connection)
+        self.subscriptionsLock.acquire()
+        self.transfers.pop(connection, None)
+        self.subscriptionsLock.release()
+
+    def collect_pushes(self, now):
+        """
+        Pushes the chunks of every transfer that came in over VHF during the time step along with any subscriptions
+        """
+        pushes = interfaceLAN.collect_pushes(self, now)
+        if not self.system.enabled:
+            return pushes
 
-        msg = sim_resp.SerializeToString()
-        self.sendTo(msg)
+        self.subscriptionsLock.acquire()
+        transfers = list(self.transfers.values())
+        self.subscriptionsLock.release()
+        for transfer in transfers:
+            frames = transfer.collect(self.system)
+            if frames:
+                pushes.append((transfer, frames))
+        return pushes
 
 
 class interfaceLAN_OBC(interfaceLAN):
     """
-    interface of OBC
+    interface of OBC, only answers the generic commands
     """
 
-    def handle_communication(self):
-        msg = self.recvFrom()
-        aros_com = pb.AROS_Command()
-        aros_com.ParseFromString(msg)
-
-        sim_resp = pb.Simulator_Response()
-
-        if aros_com.command == pb.COMMAND.GEN_PING:
-            sim_resp.response = pb.RESPONSE.GEN_PONG
-        elif aros_com.command == pb.COMMAND.GEN_GET_VOLTAGE:
-            sim_resp.response = pb.RESPONSE.GEN_RETURN_VOLTAGE
-            sim_resp.single = self.system.voltage
-        elif aros_com.command == pb.COMMAND.GEN_GET_TEMP:
-            sim_resp.response = pb.RESPONSE.GEN_RETURN_TEMP
-            sim_resp.single = self.system.temp
-        else:
-            sim_resp.response = pb.RESPONSE.GEN_ERROR
-
-        msg = sim_resp.SerializeToString()
-        self.sendTo(msg)
-
 
 class interfaceLAN_TTC(interfaceLAN):
     """
     interface of TTC
     """
-
-    def handle_communication(self):
-        msg = self.recvFrom()
-        aros_com = pb.AROS_Command()
-        aros_com.ParseFromString(msg)
-
-        sim_resp = pb.Simulator_Response()
-
-        if aros_com.command == pb.COMMAND.GEN_PING:
-            sim_resp.response = pb.RESPONSE.GEN_PONG
-        elif aros_com.command == pb.COMMAND.GEN_GET_VOLTAGE:
-            sim_resp.response = pb.RESPONSE.GEN_RETURN_VOLTAGE
-            sim_resp.single = self.system.voltage
-        elif aros_com.command == pb.COMMAND.GEN_GET_TEMP:
-            sim_resp.response = pb.RESPONSE.GEN_RETURN_TEMP
-            sim_resp.single = self.system.temp
-        elif aros_com.command == pb.COMMAND.TTC_GET_MODE:
-            if self.system.mode == TTC_mode.OFF:
-                sim_resp.response = pb.RESPONSE.TTC_OFF
-            elif self.system.mode == TTC_mode.BEACONING:
-                sim_resp.response = pb.RESPONSE.TTC_BEACONING
-            elif self.system.mode == TTC_mode.CONNECTING:
-                sim_resp.response = pb.RESPONSE.TTC_CONNECTING
-            elif self.system.mode == TTC_mode.ESTABLISHED_DATA:
-                sim_resp.response = pb.RESPONSE.TTC_ESTABLISHED_DATA
-            elif self.system.mode == TTC_mode.ESTABLISHED_CONT:
-                sim_resp.response = pb.RESPONSE.TTC_ESTABLISHED_CONT
-            elif self.system.mode == TTC_mode.BROADCAST_NO_CON:
-                sim_resp.response = pb.RESPONSE.TTC_BROADCAST_NO_CON
-            elif self.system.mode == TTC_mode.DISCONNECTED:
-                sim_resp.response = pb.RESPONSE.TTC_DISCONNECTED
-        elif aros_com.command == pb.COMMAND.TTC_GET_COMMAND:
-            if self.system.mode == TTC_mode.ESTABLISHED_DATA or self.system.mode == TTC_mode.ESTABLISHED_CONT:
-                msg = self.system.get_msg()
-                if msg == b'':
-                    sim_resp.response = pb.RESPONSE.GEN_ERROR
-                else:
-                    sim_resp.response = pb.RESPONSE.TTC_RETURN_COMMAND
-                    sim_resp.byte_string = msg
-            else:
-                sim_resp.response = pb.RESPONSE.GEN_ERROR
-        elif aros_com.command == pb.COMMAND.TTC_SET_OFF:
-            if self.system.set_off():
-                sim_resp.response = pb.RESPONSE.GEN_SUCCESS
-            else:
-                sim_resp.response = pb.RESPONSE.GEN_ERROR
-        elif aros_com.command == pb.COMMAND.TTC_SET_BEACONING:
-            if self.system.set_beaconing():
-                sim_resp.response = pb.RESPONSE.GEN_SUCCESS
-            else:
-                sim_resp.response = pb.RESPONSE.GEN_ERROR
-        elif aros_com.command == pb.COMMAND.TTC_SET_CONNECTING:
-            if self.system.set_connecting():
-                sim_resp.response = pb.RESPONSE.GEN_SUCCESS
-            else:
-                sim_resp.response = pb.RESPONSE.GEN_ERROR
-        elif aros_com.command == pb.COMMAND.TTC_SET_BROADCAST_NO_CON:
-            if self.system.set_broadcast_no_con():
-                sim_resp.response = pb.RESPONSE.GEN_SUCCESS
-            else:
-                sim_resp.response = pb.RESPONSE.GEN_ERROR
-        elif aros_com.command == pb.COMMAND.TTC_SEND_BYTE_STRING:
-            if aros_com.HasField('byte_string'):
-                msg = aros_com.byte_string
-            else:
-                msg = b''
-            if self.system.recv_msg(msg=msg):
-                sim_resp.response = pb.RESPONSE.GEN_SUCCESS
-            else:
+    STATES = {pb.COMMAND.TTC_GET_MODE: ('mode', TTC_MODE_RESPONSES)}
+    SETTERS = {
+        pb.COMMAND.TTC_SET_OFF: 'set_off',
+        pb.COMMAND.TTC_SET_BEACONING: 'set_beaconing',
+        pb.COMMAND.TTC_SET_CONNECTING: 'set_connecting',
+        pb.COMMAND.TTC_SET_BROADCAST_NO_CON: 'set_broadcast_no_con',
+    }
+    RECEIVERS = {
+        pb.COMMAND.TTC_SEND_BYTE_STRING: 'recv_msg',
+        pb.COMMAND.TTC_SEND_HEALTH: 'recv_health',
+        pb.COMMAND.TTC_SEND_AUDIO: 'recv_audio',
+    }
+    COMMANDS = {pb.COMMAND.TTC_GET_COMMAND: 'get_command'}
+
+    def get_command(self, aros_com, sim_resp):
+        if self.system.mode == TTC_mode.ESTABLISHED_DATA or self.system.mode == TTC_mode.ESTABLISHED_CONT:
+            # Returns every queued command unless AR-OS asks for fewer, each framed as its own entry
+            count = max(aros_com.count, 1) if aros_com.HasField('count') else None
+            commands = self.system.get_msg(count=count)
+            if not commands:
                 sim_resp.response = pb.RESPONSE.GEN_ERROR
-        elif aros_com.command == pb.COMMAND.TTC_SEND_HEALTH:
-            if aros_com.HasField('byte_string'):
-                msg = aros_com.byte_string
-            else:
-                msg = b''
-            if self.system.recv_health(msg=msg):
-                sim_resp.response = pb.RESPONSE.GEN_SUCCESS
             else:
-                sim_resp.response = pb.RESPONSE.GEN_ERROR
-        elif aros_com.command == pb.COMMAND.TTC_SEND_AUDIO:
-            if aros_com.HasField('byte_string'):
-                msg = aros_com.byte_string
-            else:
-                msg = b''
-            if self.system.recv_audio(msg=msg):
-                sim_resp.response = pb.RESPONSE.GEN_SUCCESS
-            else:
-                sim_resp.response = pb.RESPONSE.GEN_ERROR
+                sim_resp.response = pb.RESPONSE.TTC_RETURN_COMMAND
+                for command_id, timestamp, command in commands:
+                    sim_resp.commands.add(id=command_id, timestamp=timestamp, command=command)
+                if not aros_com.HasField('count'):
+                    # Older clients only read the byte string, keep newline terminated form for them
+                    sim_resp.byte_string = b''.join(command + b'\n' for _, _, command in commands)
         else:
             sim_resp.response = pb.RESPONSE.GEN_ERROR
-
-        msg = sim_resp.SerializeToString()
-        self.sendTo(msg)
-
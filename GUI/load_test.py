@@ -0,0 +1,366 @@
+import argparse
+import asyncio
+import random
+import time
+from collections import deque
+import AR_OS_pb2 as pb
+import interfaces
+from interfaces import HOST
+from registry import REGISTRY_PATH, load_registry
+from sharedmem import link_path
+
+# Seconds each load step runs for, the first LOAD_WARMUP seconds of it are not measured
+LOAD_DURATION = 10.0
+LOAD_WARMUP = 1.0
+# Requests kept in flight at once in closed loop mode
+LOAD_CONCURRENCY = 8
+# Command mix, command=weight, a generic command (GEN_...) is spread over every port and one meant for a particular
+# system can be given as COMMAND@system_key
+LOAD_MIX = 'GNSS_GET_POSI=60,ADCS_GET_PRY=20,TTC_GET_MODE=10,GEN_PING=10'
+# Requests allowed in flight at once in open loop mode, any more are counted as dropped rather than queued without limit
+LOAD_MAX_OUTSTANDING = 10000
+# Percentiles reported for each command
+LOAD_PERCENTILES = (50, 95, 99)
+
+
+def system_ports(registry, port_offset=0):
+    """
+    Returns {system key: (port, link)} and {command: system key} for the commands only one system answers, taken from
+    the dispatch tables of each system's interface class
+    """
+    ports = {}
+    owners = {}
+    for entry in registry['systems']:
+        ports[entry['key']] = (entry['port'] + port_offset, entry.get('link', 'lan'))
+        interface_class = getattr(interfaces, entry['interface'])
+        for table in (interface_class.SINGLES, interface_class.VECTORS, interface_class.STATES,
+                      interface_class.SETTERS, interface_class.RECEIVERS, interface_class.COMMANDS,
+                      interface_class.STREAMS):
+            for command in table:
+                owners[command] = entry['key']
+    return ports, owners
+
+
+def parse_mix(mix, ports, owners):
+    """
+    Turns a mix such as 'GNSS_GET_POSI=70,GEN_PING@EPS=30' into a list of (command, system key, weight), with generic
+    commands split evenly over every system
+    """
+    targets = []
+    for item in mix.split(','):
+        name, _, weight = item.strip().partition('=')
+        weight = float(weight) if weight else 1.0
+        name, _, key = name.partition('@')
+        command = pb.COMMAND.Value(name)
+        if key:
+            if key not in ports:
+                raise ValueError(f"No system {key} in the registry")
+            targets.append((command, key, weight))
+        elif command in owners:
+            targets.append((command, owners[command], weight))
+        elif name.startswith('GEN_'):
+            targets.extend((command, key, weight / len(ports)) for key in ports)
+        else:
+            raise ValueError(f"No system answers {name}, give one as {name}@system_key")
+    return targets
+
+
+class loadConnection:
+    """
+    One client connection to a system's port. Requests are pipelined, several can be sent before the first reply, and
+    since a port answers its requests in order each reply completes the oldest waiting request. This lets one
+    connection carry as much concurrency as asked for, even to a port that only takes a single client.
+    """
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        # Future of every request sent and not yet answered, oldest first
+        self.waiting = deque()
+        self.closed = False
+        self.task = asyncio.create_task(self.read_replies())
+
+    async def read_replies(self):
+        try:
+            while True:
+                length = int.from_bytes(await self.reader.readexactly(4), 'little')
+                body = await self.reader.readexactly(length)
+                future = self.waiting.popleft()
+                if not future.done():
+                    future.set_result(body)
+        except (asyncio.IncompleteReadError, ConnectionError) as e:
+            self.closed = True
+            for future in self.waiting:
+                if not future.done():
+                    future.set_exception(ConnectionResetError(f"Simulator closed connection: {e}"))
+            self.waiting.clear()
+
+    async def request(self, frame):
+        """
+        Sends one length prefixed request and returns the reply's body
+        """
+        if self.closed:
+            raise ConnectionResetError("Simulator closed connection")
+        future = asyncio.get_running_loop().create_future()
+        self.waiting.append(future)
+        self.writer.write(frame)
+        return await future
+
+    async def close(self):
+        self.task.cancel()
+        self.writer.close()
+
+
+async def open_connection(port, link):
+    if link == 'lan':
+        reader, writer = await asyncio.open_connection(HOST, port)
+    elif link == 'unix':
+        reader, writer = await asyncio.open_unix_connection(link_path(port, 'sock'))
+    else:
+        raise ValueError(f"Load test can not reach a system over the {link} link")
+    return loadConnection(reader, writer)
+
+
+class commandStats:
+    """
+    Latencies and errors of one command, to one system, in the measured part of a load step
+    """
+    __slots__ = ('latencies', 'errors')
+
+    def __init__(self):
+        self.latencies = []
+        self.errors = 0
+
+
+class loadGenerator:
+    """
+    Sends a weighted mix of commands to the simulator's ports and measures each request's latency. In closed loop mode
+    a fixed number of requests are kept in flight, each sent as soon as the one before it is answered, which finds the
+    most throughput the simulator gives. In open loop mode requests are started on a fixed schedule at the target rate
+    whether or not earlier ones have been answered, latency is measured from when each should have been sent so a
+    stalled simulator shows up as latency rather than a lower send rate.
+    """
+
+    def __init__(self, targets, ports, connections=1, payloads=None):
+        self.targets = targets
+        self.ports = ports
+        self.connections_per_port = connections
+        self.weights = [weight for _, _, weight in targets]
+        # Serialized request of each target, with the byte_string given for its command in payloads if any
+        self.frames = []
+        for command, _, _ in targets:
+            msg = pb.AROS_Command()
+            msg.command = command
+            if payloads and command in payloads:
+                msg.byte_string = payloads[command]
+            msg = msg.SerializeToString()
+            self.frames.append(len(msg).to_bytes(4, 'little') + msg)
+        # system key: [loadConnection], and the next to use of each
+        self.connections = {}
+        self.next_connection = {}
+        self.stats = {}
+        self.measuring = False
+        self.outstanding = 0
+        self.dropped = 0
+        # Requests that failed because the simulator closed or reset their connection
+        self.disconnected = 0
+
+    async def connect(self):
+        for key in {key for _, key, _ in self.targets}:
+            port, link = self.ports[key]
+            self.connections[key] = [await open_connection(port, link) for _ in range(self.connections_per_port)]
+            self.next_connection[key] = 0
+
+    async def close(self):
+        for connections in self.connections.values():
+            for connection in connections:
+                await connection.close()
+
+    def connection(self, key):
+        connections = self.connections[key]
+        index = self.next_connection[key]
+        self.next_connection[key] = (index + 1) % len(connections)
+        return connections[index]
+
+    async def send(self, index, start):
+        """
+        Sends the request of one target, recording its latency from start if the step is being measured. Returns False
+        if the simulator closed the connection, which is counted rather than ending the step, since a simulator tipping
+        over is what a load test is looking for.
+        """
+        key = self.targets[index][1]
+        try:
+            body = await self.connection(key).request(self.frames[index])
+        except ConnectionError:
+            if self.measuring:
+                self.disconnected += 1
+            return False
+        latency = time.perf_counter() - start
+        if self.measuring:
+            stats = self.stats.get(index)
+            if stats is None:
+                stats = self.stats[index] = commandStats()
+            stats.latencies.append(latency)
+            response = pb.Simulator_Response()
+            response.ParseFromString(body)
+            if response.response == pb.RESPONSE.GEN_ERROR:
+                stats.errors += 1
+        return True
+
+    def pick(self, rng):
+        return rng.choices(range(len(self.targets)), self.weights)[0]
+
+    async def closed_loop(self, concurrency, duration, warmup, seed=None):
+        """
+        Keeps concurrency requests in flight for duration seconds, returns the measured seconds
+        """
+        rng = random.Random(seed)
+        end = time.perf_counter() + duration
+
+        async def worker():
+            while time.perf_counter() < end:
+                if not await self.send(self.pick(rng), time.perf_counter()):
+                    # Connection gone, a closed one fails straight away so carrying on would only spin
+                    return
+
+        return await self.run_step([worker() for _ in range(concurrency)], duration, warmup)
+
+    async def open_loop(self, rate, duration, warmup, max_outstanding=LOAD_MAX_OUTSTANDING, seed=None):
+        """
+        Starts rate requests a second for duration seconds, returns the measured seconds
+        """
+        rng = random.Random(seed)
+        tasks = set()
+
+        async def scheduler():
+            start = time.perf_counter()
+            sent = 0
+            while sent < rate * duration:
+                due = start + sent / rate
+                delay = due - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                sent += 1
+                if self.outstanding >= max_outstanding:
+                    if self.measuring:
+                        self.dropped += 1
+                    continue
+                task = asyncio.create_task(self.tracked(self.pick(rng), due))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            await asyncio.gather(*list(tasks))
+
+        return await self.run_step([scheduler()], duration, warmup)
+
+    async def tracked(self, index, start):
+        self.outstanding += 1
+        try:
+            await self.send(index, start)
+        finally:
+            self.outstanding -= 1
+
+    async def run_step(self, coroutines, duration, warmup):
+        self.stats = {}
+        self.dropped = 0
+        self.disconnected = 0
+        self.measuring = False
+
+        async def measure():
+            await asyncio.sleep(warmup)
+            self.measuring = True
+            await asyncio.sleep(duration - warmup)
+            self.measuring = False
+
+        await asyncio.gather(measure(), *coroutines)
+        return duration - warmup
+
+
+def percentile(ordered, percent):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))]
+
+
+def report(generator, seconds, label):
+    """
+    Prints throughput and latency percentiles in milliseconds per command and for the whole mix
+    """
+    print(label)
+    header = f"{'command':<28}{'system':<10}{'req/s':>10}{'errors':>8}"
+    header += ''.join(f"{f'p{p}':>9}" for p in LOAD_PERCENTILES) + f"{'max':>9}"
+    print(header)
+
+    every = []
+    errors = 0
+    for index, (command, key, _) in enumerate(generator.targets):
+        stats = generator.stats.get(index)
+        if stats is None or not stats.latencies:
+            continue
+        print(format_line(pb.COMMAND.Name(command), key, stats.latencies, stats.errors, seconds))
+        every.extend(stats.latencies)
+        errors += stats.errors
+    if every:
+        print(format_line('all', '', every, errors, seconds))
+    if generator.dropped:
+        print(f"{generator.dropped} requests not sent, {LOAD_MAX_OUTSTANDING} already in flight")
+    if generator.disconnected:
+        print(f"{generator.disconnected} requests failed, the simulator closed their connection")
+    return len(every) / seconds, percentile(sorted(every), 99) * 1e3 if every else 0.0
+
+
+def format_line(name, key, latencies, errors, seconds):
+    ordered = sorted(latencies)
+    line = f"{name:<28}{key:<10}{len(ordered) / seconds:>10.0f}{errors:>8}"
+    line += ''.join(f"{percentile(ordered, p) * 1e3:>9.3f}" for p in LOAD_PERCENTILES)
+    return line + f"{ordered[-1] * 1e3:>9.3f}"
+
+
+async def run(args):
+    ports, owners = system_ports(load_registry(args.registry), args.port_offset)
+    targets = parse_mix(args.mix, ports, owners)
+    generator = loadGenerator(targets, ports, args.connections)
+    await generator.connect()
+
+    summary = []
+    try:
+        if args.rate:
+            for rate in args.rate:
+                seconds = await generator.open_loop(rate, args.duration, args.warmup, seed=args.seed)
+                summary.append((f"{rate:.0f} req/s", *report(generator, seconds, f"Open loop at {rate:.0f} req/s")))
+                print()
+        else:
+            for concurrency in args.concurrency:
+                seconds = await generator.closed_loop(concurrency, args.duration, args.warmup, seed=args.seed)
+                summary.append((f"{concurrency} in flight",
+                                *report(generator, seconds, f"Closed loop with {concurrency} in flight")))
+                print()
+    finally:
+        await generator.close()
+
+    if len(summary) > 1:
+        # Where throughput stops rising with load while p99 climbs is the simulator's capacity
+        print(f"{'load':<20}{'req/s':>10}{'p99 ms':>10}")
+        for label, throughput, p99 in summary:
+            print(f"{label:<20}{throughput:>10.0f}{p99:>10.3f}")
+
+
+if __name__ == "__main__":
+    """
+    Loads a running simulator's ports with a mix of commands and reports throughput and latency per command, e.g.
+    python load_test.py --mix GNSS_GET_POSI=70,ADCS_GET_PRY=20,TTC_GET_MODE=10 --concurrency 1 4 16 64
+    or at fixed rates with --rate 1000 2000 4000. Several values run one step each, to show where the simulator tips
+    over.
+    """
+    parser = argparse.ArgumentParser(description="AR-OS Simulator port load generator")
+    parser.add_argument('--mix', default=LOAD_MIX, help="comma separated COMMAND[@system]=weight")
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[LOAD_CONCURRENCY],
+                        help="requests kept in flight, closed loop")
+    parser.add_argument('--rate', type=float, nargs='+', help="requests per second, open loop instead of closed")
+    parser.add_argument('--duration', type=float, default=LOAD_DURATION, help="seconds per step")
+    parser.add_argument('--warmup', type=float, default=LOAD_WARMUP, help="seconds at the start of a step not measured")
+    parser.add_argument('--connections', type=int, default=1,
+                        help="connections per port, more than one needs the port to take that many clients")
+    parser.add_argument('--port-offset', type=int, default=0, help="added to every port in the registry")
+    parser.add_argument('--registry', default=REGISTRY_PATH, help="system registry the simulator was started with")
+    parser.add_argument('--seed', type=int, default=None, help="seed for picking commands from the mix")
+    args = parser.parse_args()
+
+    asyncio.run(run(args))
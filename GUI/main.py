@@ -1,114 +1,229 @@
-from threading import Thread
+import argparse
+import random
+import time
+from threading import Event, Lock, Thread
+import display
 from display import displayController
-from systems import EPS, ESP, dragSail, GNSS, Pi_VHF, OBC, ADCS, TTC
-from display import epsDisplay, espDisplay, dragSailDisplay, gnssDisplay, pi_vhfDisplay, obcDisplay, adcsDisplay, ttcDisplay
-from interfaces import interfaceLAN_EPS, interfaceLAN_ESP, interfaceLAN_dragSail, interfaceLAN_GNSS, interfaceLAN_Pi_VHF, interfaceLAN_OBC, interfaceLAN_ADCS, interfaceLAN_TTC
+from capture import captureWriter
+from metrics import METRICS_PORT, metricsServer
+from physics import processSimulator
+from registry import REGISTRY_PATH, load_registry, build_systems
 from simulator import simulator
+from transports import make_transport
 
 import PySimpleGUI as sg
 
 
 class controller:
     """
-    Primary Controller class for the application, creates all systems and passes their objects to the display controller
-    to create the appropriate display. When run will create a new thread for the display controller and for each
-    systems network code.
+    Primary Controller class for the application, creates all systems listed in the system registry and passes their
+    objects to the display controller to create the appropriate display. When run will create a new thread for the
+    display controller and for each systems network code.
     """
 
-    def __init__(self):
-        self.close = False
+    def __init__(self, registry_path=REGISTRY_PATH, port_offset=0, capture=None, lockstep=False,
+                 physics_process=False):
+        # Set once the simulator is closing, every thread that waits between tasks waits on it so it wakes straight away
+        self.shutdown = Event()
+        # Time stop was called, to report how long closing took
+        self.stopTime = None
         self.systems = []
-        self.threads = []
+        # Threads of the display, simulator and writers, and of the interface layer which can be restarted on its own
+        self.threads = {}
+        self.interfaceThreads = []
+        # Held while the interface layer is started, stopped or restarted
+        self.interfacesLock = Lock()
+        # Shared transport serving every system's port, only used when the registry selects one
+        self.transport = None
+        # Local metrics endpoint, port 0 in the registry turns it off
+        self.metrics = None
+        # Traffic capture shared by every port, only made when asked for
+        self.capture = None
 
         print("Controller Started")
         self.displayController = displayController(self)
 
-        # Global Navigation Satellite System
-        self.GNSS = GNSS("GNSS", self, 8004)
-        self.GNSS.add_interface(interfaceLAN_EPS)
-        self.displayController.addSystem(self.GNSS, gnssDisplay)
-        self.systems.append(self.GNSS)
-
-        # Attitude Direction Control System
-        self.ADCS = ADCS("ADCS", self, 8007)
-        self.ADCS.add_interface(interfaceLAN_ADCS)
-        self.displayController.addSystem(self.ADCS, adcsDisplay)
-        self.systems.append(self.ADCS)
-
-        # Electrical Power System
-        self.EPS = EPS("EPS", self, 8001)
-        self.EPS.add_interface(interfaceLAN_EPS)
-        self.displayController.addSystem(self.EPS, epsDisplay)
-        self.systems.append(self.EPS)
-
-        # Raspberry Pi and VHF Radio
-        self.Pi_VHF = Pi_VHF("Pi VHF", self, 8005)
-        self.Pi_VHF.add_interface(interfaceLAN_Pi_VHF)
-        self.displayController.addSystem(self.Pi_VHF, pi_vhfDisplay)
-        self.systems.append(self.Pi_VHF)
+        # Creates every system listed in the registry, the registry key is kept as an attribute (e.g. self.GNSS) since the
+        # simulator and displays look systems up by it
+        self.registry = load_registry(registry_path)
+        # Checked before anything starts, an unknown transport raises here
+        make_transport(self, self.registry)
+        for entry, system in build_systems(self, self.registry, port_offset):
+            setattr(self, entry['key'], system)
+            self.displayController.addSystem(system, getattr(display, entry['display']))
+            self.systems.append(system)
+
         # Adds reference of Pi VHF to GNSS sub display for map drawing purposes
-        self.displayController.systemDisplays[0].add_Pi_VHF_ref(self.Pi_VHF)
-
-        # Electro-Spray Propulsion
-        self.ESP = ESP("ESP", self, 8002)
-        self.ESP.add_interface(interfaceLAN_ESP)
-        self.displayController.addSystem(self.ESP, espDisplay)
-        self.systems.append(self.ESP)
-
-        # Drag Sail
-        self.dragSail = dragSail("Drag Sail", self, 8003)
-        self.dragSail.add_interface(interfaceLAN_dragSail)
-        self.displayController.addSystem(self.dragSail, dragSailDisplay)
-        self.systems.append(self.dragSail)
-
-        # On Board Computer
-        self.OBC = OBC("OBC", self, 8006)
-        self.OBC.add_interface(interfaceLAN_OBC)
-        self.displayController.addSystem(self.OBC, obcDisplay)
-        self.systems.append(self.OBC)
-
-        # Telemetry Tracking and Command
-        self.TTC = TTC("TTC/GS", self, 8008)
-        self.TTC.add_interface(interfaceLAN_TTC)
-        self.displayController.addSystem(self.TTC, ttcDisplay)
-        self.systems.append(self.TTC)
-
-        # Simulator
-        self.simulator = simulator(self)
+        for sysDisplay in self.displayController.systemDisplays:
+            if isinstance(sysDisplay, display.gnssDisplay):
+                sysDisplay.add_Pi_VHF_ref(self.Pi_VHF)
+
+        metrics_port = self.registry.get('metrics_port', METRICS_PORT)
+        if metrics_port:
+            self.metrics = metricsServer(self, metrics_port + port_offset)
+
+        if capture is not None:
+            self.capture = captureWriter(capture or None)
+            for system in self.systems:
+                system.interface.capture = self.capture
+            print(f"Controller capturing traffic to {self.capture.path}")
+
+        # Simulator, its time steps run in a process of their own if asked for
+        self.simulator = processSimulator(self) if physics_process else simulator(self)
         self.displayController.addSimulator(self.simulator)
+        if lockstep:
+            # AR-OS drives time from the start, so the orbit is ready for its first step
+            self.simulator.lockstep = True
+            self.simulator.orbital_elements_to_state_vectors()
+
+    @property
+    def close(self):
+        return self.shutdown.is_set()
+
+    def stop(self):
+        """
+        Tells every thread the simulation is closing, from any thread. The controller's own thread then tears everything
+        down in order.
+        """
+        if self.stopTime is None:
+            self.stopTime = time.perf_counter()
+        self.shutdown.set()
+
+    def startThread(self, name, target):
+        tempThread = Thread(target=target, args=(1,))
+        tempThread.start()
+        self.threads[name] = tempThread
+
+    def startInterfaces(self):
+        """
+        Starts serving every system's port, through the shared transport if the registry selects one
+        """
+        self.transport = make_transport(self, self.registry)
+
+        print("Controller starting port threads")
+        for entry, system in zip(self.registry['systems'], self.systems):
+            system.interface.stopping.clear()
+            if self.transport is not None and entry.get('link', 'lan') == 'lan':
+                # Served on its TCP port by the shared transport
+                self.transport.add_interface(system.interface)
+            else:
+                # Local links (Unix socket, shared memory) always run on their own thread
+                tempThread = Thread(target=system.run, args=(1,))
+                tempThread.start()
+                self.interfaceThreads.append(tempThread)
+
+        if self.transport is not None:
+            print(f"Controller starting {self.registry['transport']} transport thread")
+            tempThread = Thread(target=self.transport.run, args=(1,))
+            tempThread.start()
+            self.interfaceThreads.append(tempThread)
+
+    def stopInterfaces(self):
+        """
+        Stops serving every port and waits for the interface threads to finish, every client is disconnected. Stopping
+        wakes each thread's socket so none is left waiting out a timeout.
+        """
+        if self.transport is not None:
+            self.transport.stop()
+        for system in self.systems:
+            system.interface.stop()
+        for thread in self.interfaceThreads:
+            thread.join()
+        self.interfaceThreads = []
+        self.transport = None
+
+    def restartInterfaces(self):
+        """
+        Hot restart of the interface layer, every port is closed and opened again while the simulation carries on with
+        its state untouched. Clients have to reconnect, their subscriptions and transfers are dropped.
+        """
+        self.interfacesLock.acquire()
+        if not self.close:
+            start = time.perf_counter()
+            self.stopInterfaces()
+            self.startInterfaces()
+            print(f"Controller restarted ports in {(time.perf_counter() - start) * 1000:.0f} ms")
+        self.interfacesLock.release()
+
+    def teardown(self):
+        """
+        Closes everything in order once stopped. Ports first so no more commands arrive, then the simulation, then the
+        writers so everything the last commands and time steps produced is flushed to disk.
+        """
+        self.interfacesLock.acquire()
+        self.stopInterfaces()
+        self.interfacesLock.release()
+        if self.capture is not None:
+            self.capture.close()
+            print(f"Controller captured {self.capture.records} requests")
+
+        self.threads['simulator'].join()
+
+        self.TTC.health_log.stop()
+        self.threads['health log'].join()
+        self.TTC.flush_audio()
+
+        if self.metrics is not None:
+            self.metrics.stop()
+            self.threads['metrics'].join()
+            print(f"Controller saved metrics snapshot to {self.metrics.dump()}")
+
+        self.threads['display'].join()
+        self.threads['refresher'].join()
+        print(f"Controller Closed in {(time.perf_counter() - self.stopTime) * 1000:.0f} ms")
 
     def run(self):
         print("Controller Running")
 
         print("Controller creating display")
-        tempThread = Thread(target=self.displayController.run, args=(1,))
-        tempThread.start()
-        self.threads.append(tempThread)
+        self.startThread('display', self.displayController.run)
 
         print("Controller creating Refresher")
-        tempThread = Thread(target=self.displayController.autoRefresher, args=(1,))
-        tempThread.start()
-        self.threads.append(tempThread)
+        self.startThread('refresher', self.displayController.autoRefresher)
 
-        print("Controller starting port threads")
-        for system in self.systems:
-            tempThread = Thread(target=system.run, args=(1,))
-            tempThread.start()
-            self.threads.append(tempThread)
+        self.interfacesLock.acquire()
+        self.startInterfaces()
+        self.interfacesLock.release()
+
+        print("Controller starting health log writer")
+        self.startThread('health log', self.TTC.health_log.run)
+
+        if self.metrics is not None:
+            print("Controller starting metrics endpoint")
+            self.startThread('metrics', self.metrics.run)
 
         print("Controller running simulator thread")
-        tempThread = Thread(target=self.simulator.run, args=(1,))
-        tempThread.start()
-        self.threads.append(tempThread)
+        self.startThread('simulator', self.simulator.run)
 
-        for thread in self.threads:
-            thread.join()
-        print("Controller Closed")
+        try:
+            self.shutdown.wait()
+        except KeyboardInterrupt:
+            # Ctrl+C in the terminal closes the simulator the same as the Exit button
+            print("Controller interrupted")
+            self.stop()
+
+        self.teardown()
         return
 
 
 if __name__ == "__main__":
     # sg.preview_all_look_and_feel_themes()
 
-    SimController = controller()
+    parser = argparse.ArgumentParser(description="AR-OS subsystem simulator")
+    parser.add_argument('--registry', default=REGISTRY_PATH, help="system registry file")
+    parser.add_argument('--port-offset', type=int, default=0, help="added to every system port, to run several simulators on one host")
+    parser.add_argument('--capture', nargs='?', const='', default=None, metavar='FILE',
+                        help="record every request and response for replay.py, to a timestamped file in TTC_output if no file is given")
+    parser.add_argument('--lockstep', action='store_true',
+                        help="time only advances when AR-OS sends SIM_STEP or SIM_ADVANCE_TO, as fast as AR-OS can keep up")
+    parser.add_argument('--physics-process', action='store_true',
+                        help="run the time steps in a separate process, so the GUI and ports can not slow the orbit down")
+    parser.add_argument('--seed', type=int, default=None, help="seed for the random starting spin and radio losses, for repeatable runs")
+    args = parser.parse_args()
+
+    if args.seed is not None:
+        random.seed(args.seed)
+
+    SimController = controller(args.registry, args.port_offset, args.capture, args.lockstep,
+                              args.physics_process)
     SimController.run()
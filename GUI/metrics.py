@@ -0,0 +1,237 @@
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import os
+import time
+from threading import Lock
+import AR_OS_pb2 as pb
+
+# Local port the metrics endpoint listens on unless the registry gives "metrics_port", 0 turns the endpoint off
+METRICS_PORT = 9100
+METRICS_HOST = "127.0.0.1"
+# Seconds between the endpoint's checks for stop, kept short so closing the simulator is not held up by it
+METRICS_POLL = 0.05
+# Snapshot of every metric is written here when the simulator closes
+METRICS_DIR = "TTC_output"
+# Upper bounds in seconds of the request latency histogram buckets, a final +Inf bucket catches the rest
+LATENCY_BUCKETS = (0.000005, 0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01)
+
+
+class portMetrics:
+    """
+    Protocol metrics for one system's port, updated by the interface as it handles each request and by its listener on
+    connection events. Requests and their latencies are kept per command so polling storms show up against the
+    command causing them.
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        # command: [requests, total seconds, longest seconds, [requests per latency bucket]]
+        self.commands = {}
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.parse_errors = 0
+        self.connections_opened = 0
+        self.connections_closed = 0
+        # (codec, 'in' or 'out'): [payloads, uncompressed bytes, compressed bytes, seconds]
+        self.compression = {}
+        self.started = time.time()
+
+    def record(self, command, seconds, bytes_in=0, bytes_out=0):
+        """
+        Records one handled request, its latency and the bytes of its request and response frames
+        """
+        self.lock.acquire()
+        entry = self.commands.get(command)
+        if entry is None:
+            entry = self.commands[command] = [0, 0.0, 0.0, [0] * (len(LATENCY_BUCKETS) + 1)]
+        entry[0] += 1
+        entry[1] += seconds
+        if seconds > entry[2]:
+            entry[2] = seconds
+        entry[3][bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self.bytes_in += bytes_in
+        self.bytes_out += bytes_out
+        self.lock.release()
+
+    def record_compression(self, codec, direction, raw, compressed, seconds):
+        """
+        Records one byte_string payload decompressed ('in') or compressed ('out') with the given codec, e.g. 'zlib-6'
+        """
+        self.lock.acquire()
+        entry = self.compression.get((codec, direction))
+        if entry is None:
+            entry = self.compression[(codec, direction)] = [0, 0, 0, 0.0]
+        entry[0] += 1
+        entry[1] += raw
+        entry[2] += compressed
+        entry[3] += seconds
+        self.lock.release()
+
+    def parse_error(self, bytes_in=0, bytes_out=0):
+        self.lock.acquire()
+        self.parse_errors += 1
+        self.bytes_in += bytes_in
+        self.bytes_out += bytes_out
+        self.lock.release()
+
+    def connection_opened(self):
+        self.lock.acquire()
+        self.connections_opened += 1
+        self.lock.release()
+
+    def connection_closed(self):
+        self.lock.acquire()
+        self.connections_closed += 1
+        self.lock.release()
+
+    def snapshot(self):
+        """
+        Returns {command name: (calls, mean seconds, longest seconds)}
+        """
+        self.lock.acquire()
+        snapshot = {pb.COMMAND.Name(command): (calls, total / calls, longest)
+                    for command, (calls, total, longest, _) in self.commands.items()}
+        self.lock.release()
+        return snapshot
+
+
+def render_metrics(interfaces):
+    """
+    Returns the metrics of every interface in the Prometheus text exposition format
+    """
+    now = time.time()
+    requests = []
+    rates = []
+    latency = []
+    ports = {'bytes_received': [], 'bytes_sent': [], 'parse_errors': [], 'connections_opened': [],
+             'connections_closed': [], 'connections_active': []}
+    compression = {'payloads': [], 'raw': [], 'compressed': [], 'ratio': [], 'seconds': []}
+
+    for interface in interfaces:
+        metrics = interface.stats
+        port = f'system="{interface.system.name}",port="{interface.address}"'
+        metrics.lock.acquire()
+        uptime = max(now - metrics.started, 1e-9)
+        for command, (calls, total, _, buckets) in sorted(metrics.commands.items()):
+            labels = f'{port},command="{pb.COMMAND.Name(command)}"'
+            requests.append(f'arossim_requests_total{{{labels}}} {calls}')
+            rates.append(f'arossim_requests_per_second{{{labels}}} {calls / uptime:.3f}')
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS, buckets):
+                cumulative += count
+                latency.append(f'arossim_request_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+            latency.append(f'arossim_request_seconds_bucket{{{labels},le="+Inf"}} {calls}')
+            latency.append(f'arossim_request_seconds_sum{{{labels}}} {total:.9f}')
+            latency.append(f'arossim_request_seconds_count{{{labels}}} {calls}')
+        ports['bytes_received'].append(f'arossim_bytes_received_total{{{port}}} {metrics.bytes_in}')
+        ports['bytes_sent'].append(f'arossim_bytes_sent_total{{{port}}} {metrics.bytes_out}')
+        ports['parse_errors'].append(f'arossim_parse_errors_total{{{port}}} {metrics.parse_errors}')
+        ports['connections_opened'].append(f'arossim_connections_opened_total{{{port}}} {metrics.connections_opened}')
+        ports['connections_closed'].append(f'arossim_connections_closed_total{{{port}}} {metrics.connections_closed}')
+        ports['connections_active'].append(
+            f'arossim_connections_active{{{port}}} {metrics.connections_opened - metrics.connections_closed}')
+        for (codec, direction), (payloads, raw, compressed, seconds) in sorted(metrics.compression.items()):
+            labels = f'{port},codec="{codec}",direction="{direction}"'
+            compression['payloads'].append(f'arossim_compression_payloads_total{{{labels}}} {payloads}')
+            compression['raw'].append(f'arossim_compression_raw_bytes_total{{{labels}}} {raw}')
+            compression['compressed'].append(f'arossim_compression_compressed_bytes_total{{{labels}}} {compressed}')
+            compression['ratio'].append(f'arossim_compression_ratio{{{labels}}} {raw / max(compressed, 1):.3f}')
+            compression['seconds'].append(f'arossim_compression_seconds_total{{{labels}}} {seconds:.9f}')
+        metrics.lock.release()
+
+    lines = ['# HELP arossim_requests_total Requests handled per system port and command',
+             '# TYPE arossim_requests_total counter', *requests,
+             '# HELP arossim_requests_per_second Mean request rate since the simulator started',
+             '# TYPE arossim_requests_per_second gauge', *rates,
+             '# HELP arossim_request_seconds Time taken to handle each request, from parse to encoded response',
+             '# TYPE arossim_request_seconds histogram', *latency,
+             '# HELP arossim_bytes_received_total Bytes of request frames received, length prefix included',
+             '# TYPE arossim_bytes_received_total counter', *ports['bytes_received'],
+             '# HELP arossim_bytes_sent_total Bytes of response frames sent, length prefix included',
+             '# TYPE arossim_bytes_sent_total counter', *ports['bytes_sent'],
+             '# HELP arossim_parse_errors_total Requests that were not a valid AROS_Command',
+             '# TYPE arossim_parse_errors_total counter', *ports['parse_errors'],
+             '# HELP arossim_connections_opened_total Client connections accepted',
+             '# TYPE arossim_connections_opened_total counter', *ports['connections_opened'],
+             '# HELP arossim_connections_closed_total Client connections closed',
+             '# TYPE arossim_connections_closed_total counter', *ports['connections_closed'],
+             '# HELP arossim_connections_active Client connections currently open',
+             '# TYPE arossim_connections_active gauge', *ports['connections_active'],
+             '# HELP arossim_compression_payloads_total byte_string payloads decompressed (in) or compressed (out)',
+             '# TYPE arossim_compression_payloads_total counter', *compression['payloads'],
+             '# HELP arossim_compression_raw_bytes_total Uncompressed bytes of those payloads',
+             '# TYPE arossim_compression_raw_bytes_total counter', *compression['raw'],
+             '# HELP arossim_compression_compressed_bytes_total Compressed bytes of those payloads, as sent on the wire',
+             '# TYPE arossim_compression_compressed_bytes_total counter', *compression['compressed'],
+             '# HELP arossim_compression_ratio Uncompressed bytes per compressed byte so far',
+             '# TYPE arossim_compression_ratio gauge', *compression['ratio'],
+             '# HELP arossim_compression_seconds_total CPU time spent compressing or decompressing',
+             '# TYPE arossim_compression_seconds_total counter', *compression['seconds']]
+    return '\n'.join(lines) + '\n'
+
+
+class metricsHandler(BaseHTTPRequestHandler):
+    """
+    Answers GET /metrics with the current metrics of every system
+    """
+
+    def do_GET(self):
+        if self.path != '/metrics':
+            self.send_error(404)
+            return
+        body = render_metrics(self.server.metrics.interfaces()).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Scrapes every few seconds would drown the simulator's own output
+        pass
+
+
+class metricsServer:
+    """
+    Local HTTP endpoint serving the protocol metrics of every system port for Prometheus to scrape, and the snapshot
+    written when the simulator closes
+    """
+
+    def __init__(self, controller, port=METRICS_PORT, directory=METRICS_DIR):
+        self.controller = controller
+        self.port = port
+        self.directory = directory
+        self.server = None
+
+    def interfaces(self):
+        return [system.interface for system in self.controller.systems]
+
+    def run(self, _):
+        """
+        Main function for the metrics thread, serves requests until stop is called
+        """
+        self.server = ThreadingHTTPServer((METRICS_HOST, self.port), metricsHandler)
+        self.server.metrics = self
+        print(f"Thread for metrics endpoint running on http://{METRICS_HOST}:{self.port}/metrics")
+        if not self.controller.close:
+            self.server.serve_forever(poll_interval=METRICS_POLL)
+        self.server.server_close()
+        print("Thread for metrics endpoint closed")
+
+    def stop(self):
+        """
+        Stops the endpoint from any thread
+        """
+        if self.server is not None:
+            self.server.shutdown()
+
+    def dump(self):
+        """
+        Writes the current metrics to a timestamped file in the output directory, returns its path
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f'metrics_{time.strftime("%d-%m-%y_%H-%M-%S")}.prom')
+        f = open(path, 'wt')
+        f.write(render_metrics(self.interfaces()))
+        f.close()
+        return path
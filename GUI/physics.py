@@ -0,0 +1,422 @@
+import multiprocessing
+import signal
+import struct
+import time
+from threading import Lock
+import numpy as np
+from simulator import LOCKSTEP_MAX_STEPS, simulator
+from systems import ADCS, ADCS_mode, EPS, EPSState, ESP, ESPState, GNSS
+
+# State the physics process owns, as (owner, attribute, values, convert back), the owner being the simulator or the
+# registry key of a system. Enums are stored by their value.
+PHYSICS_STATE = (
+    ('simulator', 'time', 1, float),
+    ('simulator', 'desiredTime', 1, float),
+    ('simulator', 'dt', 1, int),
+    ('simulator', 'realTime', 1, bool),
+    ('simulator', 'lockstep', 1, bool),
+    ('simulator', 'semiMajor', 1, float),
+    ('simulator', 'eccentricity', 1, float),
+    ('simulator', 'inclination', 1, float),
+    ('simulator', 'raan', 1, float),
+    ('simulator', 'arg_periapsis', 1, float),
+    ('simulator', 'true_anomaly', 1, float),
+    ('simulator', 'position', 3, np.array),
+    ('simulator', 'velocity', 3, np.array),
+    ('simulator', 'angel', 3, list),
+    ('simulator', 'angular_velocity', 3, list),
+    ('simulator', 'tumbling', 1, bool),
+    ('ADCS', 'mode', 1, lambda value: ADCS_mode(int(value))),
+    ('EPS', 'charge', 1, float),
+    ('EPS', 'power_saving', 1, bool),
+    ('EPS', 'status', 1, lambda value: EPSState(int(value))),
+    ('ESP', 'fuel', 1, float),
+    ('ESP', 'engine_temp', 1, float),
+    ('ESP', 'status', 1, lambda value: ESPState(int(value))),
+)
+
+# Shared block, a header, every value of PHYSICS_STATE as a double, then a ring of the values after each of the last
+# PHYSICS_HISTORY steps so the simulator can hand the systems every step however far behind it is
+PHYSICS_HEADER = struct.Struct('<QQQ')  # sequence (odd while the state is being written), last command applied, steps
+PHYSICS_NOTIFY = PHYSICS_HEADER.size  # byte set by the physics process when it tells the simulator of a new state
+PHYSICS_WRITING = struct.Struct('<Q')  # steps in the ring counting the one being written, set before writing it
+PHYSICS_WRITING_OFFSET = PHYSICS_NOTIFY + 8
+PHYSICS_READ = struct.Struct('<Q')  # steps the simulator has handed to the systems, set by the simulator
+PHYSICS_READ_OFFSET = PHYSICS_WRITING_OFFSET + PHYSICS_WRITING.size
+PHYSICS_VALUES = struct.Struct(f'<{sum(field[2] for field in PHYSICS_STATE)}d')
+PHYSICS_OFFSET = PHYSICS_READ_OFFSET + PHYSICS_READ.size
+PHYSICS_HISTORY = 4096  # Steps kept in the ring, more than one lockstep request can do
+PHYSICS_AHEAD = 1024  # Most steps a free run gets ahead of the simulator, the rest of the ring is left for lockstep
+PHYSICS_RING = PHYSICS_OFFSET + PHYSICS_VALUES.size
+PHYSICS_SIZE = PHYSICS_RING + PHYSICS_HISTORY * PHYSICS_VALUES.size
+
+# Timings, seconds
+PHYSICS_IDLE = 1  # Longest the physics process waits for a command when it has no steps to do
+PHYSICS_POLL = 0.1  # Longest the mirror waits for a new state before checking for edits to send anyway
+PHYSICS_INTERVAL = 0.01  # Shortest time between mirror updates, so a fast run does not take the GIL back
+PHYSICS_ACK_POLL = 0.0002  # Between checks while waiting for a command to be applied
+PHYSICS_STOP_TIMEOUT = 2  # Given to the physics process to exit before it is killed
+
+
+def flatten(value, length):
+    """
+    Values of one field as a tuple of floats
+    """
+    if length == 1:
+        return (float(getattr(value, 'value', value)),)
+    return tuple(float(v) for v in value)
+
+
+def state_owners(sim):
+    """
+    Object holding each field of PHYSICS_STATE
+    """
+    return [sim if owner == 'simulator' else getattr(sim.controller, owner) for owner, _, _, _ in PHYSICS_STATE]
+
+
+def read_fields(owners):
+    return [flatten(getattr(owner, field[1]), field[2]) for owner, field in zip(owners, PHYSICS_STATE)]
+
+
+def write_field(owners, index, values):
+    _, attribute, length, convert = PHYSICS_STATE[index]
+    setattr(owners[index], attribute, convert(values[0] if length == 1 else values))
+
+
+def field_slices():
+    """
+    Where each field of PHYSICS_STATE is in a tuple of every value
+    """
+    slices = []
+    offset = 0
+    for field in PHYSICS_STATE:
+        slices.append(slice(offset, offset + field[2]))
+        offset += field[2]
+    return slices
+
+
+PHYSICS_SLICES = field_slices()
+
+
+class physicsController:
+    """
+    Stands in for the controller in the physics process, holding only the systems the propagator reads and changes.
+    The radios are left in the simulator's process, the GNSS is only here since initializing an orbit clears its trail.
+    """
+
+    def __init__(self):
+        self.close = False
+        self.systems = []
+        self.GNSS = GNSS('GNSS', self)
+        self.ADCS = ADCS('ADCS', self)
+        self.EPS = EPS('EPS', self)
+        self.ESP = ESP('ESP', self)
+        self.Pi_VHF = None
+        self.TTC = None
+
+
+class physicsEngine:
+    """
+    Runs in the physics process, propagating a simulator of its own and publishing its state to the shared block after
+    every step and every command. The state is written as a seqlock, the sequence is odd while it is being written so the
+    simulator's process can tell a torn read and try again. Each step's values also go into the ring, announced in
+    PHYSICS_WRITING before its slot is written and counted in the header once published. A free run waits for the
+    simulator to read the ring rather than get more than PHYSICS_AHEAD steps ahead of it.
+    """
+
+    def __init__(self, block, commands, notices):
+        self.block = block
+        self.commands = commands
+        self.notices = notices
+        self.controller = physicsController()
+        self.simulator = simulator(self.controller)
+        self.owners = state_owners(self.simulator)
+        self.sequence = 0
+        self.applied = 0
+        self.steps = 0
+
+    def values(self):
+        return [v for values in read_fields(self.owners) for v in values]
+
+    def step(self):
+        """
+        Does one time step and writes the values it reached into the ring
+        """
+        self.simulator.propagate()
+        PHYSICS_WRITING.pack_into(self.block, PHYSICS_WRITING_OFFSET, self.steps + 1)
+        slot = self.steps % PHYSICS_HISTORY
+        PHYSICS_VALUES.pack_into(self.block, PHYSICS_RING + slot * PHYSICS_VALUES.size, *self.values())
+        self.steps += 1
+
+    def behind(self):
+        """
+        Returns True if a free run has got as far ahead of the simulator as it may
+        """
+        read = PHYSICS_READ.unpack_from(self.block, PHYSICS_READ_OFFSET)[0]
+        return self.steps - read >= PHYSICS_AHEAD
+
+    def publish(self):
+        PHYSICS_HEADER.pack_into(self.block, 0, self.sequence + 1, self.applied, self.steps)
+        PHYSICS_VALUES.pack_into(self.block, PHYSICS_OFFSET, *self.values())
+        self.sequence += 2
+        PHYSICS_HEADER.pack_into(self.block, 0, self.sequence, self.applied, self.steps)
+        # Only tells the simulator when it has read every state before, so a fast run does not fill the pipe
+        if not self.block[PHYSICS_NOTIFY]:
+            self.block[PHYSICS_NOTIFY] = 1
+            self.notices.send_bytes(b'\x01')
+
+    def handle(self, command):
+        """
+        Applies one command from the simulator, returns False once told to stop
+        """
+        kind = command[0]
+        if kind == 'stop':
+            return False
+        sim = self.simulator
+        if kind == 'set':
+            for index, values in command[2].items():
+                write_field(self.owners, index, values)
+        elif kind == 'step':
+            for _ in range(command[2]):
+                self.step()
+            sim.desiredTime = sim.time
+        elif kind == 'advance_to':
+            steps = 0
+            while sim.time < command[2] and steps < command[3]:
+                self.step()
+                steps += 1
+            sim.desiredTime = sim.time
+        elif kind == 'init':
+            sim.orbital_elements_to_state_vectors()
+        self.applied = command[1]
+        self.publish()
+        return True
+
+    def run(self):
+        sim = self.simulator
+        while True:
+            # Commands first so a step always sees the latest settings
+            while self.commands.poll():
+                if not self.handle(self.commands.recv()):
+                    return
+            if not sim.lockstep and sim.time < sim.desiredTime:
+                if self.behind():
+                    # Waits for the simulator to read the ring, still taking commands
+                    self.commands.poll(PHYSICS_ACK_POLL)
+                else:
+                    self.step()
+                    self.publish()
+            else:
+                # Woken straight away by the next command
+                self.commands.poll(PHYSICS_IDLE)
+            sim.update_desired_time()
+
+
+def run_physics(block, commands, notices):
+    """
+    Entry point of the physics process
+    """
+    # Ctrl+C reaches the whole process group, the simulator stops this process itself
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    try:
+        physicsEngine(block, commands, notices).run()
+    except (EOFError, BrokenPipeError):
+        # The simulator's process has gone
+        pass
+
+
+class processSimulator(simulator):
+    """
+    Simulator whose time steps run in a process of their own, so drawing the GUI and serving the ports in this process
+    can no longer starve the propagator of the GIL.
+
+    The physics process owns the orbit, attitude, charge and engine (PHYSICS_STATE) and publishes them through a shared
+    block. The thread that would have run the simulation mirrors that state into this simulator and its systems, and
+    for every step the physics process has done since the last update hands that step's values to the GNSS, ADCS and
+    radios the same as a time step would, so connectivity, radio links and pushes move on a step at a time as they do
+    without the physics process. A free run waits for this simulator rather than get more than PHYSICS_AHEAD steps
+    ahead, and lockstep requests are capped, so steps are only folded into one if several capped requests arrive
+    together and outrun the ring.
+
+    Anything changed here, from the GUI or by AR-OS, is sent to the physics process the next time the state is mirrored,
+    and a value changed here wins over the physics process changing it at the same time. Steps, lockstep and initializing
+    the orbit are sent as commands and wait for the physics process to apply them.
+    """
+
+    def __init__(self, controller):
+        simulator.__init__(self, controller)
+        self.owners = state_owners(self)
+        # Values of each field as last sent or mirrored, None until first sent
+        self.mirrored = [None] * len(PHYSICS_STATE)
+        # Last command sent, the last the mirrored state has applied, and the steps handed to the systems
+        self.sent = 0
+        self.applied = 0
+        self.steps = 0
+        # Held over a whole mirror update, pushes included, so a reply waiting on a command goes out after its pushes
+        self.mirrorLock = Lock()
+
+        self.block = multiprocessing.RawArray('B', PHYSICS_SIZE)
+        # Commands to the physics process, and its notices of a new state back
+        commands, self.commands = multiprocessing.Pipe(duplex=False)
+        self.notices, notices = multiprocessing.Pipe(duplex=False)
+        self.process = multiprocessing.Process(target=run_physics, args=(self.block, commands, notices),
+                                               name='physics', daemon=True)
+        self.process.start()
+        # Ends used by the physics process
+        commands.close()
+        notices.close()
+
+        # Start the physics process from this simulator's state
+        self.lock.acquire()
+        self.send_changes()
+        self.lock.release()
+
+    def send(self, *command):
+        """
+        Sends a command to the physics process, returns its number. Called with the lock held.
+        """
+        self.sent += 1
+        self.commands.send((command[0], self.sent) + command[1:])
+        return self.sent
+
+    def send_changes(self):
+        """
+        Sends every value changed here since it was last sent or mirrored. Called with the lock held.
+        """
+        changes = {}
+        for index, values in enumerate(read_fields(self.owners)):
+            if values != self.mirrored[index]:
+                changes[index] = self.mirrored[index] = values
+        if changes:
+            self.send('set', changes)
+
+    def read(self):
+        """
+        Returns (last command applied, steps done, values) from the shared block once it reads the same before and after
+        """
+        while True:
+            sequence, applied, steps = PHYSICS_HEADER.unpack_from(self.block, 0)
+            if not sequence & 1:
+                values = PHYSICS_VALUES.unpack_from(self.block, PHYSICS_OFFSET)
+                if PHYSICS_HEADER.unpack_from(self.block, 0)[0] == sequence:
+                    return applied, steps, values
+            time.sleep(0)
+
+    def history(self, steps):
+        """
+        Returns the values after each step from the last one handed to the systems up to steps, as (steps it stands for,
+        values). Steps the ring no longer holds are folded into the first one it does.
+        """
+        first = max(self.steps, steps - PHYSICS_HISTORY)
+        states = [PHYSICS_VALUES.unpack_from(self.block, PHYSICS_RING + (step % PHYSICS_HISTORY) * PHYSICS_VALUES.size)
+                  for step in range(first, steps)]
+        # The physics process carries on stepping while the ring is read, writing over the oldest steps
+        writing = PHYSICS_WRITING.unpack_from(self.block, PHYSICS_WRITING_OFFSET)[0]
+        overwritten = min(max(writing - PHYSICS_HISTORY - first, 0), len(states))
+        if overwritten:
+            states = states[overwritten:]
+            first += overwritten
+        return [(first - self.steps + 1 if i == 0 else 1, state) for i, state in enumerate(states)]
+
+    def apply(self, values, fields):
+        """
+        Writes the given fields of values into this simulator and its systems. Called with the lock held.
+        """
+        for index in fields:
+            incoming = values[PHYSICS_SLICES[index]]
+            if incoming != self.mirrored[index]:
+                write_field(self.owners, index, incoming)
+                self.mirrored[index] = incoming
+
+    def mirror(self):
+        """
+        Brings this simulator up to the physics process's latest state and hands it to the systems as a time step would
+        """
+        self.mirrorLock.acquire()
+        self.lock.acquire()
+        self.send_changes()
+        # Cleared before reading, a state published after this always notifies again
+        self.block[PHYSICS_NOTIFY] = 0
+        applied, steps, values = self.read()
+        pushes = []
+        # A state from before the last command would undo edits the physics process has not seen yet
+        if applied >= self.sent:
+            # Fields changed here since the last update are left for the next one to send
+            current = read_fields(self.owners)
+            fields = [index for index, values_here in enumerate(current) if values_here == self.mirrored[index]]
+            for count, state in self.history(steps):
+                self.apply(state, fields)
+                pushes.extend(self.update_systems(self.dt * count))
+            # Covers commands that changed the state without a step, e.g. initializing the orbit
+            self.apply(values, fields)
+            self.steps = steps
+            PHYSICS_READ.pack_into(self.block, PHYSICS_READ_OFFSET, steps)
+            self.applied = applied
+        self.lock.release()
+
+        self.send_pushes(pushes)
+        self.mirrorLock.release()
+
+    def wait_for(self, command):
+        while self.applied < command and not self.controller.close and self.process.is_alive():
+            time.sleep(PHYSICS_ACK_POLL)
+            self.mirror()
+
+    def run_command(self, *command):
+        self.lock.acquire()
+        # Edits made here go first, so the command sees them
+        self.send_changes()
+        number = self.send(*command)
+        self.lock.release()
+        self.wait_for(number)
+
+    def orbital_elements_to_state_vectors(self):
+        self.run_command('init')
+        self.GNSS.clear()
+
+    def doTimeStep(self):
+        self.run_command('step', 1)
+
+    def advance(self, steps, limit=LOCKSTEP_MAX_STEPS):
+        self.run_command('step', min(steps, limit))
+        return self.time
+
+    def advance_to(self, target, limit=LOCKSTEP_MAX_STEPS):
+        self.run_command('advance_to', target, limit)
+        return self.time
+
+    def run(self, _):
+        """
+        Main loop for the thread that mirrors the physics process, stops the process once the simulator is closed
+        """
+        print("Thread for Simulator mirroring physics process", self.process.pid)
+        while not self.controller.close:
+            if not self.process.is_alive():
+                print(f"Physics process exited with {self.process.exitcode}")
+                break
+            start = time.perf_counter()
+            try:
+                if self.notices.poll(PHYSICS_POLL):
+                    while self.notices.poll():
+                        self.notices.recv_bytes()
+            except EOFError:
+                # Physics process gone, reported on the next pass
+                continue
+            self.mirror()
+            # Woken straight away if the simulator is closed
+            self.controller.shutdown.wait(PHYSICS_INTERVAL - (time.perf_counter() - start))
+
+        self.stop_process()
+        print("Thread for Simulator Closing")
+
+    def stop_process(self):
+        try:
+            self.commands.send(('stop',))
+        except OSError:
+            pass
+        self.process.join(PHYSICS_STOP_TIMEOUT)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.commands.close()
+        self.notices.close()
@@ -0,0 +1,179 @@
+import random
+from collections import deque
+from threading import Lock
+
+# Defaults for a radio link, all in sim time so links speed up with the simulation. Rate in bits per second, delay
+# and jitter in seconds, loss as the chance of each packet being lost
+LINK_RATE = 9600
+LINK_DELAY = 0.005
+LINK_JITTER = 0.002
+LINK_LOSS = 0.0
+# Bytes allowed to wait for the transmitter before new packets are dropped, 0 for no limit
+LINK_QUEUE_LIMIT = 0
+
+
+class linkPass:
+    """
+    Traffic counts for one pass, from the link coming up to it going down
+    """
+    __slots__ = ('start', 'end', 'offered', 'delivered', 'packets', 'lost', 'dropped', 'cut')
+
+    def __init__(self, start):
+        self.start = start
+        self.end = None
+        # Bytes given to the link and bytes that reached the other end
+        self.offered = 0
+        self.delivered = 0
+        # Packets delivered, lost to random loss, dropped by a full queue and cut off when the link went down
+        self.packets = 0
+        self.lost = 0
+        self.dropped = 0
+        self.cut = 0
+
+    def duration(self):
+        return self.end - self.start
+
+    def throughput(self):
+        """
+        Bytes per second delivered over the pass
+        """
+        duration = self.duration()
+        return self.delivered / duration if duration > 0 else 0.0
+
+    def summary(self):
+        return (f'{self.duration():.0f}s pass, {self.delivered}/{self.offered} bytes delivered '
+                f'({self.throughput():.0f} B/s), {self.packets} packets, {self.lost} lost, {self.dropped} dropped '
+                f'by full queue, {self.cut} cut off at end of pass')
+
+
+class radioLink:
+    """
+    Emulates one direction of a radio link between the satellite and the ground. Packets are sent one after another at
+    the link's data rate, arrive after the propagation delay plus jitter, and may be lost at random or dropped when too
+    much is waiting to be sent. Everything runs on sim time, packets sent between time steps are delivered by step()
+    once the simulation reaches their arrival time. A sender that wants to send again what never arrived can ask to be
+    told of each packet lost in the air or cut off when the link goes down.
+
+    Packets are only carried while the link is up, each time it comes up a new pass is started and its traffic is
+    counted so the achievable downlink per pass can be measured.
+    """
+    __slots__ = ('name', 'rate', 'delay', 'jitter', 'loss', 'queue_limit', 'up', 'busy_until', 'last_arrival',
+                 'in_flight', 'current', 'passes', 'random', 'lock')
+
+    def __init__(self, name, rate=LINK_RATE, delay=LINK_DELAY, jitter=LINK_JITTER, loss=LINK_LOSS,
+                 queue_limit=LINK_QUEUE_LIMIT):
+        self.name = name
+        self.rate = rate
+        self.delay = delay
+        self.jitter = jitter
+        self.loss = loss
+        self.queue_limit = queue_limit
+
+        self.up = False
+        # Sim time the transmitter finishes sending everything queued so far
+        self.busy_until = 0.0
+        # Packets arrive in the order they were sent, so jitter never lets one overtake another
+        self.last_arrival = 0.0
+        # (arrival time, packet, deliver, lose, bytes on air) of every packet sent and not yet delivered, deliver is None
+        # for a packet lost in the air that its sender is told of once it would have arrived
+        self.in_flight = deque()
+        self.current = None
+        self.passes = []
+        # Seeded from the module generator so a run started with a fixed seed is repeatable
+        self.random = random.Random(random.getrandbits(64))
+        self.lock = Lock()
+
+    def backlog(self, now):
+        """
+        Bytes still waiting to be transmitted at sim time now
+        """
+        return max(0.0, self.busy_until - now) * self.rate / 8
+
+    def set_up(self, up, now):
+        """
+        Brings the link up or down at sim time now, returns the pass that just ended when the link goes down
+        """
+        ended = None
+        cut = []
+        self.lock.acquire()
+        if up and not self.up:
+            self.current = linkPass(now)
+            self.busy_until = now
+            self.last_arrival = now
+        elif not up and self.up:
+            # Anything still queued or in the air is lost with the link
+            for _, packet, deliver, lose, _ in self.in_flight:
+                if deliver is not None:
+                    self.current.cut += 1
+                if lose is not None:
+                    cut.append((packet, lose))
+            self.in_flight.clear()
+            self.current.end = now
+            self.passes.append(self.current)
+            ended = self.current
+            self.current = None
+        self.up = up
+        self.lock.release()
+
+        # Told outside the lock so a sender can send again once the link is back
+        for packet, lose in cut:
+            lose(packet)
+        return ended
+
+    def send(self, packet, now, deliver, size=None, lose=None):
+        """
+        Sends a packet at sim time now, deliver(packet) is called by step() when it arrives. size is the bytes it takes
+        on air if not its length, e.g. when sent compressed. Returns False if the packet could not be sent because the
+        link is down or the queue is full, a packet lost in the air still returns True since the sender cannot tell.
+        If given, lose(packet) is called instead of deliver once a lost packet would have arrived, or when the link goes
+        down before it arrives.
+        """
+        if size is None:
+            size = len(packet)
+        self.lock.acquire()
+        if not self.up:
+            self.lock.release()
+            return False
+
+        current = self.current
+        current.offered += size
+        if self.queue_limit and self.backlog(now) + size > self.queue_limit:
+            current.dropped += 1
+            self.lock.release()
+            return False
+
+        # Transmission starts once everything before it has been sent
+        self.busy_until = max(self.busy_until, now) + size * 8 / self.rate
+        if self.random.random() < self.loss:
+            current.lost += 1
+            # Kept in order with the rest so its sender hears of it no sooner than of the packets sent before it
+            deliver = None
+        if deliver is not None or lose is not None:
+            arrival = self.busy_until + self.delay + self.random.uniform(-self.jitter, self.jitter)
+            self.last_arrival = max(arrival, self.last_arrival)
+            self.in_flight.append((self.last_arrival, packet, deliver, lose, size))
+        self.lock.release()
+        return True
+
+    def step(self, now):
+        """
+        Delivers every packet that has arrived by sim time now, and tells the sender of every lost one that would have
+        """
+        arrived = []
+        self.lock.acquire()
+        while self.in_flight and self.in_flight[0][0] <= now:
+            _, packet, deliver, lose, size = self.in_flight.popleft()
+            if deliver is None:
+                arrived.append((packet, lose))
+                continue
+            self.current.delivered += size
+            self.current.packets += 1
+            arrived.append((packet, deliver))
+        self.lock.release()
+
+        # Delivered outside the lock so a delivery can send on the link
+        for packet, deliver in arrived:
+            deliver(packet)
+
+    def idle(self):
+        return not self.in_flight
@@ -0,0 +1,60 @@
+import json
+import os
+from enum import Enum
+import systems
+import interfaces
+
+REGISTRY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "systems.json")
+
+
+def load_registry(path=REGISTRY_PATH):
+    """
+    Reads the system registry, a JSON file listing each system the simulator creates along with the class used for its
+    state, its interface and display, the port it listens on, the link AR-OS reaches it over, and any initial values
+    that differ from the class defaults
+    """
+    f = open(path, 'rt')
+    registry = json.load(f)
+    f.close()
+    return registry
+
+
+def build_system(controller, entry, port_offset=0):
+    """
+    Creates the system described by one registry entry, applies its initial values and attaches its interface. The port
+    offset is added to the configured port so several simulators can run side by side on one host.
+    """
+    system_class = getattr(systems, entry['class'])
+    system = system_class(entry['name'], controller, entry['port'] + port_offset)
+
+    # "link" picks how AR-OS reaches the system, lan (default), unix or shm for an AR-OS on the same host
+    system.add_interface(interfaces.with_link(getattr(interfaces, entry['interface']), entry.get('link', 'lan')))
+
+    # Applied once the interface exists so its settings can be given too (e.g. "interface.max_clients": 2)
+    for key, value in entry.get('initial', {}).items():
+        set_initial(system, key, value)
+    return system
+
+
+def set_initial(system, key, value):
+    """
+    Sets one initial value, a dotted key sets an attribute of a member (e.g. "gs_to_aros.depth") and enum attributes
+    are given by member name (e.g. "status": "SIMULATED")
+    """
+    target = system
+    *path, attribute = key.split('.')
+    for name in path:
+        target = getattr(target, name)
+
+    current = getattr(target, attribute)
+    if isinstance(current, Enum):
+        value = type(current)[value]
+    # Systems use __slots__, so an unknown attribute in the registry raises here rather than being silently added
+    setattr(target, attribute, value)
+
+
+def build_systems(controller, registry, port_offset=0):
+    """
+    Creates every system in the registry in order, returns a list of (entry, system) pairs
+    """
+    return [(entry, build_system(controller, entry, port_offset)) for entry in registry['systems']]
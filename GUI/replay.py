@@ -0,0 +1,312 @@
+import argparse
+import asyncio
+import sys
+import time
+from collections import defaultdict
+from google.protobuf import text_format
+from google.protobuf.message import DecodeError
+import AR_OS_pb2 as pb
+from capture import CAPTURE_CLOSE, CAPTURE_REQUEST, CAPTURE_RESPONSE, read_capture
+from interfaces import HOST
+from load_test import LOAD_PERCENTILES, percentile
+from sharedmem import link_path
+
+# Seconds to wait for each reply before counting it as missing
+REPLAY_TIMEOUT = 2.0
+# Differences printed for each command
+REPLAY_EXAMPLES = 3
+
+
+class replayExchange:
+    """
+    One captured request and the response frames sent back for it
+    """
+    __slots__ = ('time', 'command', 'request', 'responses')
+
+    def __init__(self, moment, request):
+        self.time = moment
+        self.request = request
+        self.responses = []
+        aros_com = pb.AROS_Command()
+        try:
+            aros_com.ParseFromString(request)
+            self.command = aros_com.command if aros_com.IsInitialized() else None
+        except DecodeError:
+            # Captured as AR-OS sent it, replayed the same
+            self.command = None
+
+
+def split_frames(data):
+    """
+    Splits length prefixed frames into their bodies
+    """
+    bodies = []
+    offset = 0
+    while offset + 4 <= len(data):
+        length = int.from_bytes(data[offset:offset + 4], 'little')
+        bodies.append(data[offset + 4:offset + 4 + length])
+        offset += 4 + length
+    return bodies
+
+
+def load_sessions(path):
+    """
+    Reads a capture into the sessions of each port, {port: [[replayExchange]]} with a port's sessions in the order they
+    connected, and returns them with the time of the first request
+    """
+    sessions = {}
+    exchanges = defaultdict(list)
+    origin = None
+    for kind, port, connection, moment, _, payload in read_capture(path):
+        key = (port, connection)
+        if kind == CAPTURE_REQUEST:
+            if key not in exchanges:
+                sessions.setdefault(port, []).append(exchanges[key])
+            exchanges[key].append(replayExchange(moment, payload))
+            if origin is None:
+                origin = moment
+        elif kind == CAPTURE_RESPONSE:
+            # Always written straight after its request
+            exchanges[key][-1].responses = split_frames(payload)
+        elif kind == CAPTURE_CLOSE:
+            # Connection numbers are not reused, but forget it so a bad capture can not merge two sessions
+            exchanges.pop(key, None)
+    return sessions, origin
+
+
+def diff_response(expected, actual, ignore=()):
+    """
+    Returns the names of the fields that differ between two response bodies, ignoring the given ones, so responses
+    encoded differently but holding the same values match
+    """
+    if expected == actual:
+        return []
+    expected_resp = pb.Simulator_Response()
+    actual_resp = pb.Simulator_Response()
+    try:
+        expected_resp.ParseFromString(expected)
+        actual_resp.ParseFromString(actual)
+    except DecodeError:
+        return ['undecodable']
+
+    fields = []
+    for field in pb.Simulator_Response.DESCRIPTOR.fields:
+        if field.name in ignore:
+            continue
+        if field.label == field.LABEL_REPEATED:
+            differs = list(getattr(expected_resp, field.name)) != list(getattr(actual_resp, field.name))
+        else:
+            differs = expected_resp.HasField(field.name) != actual_resp.HasField(field.name) or \
+                getattr(expected_resp, field.name) != getattr(actual_resp, field.name)
+        if differs:
+            fields.append(field.name)
+    return fields
+
+
+def describe(body):
+    response = pb.Simulator_Response()
+    try:
+        response.ParseFromString(body)
+    except DecodeError:
+        return repr(bytes(body[:32]))
+    return text_format.MessageToString(response, as_one_line=True)
+
+
+class commandResults:
+    """
+    Latencies and differences of one command over the whole replay
+    """
+    __slots__ = ('latencies', 'matched', 'differed', 'missing', 'fields', 'examples')
+
+    def __init__(self):
+        self.latencies = []
+        self.matched = 0
+        self.differed = 0
+        self.missing = 0
+        # field: responses it differed in
+        self.fields = defaultdict(int)
+        self.examples = []
+
+
+class replayer:
+    """
+    Feeds a captured AR-OS session back into the simulator and compares every response with the one captured. Sessions
+    of different ports run at the same time. A port's sessions run one after another as they did when captured, since
+    a port serves a single client unless the registry allows more.
+
+    With speed 1 requests are sent at their captured times, with speed N N times faster, and with speed 0 each request
+    is sent as soon as the one before it on its connection is answered. A request not answered within REPLAY_TIMEOUT
+    ends its session, the rest of it is counted as missing and the port's next session connects again. Pushes from subscriptions are not captured and
+    are skipped. Bulk audio chunks and anything else depending on the sim time the simulator has reached only match if
+    it is replayed from the same state.
+    """
+
+    def __init__(self, sessions, origin, speed=1.0, port_offset=0, link='lan', ignore=(), examples=REPLAY_EXAMPLES):
+        self.sessions = sessions
+        self.origin = origin
+        self.speed = speed
+        self.port_offset = port_offset
+        self.link = link
+        self.ignore = set(ignore)
+        # Differing responses kept to show for each command
+        self.examples = examples
+        self.results = defaultdict(commandResults)
+        # How late each paced request was sent, seconds
+        self.lateness = []
+        self.start = None
+
+    async def run(self):
+        """
+        Replays every session, returns the seconds taken
+        """
+        self.start = time.perf_counter()
+        await asyncio.gather(*(self.replay_port(port, sessions) for port, sessions in self.sessions.items()))
+        return time.perf_counter() - self.start
+
+    async def open(self, port):
+        if self.link == 'lan':
+            return await asyncio.open_connection(HOST, port)
+        if self.link == 'unix':
+            return await asyncio.open_unix_connection(link_path(port, 'sock'))
+        raise ValueError(f"Replay can not reach a system over the {self.link} link")
+
+    async def replay_port(self, port, sessions):
+        for exchanges in sessions:
+            reader, writer = await self.open(port + self.port_offset)
+            try:
+                for i, exchange in enumerate(exchanges):
+                    await self.wait_until(exchange)
+                    if not await self.replay(reader, writer, exchange):
+                        # A reply cut off part way leaves the stream at an unknown offset, every later reply would be
+                        # read out of step, so the rest of the session counts as missing
+                        for skipped in exchanges[i + 1:]:
+                            self.results[skipped.command].missing += 1
+                        break
+            finally:
+                writer.close()
+                try:
+                    await writer.wait_closed()
+                except ConnectionError:
+                    pass
+
+    async def wait_until(self, exchange):
+        """
+        Sleeps until the exchange is due at the replay's speed, recording how late it is once due
+        """
+        if not self.speed:
+            return
+        due = self.start + (exchange.time - self.origin) / self.speed
+        delay = due - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        self.lateness.append(time.perf_counter() - due)
+
+    async def replay(self, reader, writer, exchange):
+        """
+        Sends one request and compares its replies, returns False if they did not all arrive and the connection can not
+        be used for the rest of the session
+        """
+        results = self.results[exchange.command]
+        start = time.perf_counter()
+        writer.write(len(exchange.request).to_bytes(4, 'little') + exchange.request)
+        replies = []
+        try:
+            for _ in exchange.responses:
+                replies.append(await asyncio.wait_for(self.read_reply(reader), REPLAY_TIMEOUT))
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+            pass
+        results.latencies.append(time.perf_counter() - start)
+
+        if len(replies) < len(exchange.responses):
+            results.missing += 1
+            return False
+        fields = set()
+        for expected, actual in zip(exchange.responses, replies):
+            fields.update(diff_response(expected, actual, self.ignore))
+        if not fields:
+            results.matched += 1
+            return True
+        results.differed += 1
+        for field in fields:
+            results.fields[field] += 1
+        if len(results.examples) < self.examples:
+            results.examples.append((exchange.responses, replies))
+        return True
+
+    async def read_reply(self, reader):
+        """
+        Returns the body of the next frame that is not a subscription push
+        """
+        while True:
+            length = int.from_bytes(await reader.readexactly(4), 'little')
+            body = await reader.readexactly(length)
+            response = pb.Simulator_Response()
+            try:
+                response.ParseFromString(body)
+            except DecodeError:
+                return body
+            if not response.HasField('subscription') or response.response == pb.RESPONSE.GEN_SUBSCRIBED:
+                return body
+
+    def failed(self):
+        return any(results.differed or results.missing for results in self.results.values())
+
+
+def command_name(command):
+    return 'INVALID' if command is None else pb.COMMAND.Name(command)
+
+
+def report(replay, seconds, captured_seconds):
+    """
+    Prints throughput, latency percentiles in milliseconds and how many responses matched, per command
+    """
+    requests = sum(len(results.latencies) for results in replay.results.values())
+    sessions = sum(len(sessions) for sessions in replay.sessions.values())
+    print(f"Replayed {requests} requests in {sessions} sessions over {seconds:.3f} s, {requests / seconds:.1f} req/s "
+          f"(captured over {captured_seconds:.3f} s)")
+    if replay.lateness:
+        lateness = sorted(replay.lateness)
+        print(f"Sent late by p50 {percentile(lateness, 50) * 1000:.3f} ms, max {lateness[-1] * 1000:.3f} ms")
+
+    header = f"{'command':<28}{'requests':>9}{'matched':>9}{'differ':>8}{'missing':>9}"
+    header += ''.join(f"{f'p{p}':>9}" for p in LOAD_PERCENTILES) + f"{'max':>9}"
+    print(header)
+    for command, results in sorted(replay.results.items(), key=lambda item: command_name(item[0])):
+        latencies = sorted(results.latencies)
+        line = f"{command_name(command):<28}{len(latencies):>9}{results.matched:>9}{results.differed:>8}"
+        line += f"{results.missing:>9}"
+        line += ''.join(f"{percentile(latencies, p) * 1000:>9.3f}" for p in LOAD_PERCENTILES)
+        print(line + f"{latencies[-1] * 1000:>9.3f}")
+
+    for command, results in sorted(replay.results.items(), key=lambda item: command_name(item[0])):
+        if not results.differed:
+            continue
+        fields = ', '.join(f'{field} ({count})' for field, count in sorted(results.fields.items()))
+        print(f"{command_name(command)} differs in {fields}")
+        for expected, actual in results.examples:
+            print(f"  captured {' | '.join(describe(body) for body in expected)}")
+            print(f"  replayed {' | '.join(describe(body) for body in actual)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay a captured AR-OS session against the simulator and compare the responses")
+    parser.add_argument('capture', help="capture file recorded with main.py --capture")
+    parser.add_argument('--speed', type=float, default=1.0, help="times faster than captured, 0 sends every request as soon as the last is answered")
+    parser.add_argument('--fast', action='store_true', help="same as --speed 0")
+    parser.add_argument('--port-offset', type=int, default=0, help="added to every captured port, to replay into a simulator run with a different offset")
+    parser.add_argument('--link', choices=('lan', 'unix'), default='lan', help="link the simulator's ports are reached over")
+    parser.add_argument('--ignore', nargs='*', default=[], metavar='FIELD', help="Simulator_Response fields left out of the comparison, e.g. vector single")
+    parser.add_argument('--show', type=int, default=REPLAY_EXAMPLES, help="differences printed for each command")
+    args = parser.parse_args()
+
+    sessions, origin = load_sessions(args.capture)
+    if origin is None:
+        sys.exit(f"{args.capture} holds no requests")
+    captured = max(session[-1].time for port in sessions.values() for session in port) - origin
+
+    replay = replayer(sessions, origin, 0 if args.fast else args.speed, args.port_offset, args.link, args.ignore,
+                      args.show)
+    seconds = asyncio.run(replay.run())
+    report(replay, seconds, captured)
+    # Non zero exit status when anything differs, so a replay can be used as a regression test
+    sys.exit(1 if replay.failed() else 0)
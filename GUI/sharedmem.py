@@ -0,0 +1,392 @@
+import mmap
+import os
+import select
+import socket
+import struct
+import time
+
+# Directory holding the Unix sockets, shared memory files and doorbell FIFOs of locally linked systems
+LOCAL_LINK_DIR = "/tmp/ar-os-sim"
+
+# Bytes in each direction's ring, messages bigger than this are streamed through it a piece at a time
+SHM_RING_SIZE = 1 << 20
+# Times a reader polls the ring before sleeping on its doorbell, trades a little CPU for lower latency. Only worth it
+# with a spare core, on a single core the spinning reader just delays the writer it is waiting for.
+SHM_SPIN = 200 if (os.cpu_count() or 1) > 1 else 0
+SHM_MAGIC = b'AROSSHM2'
+
+# Segment layout, magic, pid of the attached client (0 when none), head and tail byte counters of each ring, then pid
+# of the simulator that made the channel (0 once it has closed it). Both counters only ever increase, the position in
+# the ring is the counter modulo the ring size.
+SHM_CLIENT = 8
+SHM_REQUEST_RING = 16
+SHM_RESPONSE_RING = 32
+SHM_SERVER = 48
+SHM_DATA = 64
+COUNTER = struct.Struct('<Q')
+
+
+def link_path(address, suffix, directory=LOCAL_LINK_DIR):
+    """
+    Path of one of a system's local link files, named after its port so each system has its own
+    """
+    return os.path.join(directory, f"{address}.{suffix}")
+
+
+class shmRing:
+    """
+    Single producer, single consumer byte ring in a shared memory segment. The producer only writes head and the
+    consumer only writes tail, so neither side needs a lock. The producer rings the consumer's doorbell after every
+    write, a pipe write that also orders the data before the new head for the other process.
+    """
+
+    def __init__(self, segment, header, data, size, doorbell):
+        self.segment = segment
+        self.view = memoryview(segment)
+        self.head_offset = header
+        self.tail_offset = header + 8
+        self.data = data
+        self.size = size
+        # FIFO rung by this ring's producer and waited on by its consumer
+        self.doorbell = doorbell
+
+    def head(self):
+        return COUNTER.unpack_from(self.segment, self.head_offset)[0]
+
+    def tail(self):
+        return COUNTER.unpack_from(self.segment, self.tail_offset)[0]
+
+    def reset(self):
+        COUNTER.pack_into(self.segment, self.head_offset, 0)
+        COUNTER.pack_into(self.segment, self.tail_offset, 0)
+
+    def write(self, data, is_open, ring=True):
+        """
+        Copies all of data into the ring, waiting for the consumer whenever the ring is full. is_open is called while
+        waiting and the write is abandoned if it returns False. With ring=False the doorbell is only rung if the ring
+        fills, so several writes can be followed by one ring.
+        """
+        data = memoryview(data).cast('B')
+        written = 0
+        while written < len(data):
+            count = self.write_available(data[written:])
+            if count == 0:
+                if not is_open():
+                    raise ConnectionResetError("Shared memory link closed")
+                # Make sure the consumer is awake to empty it
+                self.ring()
+                # Ring full, give the consumer a moment to catch up
+                time.sleep(0.0001)
+                continue
+            written += count
+        if ring:
+            self.ring()
+
+    def write_available(self, data):
+        """
+        Copies as much of data as the ring has room for without waiting, returns the bytes copied. Does not ring.
+        """
+        data = memoryview(data).cast('B')
+        head = self.head()
+        count = min(self.size - (head - self.tail()), len(data))
+        position = head % self.size
+        first = min(count, self.size - position)
+        start = self.data + position
+        self.view[start:start + first] = data[:first]
+        if count > first:
+            # Wrapped past the end of the ring
+            self.view[self.data:self.data + count - first] = data[first:count]
+        COUNTER.pack_into(self.segment, self.head_offset, head + count)
+        return count
+
+    def ring(self):
+        try:
+            os.write(self.doorbell, b'\0')
+        except BlockingIOError:
+            # Doorbell already full of unread rings, the consumer will wake regardless
+            pass
+
+    def read_into(self, view, timeout):
+        """
+        Copies whatever is waiting in the ring into view, up to its length, and returns the number of bytes copied.
+        Polls SHM_SPIN times then sleeps on the doorbell, returning 0 if the doorbell rings with nothing to read (the
+        other side attaching or detaching) or nothing arrives within timeout seconds.
+        """
+        tail = self.tail()
+        available = self.head() - tail
+        spins = 0
+        while available == 0 and spins < SHM_SPIN:
+            spins += 1
+            available = self.head() - tail
+        if available == 0:
+            self.wait(timeout)
+            available = self.head() - tail
+            if available == 0:
+                return 0
+
+        count = min(available, len(view))
+        position = tail % self.size
+        first = min(count, self.size - position)
+        start = self.data + position
+        view[:first] = self.view[start:start + first]
+        if count > first:
+            view[first:count] = self.view[self.data:self.data + count - first]
+        COUNTER.pack_into(self.segment, self.tail_offset, tail + count)
+        return count
+
+    def wait(self, timeout):
+        """
+        Sleeps until the doorbell rings or timeout seconds pass, clearing every ring waiting on it
+        """
+        readable, _, _ = select.select([self.doorbell], [], [], timeout)
+        if readable:
+            try:
+                os.read(self.doorbell, 4096)
+            except BlockingIOError:
+                pass
+
+    def release(self):
+        self.view.release()
+
+
+class shmChannel:
+    """
+    Shared memory link between the simulator and one client for a single system. Holds a request ring (client to
+    simulator) and a response ring (simulator to client) in one memory mapped file, plus a FIFO doorbell for each ring
+    so an idle reader can sleep rather than poll.
+
+    The simulator creates the channel, a client attaches to it by writing its pid into the segment and detaches by
+    writing 0, so the simulator can tell when to go back to waiting for a client. The simulator writes its own pid the
+    same way, so a client can tell when the simulator has gone.
+    """
+
+    def __init__(self, address, create, directory=LOCAL_LINK_DIR, ring_size=SHM_RING_SIZE):
+        self.address = address
+        self.create = create
+        self.path = link_path(address, 'shm', directory)
+        self.request_path = link_path(address, 'req', directory)
+        self.response_path = link_path(address, 'resp', directory)
+
+        if create:
+            os.makedirs(directory, exist_ok=True)
+            for path in (self.request_path, self.response_path):
+                if os.path.exists(path):
+                    # Left by a simulator that did not close cleanly
+                    os.unlink(path)
+                os.mkfifo(path)
+            self.file = open(self.path, 'w+b')
+            self.file.truncate(SHM_DATA + 2 * ring_size)
+        else:
+            self.file = open(self.path, 'r+b')
+        self.segment = mmap.mmap(self.file.fileno(), 0)
+
+        if create:
+            self.segment[:len(SHM_MAGIC)] = SHM_MAGIC
+            COUNTER.pack_into(self.segment, SHM_CLIENT, 0)
+            COUNTER.pack_into(self.segment, SHM_SERVER, os.getpid())
+        elif self.segment[:len(SHM_MAGIC)] != SHM_MAGIC:
+            raise ValueError(f"{self.path} is not a simulator shared memory link")
+        ring_size = (len(self.segment) - SHM_DATA) // 2
+
+        # Opened read/write so neither side blocks waiting for the other to open its end, or sees end of file when the
+        # other side goes away
+        self.request_fifo = os.open(self.request_path, os.O_RDWR | os.O_NONBLOCK)
+        self.response_fifo = os.open(self.response_path, os.O_RDWR | os.O_NONBLOCK)
+
+        self.request = shmRing(self.segment, SHM_REQUEST_RING, SHM_DATA, ring_size, self.request_fifo)
+        self.response = shmRing(self.segment, SHM_RESPONSE_RING, SHM_DATA + ring_size, ring_size, self.response_fifo)
+
+    def client(self):
+        """
+        Returns the pid of the attached client, or 0 if none is attached or the client has died without detaching
+        """
+        return self.live_pid(SHM_CLIENT)
+
+    def server(self):
+        """
+        Returns the pid of the simulator serving the channel, or 0 if it has closed the channel or died
+        """
+        return self.live_pid(SHM_SERVER)
+
+    def live_pid(self, offset):
+        """
+        Returns the pid written at offset in the segment, or 0 if none is written or that process no longer exists
+        """
+        pid = COUNTER.unpack_from(self.segment, offset)[0]
+        if pid:
+            try:
+                os.kill(pid, 0)
+            except ProcessLookupError:
+                return 0
+            except PermissionError:
+                # Process exists but belongs to another user
+                pass
+        return pid
+
+    def attach(self):
+        """
+        Attaches this process as the channel's client
+        """
+        if not self.server():
+            raise ConnectionRefusedError(f"Shared memory link {self.address} has no simulator serving it")
+        if self.client():
+            raise ConnectionRefusedError(f"Shared memory link {self.address} already has a client")
+        COUNTER.pack_into(self.segment, SHM_CLIENT, os.getpid())
+        # Wake the simulator so it sees the new client straight away
+        self.request.ring()
+
+    def detach(self):
+        COUNTER.pack_into(self.segment, SHM_CLIENT, 0)
+        self.request.ring()
+
+    def reset(self):
+        """
+        Empties both rings and clears the client, ready for the next client to attach
+        """
+        self.request.reset()
+        self.response.reset()
+        COUNTER.pack_into(self.segment, SHM_CLIENT, 0)
+
+    def close(self):
+        if self.create:
+            # Wake a client waiting for a response so it sees the simulator has gone
+            COUNTER.pack_into(self.segment, SHM_SERVER, 0)
+            self.response.ring()
+        self.request.release()
+        self.response.release()
+        self.segment.close()
+        self.file.close()
+        os.close(self.request_fifo)
+        os.close(self.response_fifo)
+        if self.create:
+            for path in (self.path, self.request_path, self.response_path):
+                if os.path.exists(path):
+                    os.unlink(path)
+
+
+class shmSocket:
+    """
+    Socket-like end of a shared memory channel, giving recv_into, sendmsg and sendall on top of its rings so the same
+    framing code serves TCP, Unix socket and shared memory clients. The simulator's end reads requests and writes
+    responses, a client's end does the opposite.
+    """
+
+    def __init__(self, channel, server):
+        self.channel = channel
+        self.server = server
+        if server:
+            self.inbound, self.outbound = channel.request, channel.response
+        else:
+            self.inbound, self.outbound = channel.response, channel.request
+        self.timeout = None
+        # Set by shutdown, reads return end of stream and writes are abandoned from then on
+        self.closed = False
+
+    def settimeout(self, timeout):
+        self.timeout = timeout
+
+    def is_open(self):
+        """
+        True while this end has not been shut down and the other end is still there. The simulator's end is open while a
+        client is attached, a client's end while the simulator is alive and the client is still attached to it, which a
+        restarted simulator clears.
+        """
+        if self.closed:
+            return False
+        if self.server:
+            return self.channel.client() != 0
+        return self.channel.server() != 0 and self.channel.client() == os.getpid()
+
+    def shutdown(self, how=None):
+        """
+        Ends the stream for this end, waking a thread waiting to read, as shutdown does for a socket
+        """
+        self.closed = True
+        self.inbound.ring()
+
+    def recv_into(self, view):
+        """
+        Reads what is waiting into view, returns 0 once the other end has gone (the client has detached, or for a client
+        the simulator has closed or died), raises TimeoutError if nothing arrives within the timeout
+        """
+        deadline = time.monotonic() + (1 if self.timeout is None else self.timeout)
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                if self.timeout is not None:
+                    raise TimeoutError("timed out")
+                deadline = time.monotonic() + 1
+                remaining = 1
+            if self.closed:
+                return 0
+            count = self.inbound.read_into(view, remaining)
+            if count:
+                return count
+            if not self.is_open():
+                return 0
+
+    def writable(self):
+        return self.outbound.size - (self.outbound.head() - self.outbound.tail()) > 0
+
+    def sendmsg(self, buffers, ancdata=(), flags=0):
+        # Every buffer goes in before a single ring, so the reader wakes once per message
+        sent = 0
+        for buffer in buffers:
+            if flags & socket.MSG_DONTWAIT:
+                # Only what fits now, as a non-blocking socket send would
+                count = self.outbound.write_available(buffer)
+                sent += count
+                if count < len(buffer):
+                    break
+            else:
+                self.outbound.write(buffer, self.is_open, False)
+                sent += len(buffer)
+        self.outbound.ring()
+        return sent
+
+    def sendall(self, data):
+        self.outbound.write(data, self.is_open)
+
+    def close(self):
+        if self.server:
+            self.channel.reset()
+        else:
+            self.channel.detach()
+
+
+class shmClient:
+    """
+    Client end of a system's shared memory link, sends length prefixed AROS_Command messages and receives the
+    Simulator_Response messages, the same as a TCP client of the system's port would
+    """
+
+    def __init__(self, address, directory=LOCAL_LINK_DIR):
+        self.channel = shmChannel(address, False, directory)
+        self.channel.attach()
+        self.socket = shmSocket(self.channel, False)
+        self.header = bytearray(4)
+
+    def send(self, msg: bytes):
+        self.socket.sendmsg([len(msg).to_bytes(4, 'little'), msg])
+
+    def recvInto(self, view):
+        received = 0
+        while received < len(view):
+            count = self.socket.recv_into(view[received:])
+            if count == 0:
+                raise ConnectionResetError("Simulator closed connection")
+            received += count
+
+    def recv(self):
+        self.recvInto(memoryview(self.header))
+        msg = bytearray(int.from_bytes(self.header, 'little'))
+        self.recvInto(memoryview(msg))
+        return bytes(msg)
+
+    def request(self, msg: bytes):
+        self.send(msg)
+        return self.recv()
+
+    def close(self):
+        self.socket.close()
+        self.channel.close()
@@ -1,9 +1,9 @@
 import numpy as np
 import random
 import time
+from threading import Lock
 from haversine import haversine, Unit
-from systems import ADCS_mode, EPSState, TTC_mode, TTC_GS_status, ESPState
-from display import KINGSTON
+from systems import ADCS_mode, EPSState, TTC_mode, TTC_GS_status, ESPState, KINGSTON
 
 # Constants
 mu = 398600.4418  # Earth's gravitational parameter, km^3/s^2
@@ -16,6 +16,10 @@ AV_RANGE = 50  # Angular velocity ranges (divided by 10)
 # Charging constants for Power Supply
 EPS_RATE = 0.01  # Charging and Discharging rate of battery
 
+# Most time steps one lockstep request does, tens of milliseconds of work. AR-OS asks again from the time reached
+# for more, so a large request can not hold up every other client.
+LOCKSTEP_MAX_STEPS = 1000
+
 # Heating and burn constants for ESP
 ESP_HEAT_RATE = 1
 ESP_FUEL_RATE = 0.5
@@ -32,6 +36,8 @@ class simulator:
 
         self.running = False
         self.controller = controller
+        # Held while stepping so a batch of AR-OS commands always sees the state of a single time step
+        self.lock = Lock()
         self.GNSS = self.controller.GNSS
         self.ADCS = self.controller.ADCS
         self.EPS = self.controller.EPS
@@ -56,6 +62,9 @@ class simulator:
         self.realTime = False
         self.startTime = 0
 
+        # In lockstep mode time only moves when AR-OS asks for it with SIM_STEP or SIM_ADVANCE_TO, never on its own
+        self.lockstep = False
+
         # Position and velocity vectors, used once initialized
         self.position = [0, 0, 0]
         self.velocity = [0, 0, 0]
@@ -256,9 +265,20 @@ class simulator:
     def doTimeStep(self):
         """
         Advacne time forward one timestep, calculate new position and send it to GNSS, calculate new orientation and send
-        it to ADCS, update charge in ESP, and connect/disconnect radio systems.
+        it to ADCS, update charge in ESP, connect/disconnect radio systems and step their links.
+        """
+        self.lock.acquire()
+        self.propagate()
+        pushes = self.update_systems(self.dt)
+        self.lock.release()
+
+        self.send_pushes(pushes)
+
+    def propagate(self):
+        """
+        Physics of one time step, moves the orbit, attitude, charge and engine on and advances time. Touches nothing but
+        the simulator and the EPS, ESP and ADCS state, so it can also run in a process of its own (see physics.py).
         """
-        #
         # Update orbit and angular parameters
         self.update_orbit()
         self.update_angular_velocity()
@@ -268,6 +288,11 @@ class simulator:
         # Update simulation time based on time step
         self.time = self.time + self.dt
 
+    def update_systems(self, elapsed):
+        """
+        Hands the state reached to the systems, elapsed sim seconds after the last time they were given it, and returns
+        the pushes due for it as [(subscription, frames)]. Called with the lock held.
+        """
         # Calculate new coordinates and send to GNSS
         lat, long, alt = (self.cartesian_to_geodetic())
         self.GNSS.simulate(lat, long, alt)
@@ -277,31 +302,80 @@ class simulator:
 
         # Update pi and TTCs connectivity based on current location
         self.check_connectivity()
-
-
-
+        # Carry radio traffic up to the new time, delivering whatever has arrived
+        self.TTC.step_link(self.time, elapsed)
+        self.Pi_VHF.step_link(self.time, elapsed)
+
+        # Values of every subscription that is due, gathered while the step's values are consistent
+        pushes = []
+        for system in self.controller.systems:
+            pushes.extend(system.interface.collect_pushes(self.time))
+        return pushes
+
+    def send_pushes(self, pushes):
+        # Sent after the step so a slow client never holds up the simulation, a client too far behind misses the push
+        # and is sent every value again once it catches up
+        for subscription, frames in pushes:
+            try:
+                sent = subscription.connection.pushBuffers(frames)
+            except OSError:
+                sent = False
+            if not sent:
+                subscription.resync()
+
+    def advance(self, steps, limit=LOCKSTEP_MAX_STEPS):
+        """
+        Lockstep, does the given number of time steps for AR-OS, at most limit of them, and returns the time reached.
+        Each step takes the lock on its own and pushes for a step go out before the next. With the threaded interfaces
+        other clients are answered between steps, the asyncio and selectors transports run every step on their one
+        thread so all ports wait until the request is done.
+        """
+        for _ in range(min(steps, limit)):
+            if self.controller.close:
+                break
+            self.doTimeStep()
+        # Kept level so leaving lockstep does not run the steps AR-OS has already done again
+        self.desiredTime = self.time
+        return self.time
+
+    def advance_to(self, target, limit=LOCKSTEP_MAX_STEPS):
+        """
+        Lockstep, does time steps until the time reaches target (going past it if target is not a whole number of steps
+        away), or limit steps are done, and returns the time reached. Does nothing if the time is already there.
+        """
+        steps = 0
+        while self.time < target and steps < limit and not self.controller.close:
+            self.doTimeStep()
+            steps += 1
+        self.desiredTime = self.time
+        return self.time
 
     def run(self, _):
         """
         Main loop for the thread that runs the simulation, only advances time steps when time is less then desired.
+        Leaves time alone in lockstep mode.
         """
         while not self.controller.close:
             # If controller not closed, continue loop
-            if self.time < self.desiredTime:
+            if not self.lockstep and self.time < self.desiredTime:
                 # If desired greater than current time, advance current time by doing a time step
                 self.doTimeStep()
             else:
-                time.sleep(1)
-
-            # if real time, advance desired time based on current time from OS
-            if self.realTime:
-                if self.startTime == 0:
-                    # If start time 0, then first frame of real time, set start time to not loose any desired time
-                    self.startTime = int(time.time()) - self.desiredTime
-                # calculate desired time using current time
-                self.desiredTime = time.time() - self.startTime
-            elif not self.realTime and self.startTime != 0:
-                # If real time off and start time not 0, reset start time to 0.
-                self.startTime = 0
+                # Nothing to do, woken straight away if the simulator is closed
+                self.controller.shutdown.wait(1)
+
+            self.update_desired_time()
 
         print("Thread for Simulator Closing")
+
+    def update_desired_time(self):
+        # if real time, advance desired time based on current time from OS
+        if self.realTime and not self.lockstep:
+            if self.startTime == 0:
+                # If start time 0, then first frame of real time, set start time to not loose any desired time
+                self.startTime = int(time.time()) - self.desiredTime
+            # calculate desired time using current time
+            self.desiredTime = time.time() - self.startTime
+        elif self.startTime != 0:
+            # If real time off (or held by lockstep) and start time not 0, reset start time to 0.
+            self.startTime = 0
@@ -0,0 +1,396 @@
+import argparse
+import asyncio
+import os
+import statistics
+import threading
+import time
+import tracemalloc
+from multiprocessing import Pipe, Process
+from threading import Event, Lock, Thread
+import AR_OS_pb2 as pb
+from load_test import loadGenerator, parse_mix, percentile, system_ports
+from registry import REGISTRY_PATH, load_registry, build_systems
+from simulator import simulator
+from systems import CONSOLE_BUFFER_SIZE, GNSS_TRAIL_SIZE, TTC_mode
+from transports import make_transport
+
+# Seconds between samples, and samples taken before the baseline so start up allocations are not counted as growth
+SOAK_INTERVAL = 60.0
+SOAK_WARMUP_SAMPLES = 2
+# Sim seconds per step and real seconds slept between steps, so the ports get time alongside the simulation
+SOAK_STEP_INTERVAL = 0.01
+# Synthetic AR-OS load, requests per second of the mix, run in another process so it is not measured
+SOAK_RATE = 200
+SOAK_MIX = ('GNSS_GET_POSI=40,ADCS_GET_PRY=15,EPS_GET_CHARGE=10,TTC_GET_MODE=5,TTC_SEND_HEALTH=15,'
+            'TTC_SEND_BYTE_STRING=10,GEN_PING=5')
+# Seconds in each load step, the load process reports its throughput and latency at the end of every step
+SOAK_LOAD_STEP = 30.0
+SOAK_PORT_OFFSET = 2000
+SOAK_DIR = os.path.join("TTC_output", "soak")
+# Allocation sites listed in the report, by growth since the baseline
+SOAK_TOP_ALLOCATORS = 10
+# A series is flagged when at least this share of its changes after the baseline are increases, and it has grown by
+# more than its threshold
+SOAK_MONOTONIC = 0.9
+SOAK_THRESHOLDS = {
+    'rss_bytes': 1 << 20,
+    'traced_bytes': 256 << 10,
+    'threads': 1,
+    'fds': 1,
+    'step_p99_ms': 1.0,
+}
+# Series held to a fixed size, filling up to it is expected and only going past it is flagged
+SOAK_BOUNDS = {
+    'console_lines': CONSOLE_BUFFER_SIZE,
+    'gnss_trail': GNSS_TRAIL_SIZE,
+}
+SOAK_PAYLOADS = {
+    'TTC_SEND_HEALTH': b'{"EPS": {"charge": 50.0, "voltage": 12.0, "temp": 20.0}, "ADCS": {"mode": "SUN_POINTING"}, '
+                       b'"GNSS": {"latitude": 45.0, "longitude": -75.0, "elevation": 550.0}}',
+    'TTC_SEND_BYTE_STRING': b'Soak test downlink text',
+}
+
+
+class soakController:
+    """
+    Headless controller for soak runs, creates every system in the registry and serves their ports the same way as
+    the GUI controller, with no display. The TTC console is drained as the display would.
+    """
+
+    def __init__(self, registry_path=REGISTRY_PATH, port_offset=SOAK_PORT_OFFSET, directory=SOAK_DIR):
+        self.shutdown = Event()
+        self.systems = []
+        self.threads = []
+        self.transport = None
+        self.registry = load_registry(registry_path)
+        for entry, system in build_systems(self, self.registry, port_offset):
+            setattr(self, entry['key'], system)
+            self.systems.append(system)
+
+        # Health data goes to the soak directory rather than the simulator's own output
+        self.TTC.health_log.directory = directory
+        if self.TTC.health_log.store is not None:
+            self.TTC.health_log.store.directory = directory
+
+        self.simulator = simulator(self)
+
+    @property
+    def close(self):
+        return self.shutdown.is_set()
+
+    def stop(self):
+        self.shutdown.set()
+        if self.transport is not None:
+            self.transport.stop()
+        for system in self.systems:
+            system.interface.stop()
+        self.TTC.health_log.stop()
+
+    def start(self):
+        """
+        Starts the port threads (or shared transport) and the health log writer
+        """
+        self.transport = make_transport(self, self.registry)
+        for entry, system in zip(self.registry['systems'], self.systems):
+            if self.transport is not None and entry.get('link', 'lan') == 'lan':
+                self.transport.add_interface(system.interface)
+            else:
+                self.threads.append(Thread(target=system.run, args=(1,)))
+        if self.transport is not None:
+            self.threads.append(Thread(target=self.transport.run, args=(1,)))
+        self.threads.append(Thread(target=self.TTC.health_log.run, args=(1,)))
+        for thread in self.threads:
+            thread.start()
+
+    def join(self):
+        for thread in self.threads:
+            thread.join()
+        self.TTC.health_log.close()
+        self.TTC.flush_audio()
+
+
+class stepper:
+    """
+    Steps the simulation on its own thread, timing each doTimeStep. Latencies are collected until taken by the sampler.
+    """
+
+    def __init__(self, controller, interval=SOAK_STEP_INTERVAL):
+        self.controller = controller
+        self.interval = interval
+        self.latencies = []
+        self.steps = 0
+        self.lock = Lock()
+
+    def run(self, _):
+        sim = self.controller.simulator
+        while not self.controller.close:
+            start = time.perf_counter()
+            sim.doTimeStep()
+            latency = time.perf_counter() - start
+            self.lock.acquire()
+            self.latencies.append(latency)
+            self.steps += 1
+            self.lock.release()
+            # Drained as the TTC display would, so the console buffer is judged as it is used
+            self.controller.TTC.console.drain()
+            time.sleep(self.interval)
+
+    def take(self):
+        self.lock.acquire()
+        latencies = self.latencies
+        self.latencies = []
+        self.lock.release()
+        return latencies
+
+
+def run_load(registry_path, port_offset, mix, rate, duration, results):
+    """
+    Load process, sends the mix at rate requests a second for duration seconds in steps of SOAK_LOAD_STEP, sending
+    (requests per second, errors, p99 ms) back through results after each step
+    """
+    ports, owners = system_ports(load_registry(registry_path), port_offset)
+    targets = parse_mix(mix, ports, owners)
+    payloads = {pb.COMMAND.Value(name): payload for name, payload in SOAK_PAYLOADS.items()}
+
+    async def load():
+        generator = loadGenerator(targets, ports, payloads=payloads)
+        await generator.connect()
+        end = time.monotonic() + duration
+        try:
+            while time.monotonic() < end:
+                step = min(SOAK_LOAD_STEP, end - time.monotonic())
+                if step < 1:
+                    break
+                seconds = await generator.open_loop(rate, step, 0)
+                latencies = sorted(latency for stats in generator.stats.values() for latency in stats.latencies)
+                errors = sum(stats.errors for stats in generator.stats.values()) + generator.disconnected
+                results.send((len(latencies) / seconds, errors, percentile(latencies, 99) * 1e3 if latencies else 0))
+        except ConnectionError:
+            pass
+        finally:
+            await generator.close()
+
+    asyncio.run(load())
+    results.close()
+
+
+def rss_bytes():
+    """
+    Resident set size of this process, from /proc on Linux, otherwise the peak from getrusage
+    """
+    try:
+        f = open('/proc/self/statm', 'rt')
+        pages = int(f.read().split()[1])
+        f.close()
+        return pages * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def open_fds():
+    for path in ('/proc/self/fd', '/dev/fd'):
+        try:
+            return len(os.listdir(path))
+        except OSError:
+            pass
+    return 0
+
+
+def sample(controller, steps, elapsed, interval):
+    """
+    Takes one sample of every tracked series, interval seconds after the last, returns {series: value}
+    """
+    latencies = sorted(steps.take())
+    ttc = controller.TTC
+    interfaces = [system.interface for system in controller.systems]
+    traced, _ = tracemalloc.get_traced_memory()
+    return {
+        'elapsed_s': round(elapsed, 1),
+        'rss_bytes': rss_bytes(),
+        'traced_bytes': traced,
+        'threads': threading.active_count(),
+        'fds': open_fds(),
+        'steps_per_s': len(latencies) / interval,
+        'step_p50_ms': percentile(latencies, 50) * 1e3 if latencies else 0,
+        'step_p99_ms': percentile(latencies, 99) * 1e3 if latencies else 0,
+        'step_max_ms': latencies[-1] * 1e3 if latencies else 0,
+        # State that accumulates while the simulator runs
+        'console_lines': len(ttc.console.lines),
+        'console_dropped': ttc.console.dropped,
+        'audio_to_save_bytes': len(ttc.audio_to_save),
+        'health_queue': ttc.health_log.queue.qsize(),
+        'health_segments': len(ttc.health_log.segments),
+        'gs_commands': len(ttc.gs_to_aros),
+        'pi_audio_bytes': len(controller.Pi_VHF.audio_received),
+        'gnss_trail': controller.GNSS.trail.qsize(),
+        'radio_in_flight': sum(len(link.in_flight) for link in (ttc.downlink, ttc.uplink, controller.Pi_VHF.vhf_link)),
+        'radio_passes': sum(len(link.passes) for link in (ttc.downlink, ttc.uplink, controller.Pi_VHF.vhf_link)),
+        'subscriptions': sum(len(interface.subscriptions) + len(interface.codecs) for interface in interfaces),
+    }
+
+
+def growth(values):
+    """
+    Returns (share of changes that are increases, total change) of a series, unchanged steps are not counted
+    """
+    changes = [after - before for before, after in zip(values, values[1:]) if after != before]
+    if not changes:
+        return 0.0, 0
+    return sum(1 for change in changes if change > 0) / len(changes), values[-1] - values[0]
+
+
+def analyse(samples):
+    """
+    Returns [(series, first, last, change per hour, share of increases, flagged)] for every series, measured from the
+    baseline sample on
+    """
+    measured = samples[SOAK_WARMUP_SAMPLES:] if len(samples) > SOAK_WARMUP_SAMPLES + 2 else samples
+    hours = max((measured[-1]['elapsed_s'] - measured[0]['elapsed_s']) / 3600, 1e-9)
+    results = []
+    for series in measured[0]:
+        if series == 'elapsed_s' or series in ('steps_per_s', 'step_p50_ms', 'step_max_ms'):
+            continue
+        values = [entry[series] for entry in measured]
+        increasing, change = growth(values)
+        if series in SOAK_BOUNDS:
+            # Filling up to its bound is expected, only holding more than it is a leak
+            flagged = values[-1] > SOAK_BOUNDS[series]
+        else:
+            # Anything not given a threshold is a count of held items, where steady growth of even one is suspect
+            flagged = len(values) >= 4 and increasing >= SOAK_MONOTONIC and change > SOAK_THRESHOLDS.get(series, 0)
+        results.append((series, values[0], values[-1], change / hours, increasing, flagged))
+    return results
+
+
+def write_report(samples, allocators, load, path):
+    """
+    Writes the samples as CSV and the growth report as text beside it, returns the report's text
+    """
+    series = list(samples[0])
+    f = open(path + '.csv', 'wt')
+    f.write(','.join(series) + '\n')
+    for entry in samples:
+        f.write(','.join(str(entry[name]) for name in series) + '\n')
+    f.close()
+
+    lines = [f"Soak report, {len(samples)} samples over {samples[-1]['elapsed_s'] / 3600:.2f} h, "
+             f"baseline at sample {SOAK_WARMUP_SAMPLES}", '',
+             f"{'series':<22}{'baseline':>14}{'last':>14}{'per hour':>14}{'rising':>9}  flag"]
+    flagged = []
+    for name, first, last, per_hour, increasing, flag in analyse(samples):
+        lines.append(f"{name:<22}{first:>14.6g}{last:>14.6g}{per_hour:>14.6g}{increasing:>8.0%}  "
+                     f"{'GROWING' if flag else ''}")
+        if flag:
+            flagged.append(name)
+
+    steps = [entry['steps_per_s'] for entry in samples[SOAK_WARMUP_SAMPLES:]] or [0]
+    lines += ['', f"Steps per second, mean {statistics.fmean(steps):.1f}, min {min(steps):.1f}"]
+    if load:
+        rates = [rps for rps, _, _ in load]
+        lines.append(f"Load {statistics.fmean(rates):.0f} req/s mean, {sum(errors for _, errors, _ in load)} error "
+                     f"replies, p99 {max(p99 for _, _, p99 in load):.3f} ms at worst")
+    lines += ['', f"Top {len(allocators)} allocation sites by growth since the baseline"]
+    lines += [f"  {stat}" for stat in allocators]
+    lines += ['', f"Growing: {', '.join(flagged)}" if flagged else "No monotonic growth found"]
+
+    text = '\n'.join(lines) + '\n'
+    f = open(path + '.txt', 'wt')
+    f.write(text)
+    f.close()
+    return text
+
+
+def soak(duration, interval=SOAK_INTERVAL, rate=SOAK_RATE, mix=SOAK_MIX, registry_path=REGISTRY_PATH,
+         port_offset=SOAK_PORT_OFFSET, directory=SOAK_DIR, step_interval=SOAK_STEP_INTERVAL):
+    """
+    Runs the headless simulator under synthetic load for duration seconds, sampling every interval seconds, and writes
+    the report to directory. Returns the report's text.
+    """
+    os.makedirs(directory, exist_ok=True)
+    tracemalloc.start()
+
+    controller = soakController(registry_path, port_offset, directory)
+    # In range of both the ground station and the sonar buoy the whole time, so every path that holds data is in use
+    controller.TTC.connection_radius = 1e9
+    controller.Pi_VHF.connection_radius = 1e9
+    controller.TTC.mode = TTC_mode.ESTABLISHED_CONT
+    controller.simulator.orbital_elements_to_state_vectors()
+    controller.start()
+
+    steps = stepper(controller, step_interval)
+    step_thread = Thread(target=steps.run, args=(1,))
+    step_thread.start()
+
+    receiver, sender = Pipe(duplex=False)
+    load = Process(target=run_load, args=(registry_path, port_offset, mix, rate, duration, sender))
+    load.start()
+    sender.close()
+
+    samples = []
+    load_results = []
+    baseline = None
+    start = time.monotonic()
+    last = start
+    finished = False
+    try:
+        while time.monotonic() - start < duration:
+            time.sleep(min(interval, max(duration - (time.monotonic() - start), 0)))
+            now = time.monotonic()
+            samples.append(sample(controller, steps, now - start, now - last))
+            last = now
+            while receiver.poll():
+                try:
+                    load_results.append(receiver.recv())
+                except EOFError:
+                    break
+            if len(samples) == SOAK_WARMUP_SAMPLES:
+                baseline = tracemalloc.take_snapshot()
+            print(f"Soak {samples[-1]['elapsed_s']:.0f}s rss {samples[-1]['rss_bytes'] >> 20} MB, "
+                  f"threads {samples[-1]['threads']}, fds {samples[-1]['fds']}, "
+                  f"step p99 {samples[-1]['step_p99_ms']:.2f} ms")
+        finished = True
+    finally:
+        snapshot = tracemalloc.take_snapshot()
+        if not finished:
+            # Sampling failed, the load process would otherwise keep on for the rest of the duration
+            load.terminate()
+        # Read to the end, the load process's last step only reports once sampling is over
+        while True:
+            try:
+                load_results.append(receiver.recv())
+            except EOFError:
+                break
+        load.join()
+        controller.stop()
+        step_thread.join()
+        controller.join()
+        tracemalloc.stop()
+
+    if baseline is None:
+        allocators = snapshot.statistics('lineno')[:SOAK_TOP_ALLOCATORS]
+    else:
+        allocators = snapshot.compare_to(baseline, 'lineno')[:SOAK_TOP_ALLOCATORS]
+    path = os.path.join(directory, f'soak_{time.strftime("%d-%m-%y_%H-%M-%S")}')
+    return write_report(samples, allocators, load_results, path)
+
+
+if __name__ == "__main__":
+    """
+    Runs the simulator headless under load for a long time and reports anything that keeps growing, e.g.
+    python soak.py --duration 86400 for a day, or python soak.py --duration 600 --interval 10 for a quick check
+    """
+    parser = argparse.ArgumentParser(description="AR-OS Simulator soak test")
+    parser.add_argument('--duration', type=float, default=3600, help="seconds to run for")
+    parser.add_argument('--interval', type=float, default=SOAK_INTERVAL, help="seconds between samples")
+    parser.add_argument('--rate', type=float, default=SOAK_RATE, help="AR-OS requests per second")
+    parser.add_argument('--mix', default=SOAK_MIX, help="command mix, as for load_test.py")
+    parser.add_argument('--step-interval', type=float, default=SOAK_STEP_INTERVAL,
+                        help="real seconds slept between time steps")
+    parser.add_argument('--registry', default=REGISTRY_PATH, help="system registry file")
+    parser.add_argument('--port-offset', type=int, default=SOAK_PORT_OFFSET, help="added to every system port")
+    parser.add_argument('--output', default=SOAK_DIR, help="directory for the report, samples and health data")
+    args = parser.parse_args()
+
+    print(soak(args.duration, args.interval, args.rate, args.mix, args.registry, args.port_offset, args.output,
+               args.step_interval))
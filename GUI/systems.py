@@ -1,14 +1,20 @@
 import math
 from abc import ABC
+from collections import deque
 from enum import Enum
 from queue import Queue
 from threading import Lock
-import time  # Only used for getting local time to save files
+import time  # Only used for getting local time to save files and stamp console lines
+from telemetry import healthLogWriter, healthStore
+from radiolink import radioLink
 
 
 DEFAULT_VOLTAGE = 12.0
 DEFAULT_TEMP = 30.0
 
+# Ground station location (longitude, latitude), kept here rather than in the display so the simulation can run headless
+KINGSTON = (-76.4930, 44.2334)
+
 HOST = "127.0.0.1"
 
 
@@ -19,6 +25,8 @@ class system(ABC):
 
     Also contains the generic network code for each system to listen on a port and accept TCP requests.
     """
+    __slots__ = ('name', 'controller', 'port', 'socket', 'voltage', 'temp', 'interface')
+
     def __init__(self, name, controller, port=0):
         self.name = name
         self.controller = controller
@@ -42,6 +50,8 @@ class EPS(system):
     """
     System for simulating the Electrical Power System in Audimus
     """
+    __slots__ = ('charge', 'power_saving', 'status')
+
     def __init__(self, name, controller, port=0):
         system.__init__(self, name, controller, port)
         self.charge = 50
@@ -75,6 +85,8 @@ class ESP(system):
     """
     System for simulating the Electro-Spray Propulsion in Audimus
     """
+    __slots__ = ('fuel', 'engine_temp', 'status')
+
     def __init__(self, name, controller, port=0):
         system.__init__(self, name, controller, port)
         self.fuel = 100
@@ -116,6 +128,8 @@ class dragSail(system):
     """
     System for simulating the Drag Sail in Audimus
     """
+    __slots__ = ('deployed',)
+
     def __init__(self, name, controller, port=0):
         system.__init__(self, name, controller, port)
         self.deployed = False
@@ -132,6 +146,8 @@ class ADCS(system):
     """
     System for simulating the Attitude Direction Control System in Audimus
     """
+    __slots__ = ('pitch', 'roll', 'yaw', 'pitch_av', 'roll_av', 'yaw_av', 'status', 'mode')
+
     def __init__(self, name, controller, port=0):
         system.__init__(self, name, controller, port)
         self.pitch = 0.0
@@ -190,11 +206,13 @@ class GNSS(system):
     audimus for the GUI's rendering
 
     """
+    __slots__ = ('latitude', 'longitude', 'elevation', 'status', 'trail', 'lastSaved', 'trailSize', 'lock')
+
     def __init__(self, name, controller, port=0):
         system.__init__(self, name, controller, port)
         self.latitude = 0.00
         self.longitude = 0.00
-        self. elevation = 2000
+        self.elevation = 2000
         self.status = GNSS_ADCSState.SIMULATED
 
         # For image tracking purposes
@@ -268,6 +286,10 @@ class Pi_VHF(system):
     """
     System for simulating the Raspberry Pi and VHF Radio System in Audimus
     """
+    __slots__ = ('enabled', 'connected', 'audio_filepath', 'audio_status', 'audio_data', 'audio_sent', 'audio_lost',
+                 'audio_received', 'audio_early', 'audio_read', 'PI_MSG_LENGTH', 'vhf_link', 'connection_radius',
+                 'latitude', 'longitude')
+
 
     def __init__(self, name, controller, port=0):
         system.__init__(self, name, controller, port)
@@ -277,8 +299,18 @@ class Pi_VHF(system):
         # Audio Status
         self.audio_filepath = ""
         self.audio_status = audioState.NO_DATA
-        self.byte_to_send = b''
+        # Audio file held by the sonar buoy, bytes of it the buoy has transmitted once and offsets of the sections it
+        # has to send again since they were lost or cut off, bytes the Pi has received in order over VHF, sections it
+        # received ahead of one that is missing by offset, and bytes AR-OS has read from the Pi
+        self.audio_data = b''
+        self.audio_sent = 0
+        self.audio_lost = deque()
+        self.audio_received = bytearray()
+        self.audio_early = {}
+        self.audio_read = 0
         self.PI_MSG_LENGTH = 100
+        # VHF link from the sonar buoy to the Pi
+        self.vhf_link = radioLink('VHF')
         # Sonar Bouy
         self.connection_radius = 500.0
         self.latitude = 73.0
@@ -287,31 +319,96 @@ class Pi_VHF(system):
     def load_file(self):
         try:
             f = open(self.audio_filepath, 'rb')
-            self.byte_to_send = f.read()
+            self.audio_data = f.read()
             f.close()
+            self.audio_sent = 0
+            self.audio_lost.clear()
+            self.audio_received = bytearray()
+            self.audio_early.clear()
+            self.audio_read = 0
             self.audio_status = audioState.UNSENT
-            print(len(self.byte_to_send))
+            print(len(self.audio_data))
         except:
             self.audio_status = audioState.ERROR_LOADING
 
-    def get_audio(self):
-        if self.connected is False:
-            # If Pi not connected, then return empty string
-            return b''
-
-        self.audio_status = audioState.SENDING
+    def step_link(self, now, dt):
+        """
+        Advances the VHF link to sim time now. Whatever arrived before now is added to the Pi's received audio, then
+        while in range the buoy keeps the link busy for the coming time step, first sending again the sections that
+        were lost or cut off at the end of a pass and then the rest of its file.
+        """
+        # Delivered before the link goes down, so sections that arrived before loss of signal are not cut off
+        self.vhf_link.step(now)
+        ended = self.vhf_link.set_up(self.connected, now)
+        if ended is not None and ended.offered:
+            print(f"{self.name} VHF link: {ended.summary()}")
+
+        if self.connected:
+            while (self.audio_lost or self.audio_sent < len(self.audio_data)) and self.vhf_link.busy_until < now + dt:
+                if self.audio_lost:
+                    offset = self.audio_lost.popleft()
+                else:
+                    offset = self.audio_sent
+                    self.audio_sent = min(offset + self.PI_MSG_LENGTH, len(self.audio_data))
+                data = self.audio_data[offset:offset + self.PI_MSG_LENGTH]
+                self.vhf_link.send((offset, data), now, self.receive_audio, len(data), self.lose_audio)
 
-        # gets section of message
-        msg = self.byte_to_send[0:self.PI_MSG_LENGTH]
+    def receive_audio(self, packet):
+        """
+        Adds a section of audio that reached the Pi. A section that arrives while one before it is still missing is held
+        until the missing one is sent again, so the Pi's audio is always the start of the file.
+        """
+        offset, data = packet
+        if offset == len(self.audio_received):
+            self.audio_received += data
+            while len(self.audio_received) in self.audio_early:
+                self.audio_received += self.audio_early.pop(len(self.audio_received))
+        elif offset > len(self.audio_received):
+            self.audio_early[offset] = data
+
+    def lose_audio(self, packet):
+        """
+        Has the buoy send again a section that was lost on the way to the Pi or cut off when the link went down
+        """
+        self.audio_lost.append(packet[0])
 
-        if len(self.byte_to_send) > self.PI_MSG_LENGTH:
-            self.byte_to_send = self.byte_to_send[self.PI_MSG_LENGTH:]
-        else:
-            self.byte_to_send = b''
-            self.audio_status = audioState.SENT
+    def get_audio(self):
+        """
+        Returns the next section of audio the Pi has received over VHF, an empty string at the end of the file, or None
+        if the buoy is still sending and nothing new has come over the link yet
+        """
+        # gets section of message, moving audio_read past it
+        msg = self.read_audio(self.audio_read, self.audio_read + self.PI_MSG_LENGTH)
+        if msg:
+            return msg
+        if self.audio_finished():
+            if self.audio_status == audioState.SENDING:
+                # Link went idle after the last section was read
+                self.update_audio_status()
+            return msg
+        return None
 
+    def read_audio(self, start, end):
+        """
+        Returns the audio the Pi has received between start and end, cut short at what has arrived so far. Used by
+        bulk transfers, which track their own position in the file.
+        """
+        msg = bytes(self.audio_received[start:end])
+        if msg and start + len(msg) > self.audio_read:
+            self.audio_read = start + len(msg)
+            self.update_audio_status()
         return msg
 
+    def audio_finished(self):
+        """
+        True once the whole file has reached the Pi and been read
+        """
+        return len(self.audio_received) == len(self.audio_data) and self.vhf_link.idle() and \
+            self.audio_read == len(self.audio_received)
+
+    def update_audio_status(self):
+        self.audio_status = audioState.SENT if self.audio_finished() else audioState.SENDING
+
     def set_on(self):
         if not self.enabled:
             self.enabled = True
@@ -339,11 +436,99 @@ class OBC(system):
     """
     System for simulating the TTC in Audimus
     """
+    __slots__ = ()
+
     def __init__(self, name, controller, port=0):
         system.__init__(self, name, controller, port)
 
 
+CONSOLE_BUFFER_SIZE = 1000
+
+
+class consoleBuffer:
+    """
+    Thread safe, bounded buffer of timestamped lines waiting to be printed to the TTC console. Written to by both the GUI
+    and the TTC interface thread. Once full the oldest line is dropped and counted, so an unopened console window can
+    never grow the buffer without bound.
+    """
+    __slots__ = ('lines', 'dropped', 'lock')
+
+    def __init__(self, size=CONSOLE_BUFFER_SIZE):
+        self.lines = deque(maxlen=size)
+        self.dropped = 0
+        self.lock = Lock()
+
+    def append(self, line):
+        self.lock.acquire()
+        if len(self.lines) == self.lines.maxlen:
+            # Oldest line is about to be pushed out of the buffer
+            self.dropped += 1
+        self.lines.append((time.strftime("%H:%M:%S"), line))
+        self.lock.release()
+
+    def drain(self, limit=None):
+        """
+        Removes and returns up to limit of the oldest lines, along with the number of lines dropped since last drain
+        """
+        self.lock.acquire()
+        count = len(self.lines) if limit is None else min(limit, len(self.lines))
+        lines = [self.lines.popleft() for _ in range(count)]
+        dropped = self.dropped
+        self.dropped = 0
+        self.lock.release()
+        return lines, dropped
+
+
+GS_COMMAND_QUEUE_DEPTH = 1000
+
+
+class commandQueue:
+    """
+    Thread safe queue of ground station commands waiting to be fetched by AR-OS. Each command is kept as its own entry
+    with an id and the time it was queued, and the queue refuses new commands once it holds depth of them.
+    """
+    __slots__ = ('commands', 'depth', 'next_id', 'lock')
+
+    def __init__(self, depth=GS_COMMAND_QUEUE_DEPTH):
+        self.commands = deque()
+        self.depth = depth
+        self.next_id = 1
+        self.lock = Lock()
+
+    def __len__(self):
+        return len(self.commands)
+
+    def put(self, command):
+        """
+        Queues a command, returns its id or None if the queue is full
+        """
+        self.lock.acquire()
+        if len(self.commands) >= self.depth:
+            self.lock.release()
+            return None
+        command_id = self.next_id
+        self.next_id += 1
+        self.commands.append((command_id, time.time(), command))
+        self.lock.release()
+        return command_id
+
+    def get(self, count=None):
+        """
+        Removes and returns up to count of the oldest commands, every queued command if count is None
+        """
+        self.lock.acquire()
+        count = len(self.commands) if count is None else min(count, len(self.commands))
+        commands = [self.commands.popleft() for _ in range(count)]
+        self.lock.release()
+        return commands
+
+
 class TTC(system):
+    """
+    System for simulating the Telemetry Tracking and Command radio in Audimus, and the ground station it talks to
+    """
+    __slots__ = ('mode', 'gs_status', 'connection_radius', 'connected', 'console', 'gs_to_aros', 'audio_to_save',
+                 'health_log', 'downlink', 'uplink')
 
     def __init__(self, name, controller, port=0):
         system.__init__(self, name, controller, port)
@@ -353,103 +538,132 @@ class TTC(system):
         self.connection_radius = 500
         self.connected = False
         # Message queues for sending and receiving and printing
-        self.console_output = ''
-        self.gs_to_aros = ''
+        self.console = consoleBuffer()
+        self.gs_to_aros = commandQueue()
         self.audio_to_save = b''
+        # Health data is written to disk by a background writer so the interface thread never waits on file IO,
+        # and each record is also kept in a structured store that can be queried by sim time
+        self.health_log = healthLogWriter(controller, store=healthStore())
+        # Radio links to and from the ground station, everything AR-OS sends and the GS replies goes through them
+        self.downlink = radioLink('TTC downlink')
+        self.uplink = radioLink('TTC uplink')
 
     def gs_send_command(self, msg):
         if msg == '':
             # If message is empty, do nothing with it
             return
         # Add message sent to console output so that it can be seen
-        if self.console_output != '':
-            self.console_output += '\n'
-        self.console_output += f'GS[{"C" if self.connected else "X"}] > {msg}'
+        self.console.append(f'GS[{"C" if self.connected else "X"}] > {msg}')
 
-        # Adds message to queue for ar-os if in right state for sending commands
+        # Sends message up to ar-os if in right state for sending commands
         if self.mode == TTC_mode.ESTABLISHED_CONT:
             # State for sending commands to AR-OS from GS
-            self.gs_to_aros += msg + '\n'
+            command = msg.encode(encoding='utf-8')
+            if not self.uplink.send(command, self.controller.simulator.time, self.deliver_command):
+                self.console.append('GS > Uplink down or full, command not sent')
 
+    def deliver_command(self, command):
+        """
+        Queues a command that has reached the satellite for AR-OS to fetch
+        """
+        if self.gs_to_aros.put(command) is None:
+            # Queue is full, report backpressure to the GS rather than growing the queue
+            self.console.append(f'GS > Command queue full ({self.gs_to_aros.depth} waiting), command not sent')
 
-    def get_msg(self):
+    def step_link(self, now, dt):
+        """
+        Advances both radio links to sim time now, delivering whatever has arrived and reporting each finished pass
+        """
+        for link in (self.downlink, self.uplink):
+            # Delivered before the link goes down, so packets that arrived before loss of signal are not cut off
+            link.step(now)
+            ended = link.set_up(self.connected, now)
+            if ended is not None and ended.offered:
+                self.console.append(f'GS > {link.name} {ended.summary()}')
+
+    def get_msg(self, count=None):
+        """
+        Returns up to count queued GS commands (all of them if count is None) as (id, timestamp, command) tuples, or an
+        empty list if none are waiting or TTC is not in the right mode to receive commands
+        """
         # If in right state for connection for receiving commands, read from gs_to_aros
         if self.mode == TTC_mode.ESTABLISHED_CONT:
-            # Save and clear message queue
-            msg = self.gs_to_aros
-            self.gs_to_aros = ""
-            # encode msg in bytes to be sent to AR-OS
-            msg = msg.encode(encoding='utf-8')
-            return msg
-        # If not in right mode, return empty byte string
-        return b''
+            return self.gs_to_aros.get(count)
+        # If not in right mode, return no commands
+        return []
 
-    def recv_msg(self, msg=b'TEST'):
+    def recv_msg(self, msg=b'TEST', size=None):
         if self.mode == TTC_mode.OFF or self.mode == TTC_mode.BEACONING or self.mode == TTC_mode.CONNECTING or self.mode == TTC_mode.DISCONNECTED:
             # If not in right mode to send byte then TTC will return an error
             return False
-        elif self.connected == False:
-            # If TTC not connected but in right mode, return true but do nothing with it, data has just been lost
-            return True
-
-        # Add message sent to console output so that it can be seen
-        if self.console_output != '':
-            self.console_output += '\n'
-        self.console_output += f'AR-OS > {msg.decode(encoding="utf-8")}'
 
+        # Send down to the GS, if TTC is not connected the data has just been lost. Takes size bytes on air if AR-OS
+        # sent it compressed
+        self.downlink.send(msg, self.controller.simulator.time, self.deliver_msg, size)
         return True
 
-    def recv_health(self, msg=b'TEST'):
+    def deliver_msg(self, msg):
+        # Add message sent to console output so that it can be seen
+        self.console.append(f'AR-OS > {msg.decode(encoding="utf-8")}')
+
+    def recv_health(self, msg=b'TEST', size=None):
         if self.mode == TTC_mode.OFF or self.mode == TTC_mode.BEACONING or self.mode == TTC_mode.CONNECTING or self.mode == TTC_mode.DISCONNECTED:
             # If not in right mode to send byte then TTC will return an error
             return False
-        elif self.connected == False:
-            # If TTC not connected but in right mode, return true but do nothing with it, data has just been lost
-            return True
 
+        # Send down to the GS, if TTC is not connected the data has just been lost. Takes size bytes on air if AR-OS
+        # sent it compressed
+        self.downlink.send(msg, self.controller.simulator.time, self.deliver_health, size)
+        return True
+
+    def deliver_health(self, msg):
         health_data = msg.decode(encoding="utf-8")
 
-        # Save sent health data to log file, assumes health data is single message
-        f = open("TTC_output/health_log.txt", 'at')
-        f.write(health_data + '\n')
-        f.close()
+        # Queue received health data for the log writer, assumes health data is single message
+        self.health_log.write(self.controller.simulator.time, health_data)
 
-        if self.console_output != '':
-            self.console_output += '\n'
-        self.console_output += f'AR-OS > Logged Health data: {health_data[:80]}{"..." if len(health_data) > 70 else ""}'
+        self.console.append(f'AR-OS > Logged Health data: {health_data[:80]}{"..." if len(health_data) > 70 else ""}')
 
-        return True
-
-    def recv_audio(self, msg=b'TEST'):
+    def recv_audio(self, msg=b'TEST', size=None):
         if self.mode == TTC_mode.OFF or self.mode == TTC_mode.BEACONING or self.mode == TTC_mode.CONNECTING or self.mode == TTC_mode.DISCONNECTED:
             # If not in right mode to send byte then TTC will return an error
             return False
-        elif self.connected == False:
-            # If TTC not connected but in right mode, return true but do nothing with it, data has just been lost
-            return True
 
+        # Send down to the GS, if TTC is not connected the data has just been lost. Takes size bytes on air if AR-OS
+        # sent it compressed
+        self.downlink.send(msg, self.controller.simulator.time, self.deliver_audio, size)
+        return True
+
+    def deliver_audio(self, msg):
         # Append audio data recevived to total audio data, done assuming most audio files will be too big for one message
         self.audio_to_save += msg
 
         if self.audio_to_save != b'' and msg == b'':
             # If audio data to save not empty but an empty message is sent, then end of message and should save it
-            # generate unique name from hash
-            audio_name = f'Audio_data_{time.strftime("%d-%m-%y_%H-%M-%S")}.wav'
+            self.save_audio()
 
-            # Save data in output folder with name
-            f = open(f'TTC_output/{audio_name}', 'wb')
-            f.write(self.audio_to_save)
-            f.close()
+    def save_audio(self, suffix=''):
+        # generate unique name from hash
+        audio_name = f'Audio_data_{time.strftime("%d-%m-%y_%H-%M-%S")}{suffix}.wav'
 
-            # Clear Audio to save after saving it
-            self.audio_to_save = b''
+        # Save data in output folder with name
+        f = open(f'TTC_output/{audio_name}', 'wb')
+        f.write(self.audio_to_save)
+        f.close()
 
-            # Print to console
-            if self.console_output != '':
-                self.console_output += '\n'
-            self.console_output += f'AR-OS > Saved audio data in file {audio_name}'
+        # Clear Audio to save after saving it
+        self.audio_to_save = b''
 
-        return True
+        # Print to console
+        self.console.append(f'AR-OS > Saved audio data in file {audio_name}')
+
+    def flush_audio(self):
+        """
+        Flush on shutdown hook, saves audio that was still arriving when the simulator closed so it is not lost, marked
+        as partial since its end was never received
+        """
+        if self.audio_to_save != b'':
+            self.save_audio('_partial')
 
     def set_off(self):
         if self.mode != TTC_mode.OFF:
@@ -0,0 +1,432 @@
+from bisect import bisect_left
+import json
+import mmap
+import os
+import struct
+import time
+from queue import Queue, Empty
+from threading import Event, Lock
+
+# Health log file settings
+HEALTH_LOG_DIR = "TTC_output"
+HEALTH_LOG_NAME = "health_log"
+HEALTH_LOG_MAX_BYTES = 8 * 1024 * 1024  # Size at which the active log file is rotated
+HEALTH_LOG_BATCH_SIZE = 256  # Number of waiting records that triggers an early flush
+HEALTH_LOG_FLUSH_INTERVAL = 1.0  # Longest time (seconds) a record waits before being written
+
+# Health store file settings
+HEALTH_STORE_NAME = "health_store"
+HEALTH_STORE_MAGIC = b'AROSHLT1'
+HEALTH_STORE_INDEX_INTERVAL = 64  # Number of records between entries in the sparse time index
+HEALTH_RECORD = struct.Struct('<ddI')  # sim time, wall time, payload length
+HEALTH_INDEX_ENTRY = struct.Struct('<dQ')  # sim time, offset of record in data file
+HEALTH_RUN_START = 1 << 63  # Set in an index entry's offset when its record starts a new run of sim time
+
+
+class healthLogWriter:
+    """
+    Background writer for the TTC health log. The TTC interface thread only enqueues records, the writer thread batches
+    them and writes them to disk when enough records are waiting or enough time has passed, so the protocol response is
+    never held up by file IO.
+
+    The active log is rotated once it reaches max_bytes, and an index file records the range of simulation time that
+    each log file holds so a given time can be found without reading every file.
+    """
+
+    def __init__(self, controller, directory=HEALTH_LOG_DIR, name=HEALTH_LOG_NAME, max_bytes=HEALTH_LOG_MAX_BYTES,
+                 batch_size=HEALTH_LOG_BATCH_SIZE, flush_interval=HEALTH_LOG_FLUSH_INTERVAL, store=None):
+        self.controller = controller
+        # Optional structured store that every record is also written to
+        self.store = store
+        self.directory = directory
+        self.name = name
+        self.max_bytes = max_bytes
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+        # Records waiting to be written, and event to wake the writer thread before the flush interval is up
+        self.queue = Queue()
+        self.flush_event = Event()
+        # Mutex so an explicit flush and the writer thread never write at the same time
+        self.lock = Lock()
+
+        self.file = None
+        self.file_size = 0
+        # Index of log files, each entry is [file name, first sim time, last sim time, number of records]
+        self.segments = []
+        self.closed = False
+        # Set by stop to end the writer thread
+        self.stopping = False
+
+    def active_path(self):
+        return os.path.join(self.directory, f'{self.name}.txt')
+
+    def index_path(self):
+        return os.path.join(self.directory, f'{self.name}_index.txt')
+
+    def write(self, sim_time, text):
+        """
+        Queues one health record to be written, called from the TTC interface thread so it must never block on IO
+        """
+        self.queue.put((sim_time, time.time(), text))
+        if self.queue.qsize() >= self.batch_size:
+            # Enough records waiting, wake writer early
+            self.flush_event.set()
+
+    def run(self, _):
+        """
+        Main loop for the writer thread, flushes every flush_interval or when woken early, and flushes everything left
+        once stopped.
+        """
+        print("Thread for Health Log running")
+        while not self.stopping:
+            self.flush_event.wait(self.flush_interval)
+            self.flush_event.clear()
+            self.flush()
+        self.close()
+        print("Thread for Health Log Closed")
+
+    def stop(self):
+        """
+        Stops the writer thread from any thread, waking it so it writes what is queued and closes straight away
+        """
+        self.stopping = True
+        self.flush_event.set()
+
+    def flush(self):
+        """
+        Writes every queued record to the active log file, rotating it when it grows past max_bytes
+        """
+        self.lock.acquire()
+
+        records = []
+        while True:
+            try:
+                records.append(self.queue.get_nowait())
+            except Empty:
+                break
+
+        if records:
+            if self.file is None:
+                self.open()
+
+            lines = []
+            for sim_time, wall_time, text in records:
+                if self.store is not None:
+                    self.store.append(sim_time, wall_time, text.encode(encoding='utf-8'))
+
+                line = (text + '\n').encode(encoding='utf-8')
+                lines.append(line)
+                self.file_size += len(line)
+                self.update_segment(sim_time)
+
+                if self.file_size >= self.max_bytes:
+                    # Write what has been gathered so far then start a new file
+                    self.file.write(b''.join(lines))
+                    lines = []
+                    self.rotate()
+
+            if lines:
+                self.file.write(b''.join(lines))
+            self.file.flush()
+            self.write_index()
+            if self.store is not None:
+                self.store.flush()
+
+        self.lock.release()
+
+    def close(self):
+        """
+        Flush on shutdown hook, writes anything still queued and closes the active file. Safe to call more than once.
+        """
+        self.flush()
+
+        self.lock.acquire()
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        if self.store is not None:
+            self.store.close()
+        self.closed = True
+        self.lock.release()
+
+    def open(self):
+        """
+        Opens the active log file for appending, and loads the index from previous runs so numbering carries on
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        self.read_index()
+
+        self.file = open(self.active_path(), 'ab')
+        self.file_size = self.file.tell()
+
+        if not self.segments or self.segments[-1][0] != os.path.basename(self.active_path()):
+            # Active file not yet in index, add an empty entry for it
+            self.segments.append([os.path.basename(self.active_path()), None, None, 0])
+
+    def rotate(self):
+        """
+        Closes the active log, renames it with the next free number and opens a fresh active log
+        """
+        self.file.close()
+
+        number = len(self.segments)
+        rotated_name = f'{self.name}_{number}.txt'
+        os.replace(self.active_path(), os.path.join(self.directory, rotated_name))
+        self.segments[-1][0] = rotated_name
+
+        self.file = open(self.active_path(), 'ab')
+        self.file_size = 0
+        self.segments.append([os.path.basename(self.active_path()), None, None, 0])
+
+    def update_segment(self, sim_time):
+        segment = self.segments[-1]
+        if segment[1] is None:
+            segment[1] = sim_time
+        segment[2] = sim_time
+        segment[3] += 1
+
+    def read_index(self):
+        self.segments = []
+        try:
+            f = open(self.index_path(), 'rt')
+            for line in f:
+                parts = line.split()
+                if len(parts) != 4:
+                    continue
+                first = None if parts[1] == '-' else float(parts[1])
+                last = None if parts[2] == '-' else float(parts[2])
+                self.segments.append([parts[0], first, last, int(parts[3])])
+            f.close()
+        except FileNotFoundError:
+            pass
+
+    def write_index(self):
+        """
+        Rewrites the index file, one line per log file: name, first sim time, last sim time, number of records
+        """
+        lines = []
+        for name, first, last, count in self.segments:
+            lines.append(f'{name} {"-" if first is None else first} {"-" if last is None else last} {count}\n')
+
+        temp_path = self.index_path() + '.tmp'
+        f = open(temp_path, 'wt')
+        f.write(''.join(lines))
+        f.close()
+        os.replace(temp_path, self.index_path())
+
+    def find(self, sim_time):
+        """
+        Returns the names of the log files that may hold records for the given simulation time
+        """
+        self.lock.acquire()
+        names = [name for name, first, last, _ in self.segments
+                 if first is not None and first <= sim_time <= last]
+        self.lock.release()
+        return names
+
+
+class healthStore:
+    """
+    Append only binary store of health records. Each record holds the sim time and wall time it was received at along
+    with the raw health payload, and a sparse index of (sim time, offset) entries is kept beside it so a time range can
+    be found with a binary search and read through mmap without scanning the whole file.
+
+    Sim time restarts when the simulation is initialized again, so an index entry marked as the start of a run is always
+    written when sim time goes backwards. Each run of increasing sim time is then searched separately, however far back
+    the time went.
+
+    Only written to by the health log writer thread, records become visible to query once they have been flushed.
+    """
+
+    def __init__(self, directory=HEALTH_LOG_DIR, name=HEALTH_STORE_NAME, index_interval=HEALTH_STORE_INDEX_INTERVAL):
+        self.directory = directory
+        self.name = name
+        self.index_interval = index_interval
+
+        self.data_file = None
+        self.index_file = None
+        self.offset = 0
+        self.last_time = None
+        self.since_index = 0
+
+    def data_path(self):
+        return os.path.join(self.directory, f'{self.name}.dat')
+
+    def index_path(self):
+        return os.path.join(self.directory, f'{self.name}.idx')
+
+    def open(self):
+        """
+        Opens the store for appending, picking up where a previous run left off
+        """
+        os.makedirs(self.directory, exist_ok=True)
+
+        self.data_file = open(self.data_path(), 'ab')
+        self.index_file = open(self.index_path(), 'ab')
+        self.offset = self.data_file.tell()
+
+        if self.offset == 0:
+            # New store, write header
+            self.data_file.write(HEALTH_STORE_MAGIC)
+            self.offset = len(HEALTH_STORE_MAGIC)
+            return
+
+        # Existing store, walk the records after the last index entry to find last time and records since the index
+        index = self.read_index()
+        position = index[-1][1] & ~HEALTH_RUN_START if index else len(HEALTH_STORE_MAGIC)
+        self.since_index = 0
+        f = open(self.data_path(), 'rb')
+        f.seek(position)
+        while True:
+            header = f.read(HEALTH_RECORD.size)
+            if len(header) < HEALTH_RECORD.size:
+                break
+            sim_time, _, length = HEALTH_RECORD.unpack(header)
+            f.seek(length, os.SEEK_CUR)
+            self.last_time = sim_time
+            self.since_index += 1
+        f.close()
+
+    def append(self, sim_time, wall_time, payload):
+        if self.data_file is None:
+            self.open()
+
+        if self.last_time is None or sim_time < self.last_time:
+            # First record or start of a new run of sim time
+            self.index_file.write(HEALTH_INDEX_ENTRY.pack(sim_time, self.offset | HEALTH_RUN_START))
+            self.since_index = 0
+        elif self.since_index >= self.index_interval:
+            # Far enough past the last index entry
+            self.index_file.write(HEALTH_INDEX_ENTRY.pack(sim_time, self.offset))
+            self.since_index = 0
+
+        self.data_file.write(HEALTH_RECORD.pack(sim_time, wall_time, len(payload)))
+        self.data_file.write(payload)
+        self.offset += HEALTH_RECORD.size + len(payload)
+        self.last_time = sim_time
+        self.since_index += 1
+
+    def flush(self):
+        if self.data_file is not None:
+            # Data before index, so an index entry never points past the end of the data file
+            self.data_file.flush()
+            self.index_file.flush()
+
+    def close(self):
+        if self.data_file is not None:
+            self.flush()
+            self.data_file.close()
+            self.index_file.close()
+            self.data_file = None
+            self.index_file = None
+
+    def read_index(self):
+        try:
+            f = open(self.index_path(), 'rb')
+            raw = f.read()
+            f.close()
+        except FileNotFoundError:
+            return []
+        raw = raw[:len(raw) - len(raw) % HEALTH_INDEX_ENTRY.size]
+        return list(HEALTH_INDEX_ENTRY.iter_unpack(raw))
+
+    def query(self, start=None, end=None, fields=None):
+        """
+        Returns (sim time, wall time, payload) for every stored record with start <= sim time <= end. If fields is
+        given, payload is a dict of just those fields and records holding none of them are skipped.
+        """
+        start = float('-inf') if start is None else start
+        end = float('inf') if end is None else end
+
+        try:
+            f = open(self.data_path(), 'rb')
+        except FileNotFoundError:
+            return []
+        size = os.fstat(f.fileno()).st_size
+        if size <= len(HEALTH_STORE_MAGIC):
+            f.close()
+            return []
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        results = []
+        for run_times, run_offsets, run_end in self.runs(self.read_index(), size):
+            if run_times[0] > end:
+                continue
+            # Start from the last index entry before start, every record before it is too early
+            i = max(bisect_left(run_times, start) - 1, 0)
+            offset = run_offsets[i]
+
+            while offset + HEALTH_RECORD.size <= run_end:
+                sim_time, wall_time, length = HEALTH_RECORD.unpack_from(data, offset)
+                payload_start = offset + HEALTH_RECORD.size
+                offset = payload_start + length
+                if offset > size or sim_time > end:
+                    # Past the end of the range, or a record still being written
+                    break
+                if sim_time < start:
+                    continue
+
+                payload = data[payload_start:offset]
+                if fields is not None:
+                    payload = self.select_fields(payload, fields)
+                    if not payload:
+                        continue
+                results.append((sim_time, wall_time, payload))
+
+        data.close()
+        f.close()
+        return results
+
+    def runs(self, index, size):
+        """
+        Splits the index into runs of increasing sim time, yields the times and offsets of each run and where it ends
+        """
+        run_times = []
+        run_offsets = []
+        for sim_time, offset in index:
+            run_start = offset & HEALTH_RUN_START
+            offset &= ~HEALTH_RUN_START
+            if offset >= size:
+                break
+            # Stores written before runs were marked only show a new run where an index entry's time goes backwards
+            if run_times and (run_start or sim_time < run_times[-1]):
+                yield run_times, run_offsets, offset
+                run_times = []
+                run_offsets = []
+            run_times.append(sim_time)
+            run_offsets.append(offset)
+        if run_times:
+            yield run_times, run_offsets, size
+
+    @staticmethod
+    def select_fields(payload, fields):
+        """
+        Picks the requested fields out of a health payload, which is either a JSON object or key=value pairs separated
+        by commas
+        """
+        text = bytes(payload).decode(encoding='utf-8', errors='replace')
+        try:
+            values = json.loads(text)
+            if not isinstance(values, dict):
+                raise ValueError
+        except ValueError:
+            values = {}
+            for pair in text.strip('[]{} \n').split(','):
+                key, sep, value = pair.partition('=')
+                if sep:
+                    values[key.strip()] = value.strip()
+        return {field: values[field] for field in fields if field in values}
+
+
+if __name__ == "__main__":
+    """
+    Prints the health records stored between two sim times, optionally only the given fields.
+    Usage: python telemetry.py START END [FIELD ...]
+    """
+    import sys
+
+    store = healthStore()
+    selected = sys.argv[3:] if len(sys.argv) > 3 else None
+    for record in store.query(float(sys.argv[1]), float(sys.argv[2]), fields=selected):
+        print(*record)
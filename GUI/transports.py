@@ -0,0 +1,368 @@
+import asyncio
+import selectors
+import socket
+from threading import Lock
+from interfaces import ERROR_FRAME, HOST
+
+# Largest read taken from a socket in one go by the selector transport
+RECV_SIZE = 65536
+# Pushed subscription frames are dropped for a client with more than this many bytes still waiting to be sent to it
+PUSH_BUFFER_LIMIT = 65536
+
+
+class asyncConnection:
+    """
+    Handle on one connection of the asyncio transport that other threads can push subscription frames through, the
+    write itself is handed to the event loop
+    """
+
+    def __init__(self, loop, writer):
+        self.loop = loop
+        self.writer = writer
+
+    def pushBuffers(self, buffers):
+        """
+        Queues frames to be written by the event loop, returns False and drops them if the client is falling behind
+        """
+        if self.writer.transport.get_write_buffer_size() > PUSH_BUFFER_LIMIT:
+            return False
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self.loop:
+            # Pushed by a lockstep step run from a request on the loop itself, written straight away so the pushes go
+            # out ahead of the request's reply
+            self.writer.writelines(buffers)
+        else:
+            self.loop.call_soon_threadsafe(self.writer.writelines, buffers)
+        return True
+
+
+class asyncTransport:
+    """
+    Serves the ports of many system interfaces from a single asyncio event loop running on one thread, instead of one
+    blocking socket thread per system. Each connection is handled by its own coroutine which reads length prefixed
+    frames, hands them to the interface's handle_frame and writes back the response frame.
+
+    Interfaces from several controllers can be added to the same transport, so thread count stays flat as more systems
+    or satellites are added.
+    """
+
+    def __init__(self, controller):
+        self.controller = controller
+        self.interfaces = []
+        self.loop = None
+        self.stop_event = None
+        # Set by stop, seen by serve if it is called before the event loop is ready
+        self.stopping = False
+        self.servers = []
+        # Handler task of every open connection and the interface it belongs to
+        self.clients = {}
+
+    def add_interface(self, interface):
+        """
+        Adds an interface to be served, can be called before or while the transport is running
+        """
+        self.interfaces.append(interface)
+        if self.loop is not None:
+            asyncio.run_coroutine_threadsafe(self.start_server(interface), self.loop)
+
+    def run(self, _):
+        """
+        Main function for the transport thread, runs the event loop until stop is called
+        """
+        print("Thread for asyncio transport running")
+        asyncio.run(self.serve())
+        print("Thread for asyncio transport closed")
+
+    def stop(self):
+        """
+        Stops the transport from any thread, all servers and connections are cancelled immediately
+        """
+        self.stopping = True
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.stop_event.set)
+
+    async def serve(self):
+        self.stop_event = asyncio.Event()
+        self.loop = asyncio.get_running_loop()
+
+        for interface in list(self.interfaces):
+            await self.start_server(interface)
+
+        if self.stopping:
+            # Stopped before the loop was ready for stop to reach it
+            self.stop_event.set()
+        await self.stop_event.wait()
+
+        for server in self.servers:
+            server.close()
+        for client in list(self.clients):
+            client.cancel()
+        await asyncio.gather(*self.clients, return_exceptions=True)
+        self.loop = None
+
+    async def start_server(self, interface):
+        # Address is used as port number, since it is the 'address' for the system in the simulator
+        server = await asyncio.start_server(lambda reader, writer: self.handle_client(interface, reader, writer),
+                                            HOST, interface.address)
+        self.servers.append(server)
+        print(f"Thread asyncio transport listening for {interface.system.name}")
+
+    async def handle_client(self, interface, reader, writer):
+        """
+        Handler coroutine for one connection, packets are length of message in 4 bytes + message
+        """
+        task = asyncio.current_task()
+        connection = asyncConnection(self.loop, writer)
+        self.clients[task] = interface
+        interface.connected = True
+        interface.stats.connection_opened()
+        print(f"Thread asyncio transport {interface.system.name} connection established")
+
+        try:
+            while True:
+                lengthBytes = await reader.readexactly(4)
+                msg = await reader.readexactly(int.from_bytes(lengthBytes, 'little'))
+
+                writer.writelines(interface.handle_frame(msg, connection))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            # Client closed the connection
+            print(f"Thread asyncio transport {interface.system.name} connection closed")
+        except asyncio.CancelledError:
+            # Transport stopping, end the handler quietly rather than leaving a cancelled task to be reported
+            pass
+        finally:
+            interface.drop_subscriptions(connection)
+            del self.clients[task]
+            interface.connected = interface in self.clients.values()
+            interface.stats.connection_closed()
+            writer.close()
+
+
+class selectorConnection:
+    """
+    State for one connection of the selector transport, with its own input and output buffers so frames can be parsed
+    and written a piece at a time
+    """
+
+    def __init__(self, conn, interface, transport):
+        self.conn = conn
+        self.interface = interface
+        self.transport = transport
+        self.inbuf = bytearray()
+        self.outbuf = bytearray()
+        self.events = selectors.EVENT_READ
+        # Held while using outbuf, subscription frames are pushed into it from the simulator thread
+        self.lock = Lock()
+
+    def pushBuffers(self, buffers):
+        """
+        Queues frames to be sent by the reactor and wakes it, returns False and drops them if the client is falling
+        behind
+        """
+        self.lock.acquire()
+        if len(self.outbuf) > PUSH_BUFFER_LIMIT:
+            self.lock.release()
+            return False
+        for buffer in buffers:
+            self.outbuf += buffer
+        self.lock.release()
+        self.transport.wake()
+        return True
+
+
+class selectorTransport:
+    """
+    Lightweight alternative to the asyncio transport for minimal CPUs. A single thread owns every listening socket and
+    uses selectors (epoll on Linux) to do non-blocking accept, recv and send. Frames are parsed incrementally from each
+    connection's buffer and handed to the interface's handle_frame, so no event loop machinery sits between the
+    socket and the system logic.
+    """
+
+    def __init__(self, controller):
+        self.controller = controller
+        self.interfaces = []
+        self.selector = None
+        self.connections = []
+        # Socket pair used to wake the select call when stopping, made when run so it is never left open
+        self.wakeup_recv = None
+        self.wakeup_send = None
+        self.stopping = False
+
+    def add_interface(self, interface):
+        """
+        Adds an interface to be served, must be called before the transport is run
+        """
+        self.interfaces.append(interface)
+
+    def stop(self):
+        """
+        Stops the transport from any thread, wakes the select call so the reactor closes straight away
+        """
+        self.stopping = True
+        self.wake()
+
+    def wake(self):
+        """
+        Wakes the select call from any thread, to see it has been stopped or frames pushed into connections
+        """
+        try:
+            self.wakeup_send.send(b'\0')
+        except (AttributeError, OSError):
+            # Not running yet, or already closed
+            pass
+
+    def run(self, _):
+        """
+        Main loop for the reactor thread, dispatches socket events until stop is called
+        """
+        print("Thread for selector transport running")
+        self.wakeup_recv, self.wakeup_send = socket.socketpair()
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.wakeup_recv, selectors.EVENT_READ, (None, None))
+
+        listeners = []
+        for interface in self.interfaces:
+            listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            # Lets the port be bound again straight after a restart, while old connections are still in TIME_WAIT
+            listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            # Address is used as port number, since it is the 'address' for the system in the simulator
+            listener.bind((HOST, interface.address))
+            listener.listen()
+            listener.setblocking(False)
+            self.selector.register(listener, selectors.EVENT_READ, (self.accept, interface))
+            listeners.append(listener)
+
+        while not self.stopping:
+            for key, mask in self.selector.select():
+                callback, data = key.data
+                if callback is None:
+                    # Woken to stop, loop condition will see it, or to send pushed frames
+                    self.wakeup_recv.recv(RECV_SIZE)
+                    for connection in self.connections:
+                        self.update_events(connection)
+                    continue
+                callback(key.fileobj, mask, data)
+
+        for connection in list(self.connections):
+            self.disconnect(connection)
+        for listener in listeners:
+            self.selector.unregister(listener)
+            listener.close()
+        self.selector.close()
+        self.wakeup_recv.close()
+        self.wakeup_send.close()
+        print("Thread for selector transport closed")
+
+    def accept(self, listener, mask, interface):
+        try:
+            conn, _ = listener.accept()
+        except BlockingIOError:
+            return
+        conn.setblocking(False)
+
+        connection = selectorConnection(conn, interface, self)
+        self.connections.append(connection)
+        self.selector.register(conn, connection.events, (self.service, connection))
+        interface.connected = True
+        interface.stats.connection_opened()
+        print(f"Thread selector transport {interface.system.name} connection established")
+
+    def disconnect(self, connection):
+        connection.interface.drop_subscriptions(connection)
+        self.selector.unregister(connection.conn)
+        connection.conn.close()
+        self.connections.remove(connection)
+        connection.interface.connected = any(other.interface is connection.interface for other in self.connections)
+        connection.interface.stats.connection_closed()
+        print(f"Thread selector transport {connection.interface.system.name} connection closed")
+
+    def service(self, conn, mask, connection):
+        """
+        Handles a readable or writable connection, reads whatever has arrived, handles every complete frame in the
+        buffer and sends as much of the queued output as the socket takes
+        """
+        if mask & selectors.EVENT_READ:
+            try:
+                data = conn.recv(RECV_SIZE)
+            except BlockingIOError:
+                data = None
+            except OSError:
+                data = b''
+            if data == b'':
+                # Client closed the connection
+                self.disconnect(connection)
+                return
+            if data:
+                connection.inbuf += data
+                self.parse_frames(connection)
+
+        connection.lock.acquire()
+        try:
+            if connection.outbuf:
+                sent = conn.send(connection.outbuf)
+                del connection.outbuf[:sent]
+        except BlockingIOError:
+            pass
+        except OSError:
+            connection.lock.release()
+            self.disconnect(connection)
+            return
+        connection.lock.release()
+
+        self.update_events(connection)
+
+    def update_events(self, connection):
+        """
+        Only asks to be told about writability while there is output waiting
+        """
+        events = selectors.EVENT_READ | (selectors.EVENT_WRITE if connection.outbuf else 0)
+        if events != connection.events:
+            connection.events = events
+            self.selector.modify(connection.conn, events, (self.service, connection))
+
+    def parse_frames(self, connection):
+        """
+        Handles every complete frame in the input buffer, packets are length of message in 4 bytes + message
+        """
+        inbuf = connection.inbuf
+        offset = 0
+        while len(inbuf) - offset >= 4:
+            length = int.from_bytes(inbuf[offset:offset + 4], 'little')
+            if len(inbuf) - offset - 4 < length:
+                # Rest of the frame has not arrived yet
+                break
+            msg = bytes(inbuf[offset + 4:offset + 4 + length])
+            offset += 4 + length
+
+            try:
+                buffers = connection.interface.handle_frame(msg, connection)
+            except Exception as e:
+                # Every port runs on this one thread, a bug in one command must not take them all down
+                print(f"Thread selector transport {connection.interface.system.name} failed handling frame: {e!r}")
+                buffers = [ERROR_FRAME]
+            connection.lock.acquire()
+            for buffer in buffers:
+                connection.outbuf += buffer
+            connection.lock.release()
+        del inbuf[:offset]
+
+
+# Transports that can be selected in the system registry, "lan" (the default) uses a thread per interface
+TRANSPORTS = {'asyncio': asyncTransport, 'selectors': selectorTransport}
+
+
+def make_transport(controller, registry):
+    """
+    Creates the shared transport the registry selects, None for a thread per interface. Raises ValueError for a
+    transport that does not exist rather than quietly serving the ports some other way.
+    """
+    transport = registry.get('transport', 'lan')
+    if transport == 'lan':
+        return None
+    if transport not in TRANSPORTS:
+        raise ValueError(f"Unknown transport \"{transport}\" in registry, expected lan or {' or '.join(TRANSPORTS)}")
+    return TRANSPORTS[transport](controller)